@@ -33,7 +33,9 @@
 #
 # Data Refresh
 # This program relies on the SNMP agent on each node. SNMP is hard coded for a 5 second refresh rate
-# which means this tool inherits this level of granularity.
+# which means this tool inherits this level of granularity. --interval 1 samples every second, lowering 
+# the nsCacheTimeout of the tables it reads through nsCacheTable where the agent allows the set. The
+# local node (/proc), gtop-agent nodes and nodes publishing the summary subtree aren't limited by it.
 #
 # References  	
 # https://net-snmp.svn.sourceforge.net/svnroot/net-snmp/trunk/net-snmp/python/README
@@ -54,6 +56,7 @@ import netsnmp
 import locale										# enabling curses display of unicode chars
 
 import traceback									# tracing exceptions
+import socket
 import datetime
 
 # modules and packages used for XML 
@@ -68,14 +71,26 @@ import re											# regex module used for whitelisting interface names
 from optparse   import OptionParser					# command line option parsing
 
 from multiprocessing import Process, Queue, current_process, Pipe, Manager
+from multiprocessing.managers import Namespace
 
 
 import syslog										# Used for pushing error msgs to the syslog
 
 import curses										# ncurses interface 
 
-from gtop_utils import convertBytes, issueCMD, oct2DateTime
-from gtop_iputils import SNMPsession, forwardDNS, reverseDNS, validIPv4
+from gtop_utils import convertBytes, issueCMD, oct2DateTime, QuantileSketch, termSize
+from gtop_iputils import SNMPsession, AsyncSNMP, forwardDNS, reverseDNS, validIPv4, resolveAddresses
+from gtop_export import Exporter
+from gtop_output import WRITERS, FIELDS, FIELDNAMES, BRICKFIELDS, BRICKFIELDNAMES, selectFields, RotatingFile
+from gtop_sink import MetricSink, SinkError
+from gtop_daemon import Publisher, DaemonFeed, DaemonError, applyNodeState, plainStr
+from gtop_heal import HealScanner
+from gtop_local import readCPU, readMemInfo, readNetDev, readDiskStats, physicalDisks, blockDevice, fsUsage, ifAddress, ifSpeed, ifLower, \
+						readProcesses, readTcpEstablished
+from gtop_profile import ProfileCollector
+from gtop_agent import AgentSender, AgentListener, AgentError
+from gtop_summary import PassPersist, decodeSummary, intervalOID
+from gtop_record import Recorder, Replay, RecordFile, RecordError, STATENAMES, unpackFlags, epoch2Dt, parseTime, selectTier
 
 
 
@@ -96,6 +111,11 @@ class GLUSTERvol:
 		self.usableSize = 0
 		self.usedSize = 0
 		self.freeSpace = 0
+		self.readRate = 0										# client reads/writes - bytes/sec
+		self.writeRate = 0
+		self.clients = 0										# most connections to any of it's bricks
+		self.healPending = None									# pending heals on the local bricks
+		self.healRate = 0										# heals/sec, negative when the backlog grows
 		self.graph =[]
 		#self.highlight = False
 			
@@ -123,15 +143,24 @@ class GLUSTERvol:
 						"Size " + str(xl.size) + " " + \
 						"Used " + str(xl.used)
 						
-	def formatVol(self):
-		"""	format volume data for display on the UI """
-		
-		volData = self.fmtdName.ljust(16) + "  " + \
-				str(self.numBricks).rjust(4) + "    " + \
-				volTypeShort[self.volType] + "   " + \
-				convertBytes(self.usableSize).rjust(5) + "  " + \
-				convertBytes(self.usedSize).rjust(5) + "   " + \
-				convertBytes(self.freeSpace).rjust(5)
+	def formatVol(self, view='volumes'):
+		"""	format volume data for display on the UI. The heal view shows the self-heal backlog of 
+			the local bricks in place of the throughput """
+		
+		volData = self.fmtdName.ljust(16) + " " + \
+				str(self.numBricks).rjust(3) + "  " + \
+				volTypeShort[self.volType].ljust(3) + " " + \
+				convertBytes(self.usableSize).rjust(5) + " " + \
+				convertBytes(self.usedSize).rjust(5) + " " + \
+				convertBytes(self.freeSpace).rjust(5) + "  "
+		
+		if view == 'heal':
+			pending = '-' if self.healPending is None else str(self.healPending)
+			volData += pending.rjust(8) + " " + str(int(round(self.healRate))).rjust(8)
+		else:
+			volData += convertBytes(self.readRate).rjust(5) + " " + \
+				convertBytes(self.writeRate).rjust(6) + " " + \
+				str(self.clients).rjust(4)
 								
 		if self.usableSize == 0:
 			pctUsed = 0
@@ -167,12 +196,18 @@ class GLUSTERvol:
 		still have entries there (remote-host field) referencing names; this routine attempts to use 
 		the current name (which would be IP based) to match against a brick which fails - result is 
 		the output shows 0b against all volumes!
+		
+		The read/write rates of the bricks (device I/O) are rolled up the same way, to give the
+		volume's client throughput. Every write to a replica set is written to each brick in the 
+		set, so a replica's write rate is that of one brick, not the sum. Reads are served by one
+		brick of the set, so they are summed. Bricks that share a device report the device's 
+		activity, so a volume sharing devices with other bricks will over report.
 		"""
 		self.rawSize = 0										# reset raw size to recalculate based
 																# on current observation
 																
-		for xl in self.graph:									# look at this volumes Xlators
-			
+		for xl in self.graph:									# look at this volumes Xlators, children 
+																# are listed before their parents
 			if xl.type == "Brick":								# if this Xlator is a brick just add
 				self.rawSize += xl.size						# to raw total of volume
 			
@@ -190,13 +225,20 @@ class GLUSTERvol:
 				xl.used = max(used)							# equal size, but taking the max incase any of the bricks 
 															# are offline at scan time.									
 				
+				xl.readRate = sum([brick.readRate for brick in xl.subvolumes])
+				xl.writeRate = max([brick.writeRate for brick in xl.subvolumes])
+				
 			elif xl.type == "Distributed" or xl.type == "Striped":
 
 					xl.size = 0								# reset the size/used, ready to recalculate
 					xl.used = 0								# from current child subvolumes
+					xl.readRate = 0
+					xl.writeRate = 0
 					for child in xl.subvolumes:
 						xl.size += child.size
 						xl.used += child.used
+						xl.readRate += child.readRate
+						xl.writeRate += child.writeRate
 		
 			else:
 				pass 
@@ -207,6 +249,11 @@ class GLUSTERvol:
 				self.usableSize = xl.size
 				self.usedSize   = xl.used
 				self.freeSpace = self.usableSize - self.usedSize
+				self.readRate = xl.readRate
+				self.writeRate = xl.writeRate
+		
+		# every client connects to each brick of the volume, so the busiest brick gives the client count
+		self.clients = max([xl.clients for xl in self.graph if xl.type == "Brick"] or [0])
 	
 
 		
@@ -220,10 +267,16 @@ class Xlator():
 		self.options = {}
 		self.size = 0
 		self.used = 0
+		self.readRate = 0
+		self.writeRate = 0
+		self.clients = 0
 				
 
 class Cluster:
 	
+	# aggregate metrics maintained by updateStats, in the same order as GLUSTERhost.reportMetrics
+	metrics = ('avgCPU', 'aggrNetIn', 'aggrNetOut', 'aggrDiskR', 'aggrDiskW')
+	
 	def __init__(self):
 		self.nodes = []						# list of peer node objects in the cluster
 		self.evictNodes=[]					# when nodes drop out of the main list catch them here for diagnostics
@@ -235,8 +288,15 @@ class Cluster:
 		self.volumes=[]						# list of volumes within the cluster
 		self.brickXref={}					# dict pointing a brick to the volume that owns it
 		self.brick2Xlator={}				# dict pointing a brick path to the relevant translator
+		self.volFiles={}					# volfile contents for each volume, by volume name
+		self.tickTime = None				# time of the current sample run (None = now)
+		self.agentTick = None				# when the last sample run of agent datagrams was made
+		self.agentSeen = {}					# host -> time it's last datagram was received
+		self.agentRcvd = set()				# hosts heard from since the last sample run
 		self.avgCPU = 0
 		self.peakCPU = 0
+		self.hotCore = 0								# busiest core in the cluster, and it's node
+		self.hotCoreNode = ''
 		self.aggrNetIn = 0
 		self.aggrNetOut = 0
 		self.aggrDiskR = 0
@@ -288,7 +348,7 @@ class Cluster:
 					if p[0] == 'hostname1':							# to build the server list
 						peers.append(p[1])
 			
-			peers.append(os.getenv('HOSTNAME').split('.')[0])		# Add this host to the list		
+			peers.append(os.getenv('HOSTNAME', socket.gethostname()).split('.')[0])		# Add this host to the list		
 			self.peerCount = len(peers)								
 			peersList = ",".join(peers)
 			self.validateServers(peersList)
@@ -303,11 +363,6 @@ class Cluster:
 			
 		"""
 		
-		types = {'cluster/distribute' : 'Distributed', 
-				'cluster/stripe' : 'Striped', 
-				'cluster/replicate' : 'Replicated', 
-				'protocol/client' : 'Brick'}
-		
 		#-----------------------------------------------------------------------------------
 		# build the volume objects from the volfiles
 		# output is 
@@ -316,76 +371,88 @@ class Cluster:
 		#-----------------------------------------------------------------------------------
 		for thisDir in os.listdir(volDir):
 			volFile = os.path.join(volDir,thisDir,thisDir + "-fuse.vol")
-			thisVol = GLUSTERvol(name=thisDir)
-			self.volumes.append(thisVol)
-			
-			stack =[]						# List to hold the translators found for this volume
-			layout = []						# list holding data layout XL types e.g. distributed
+			volText = open(volFile).read()
+			self.volFiles[thisDir] = volText				# kept so recordings can rebuild the volumes
+			self.addVolume(thisDir, volText.splitlines())
+	
+	def addVolume(self, volName, volLines):
+		"""	Build a volume object and it's translator graph from the lines of a volfile """
+		
+		types = {'cluster/distribute' : 'Distributed', 
+				'cluster/stripe' : 'Striped', 
+				'cluster/replicate' : 'Replicated', 
+				'protocol/client' : 'Brick'}
+		
+		thisVol = GLUSTERvol(name=volName)
+		self.volumes.append(thisVol)
+		
+		stack =[]						# List to hold the translators found for this volume
+		layout = []						# list holding data layout XL types e.g. distributed
+	
+		xl = None					
 		
-			xl = None					
+		for line in volLines:
+			words = line.split()
 			
-			for line in open(volFile):
-				words = line.split()
+			if not words: continue
+
+			if words[0] == 'volume':
+				xl = Xlator()
+				xl.volname = volName
+				xl.name = words[1]
 				
-				if not words: continue
-	
-				if words[0] == 'volume':
-					xl = Xlator()
-					xl.volname = thisDir
-					xl.name = words[1]
-					
-				elif words[0] == 'type':
+			elif words[0] == 'type':
+				
+				if words[1] in types.keys():
+					xl.type = types[words[1]]
 					
-					if words[1] in types.keys():
-						xl.type = types[words[1]]
-						
-						if xl.type == "Brick":					
-							thisVol.numBricks += 1				# increase the brick count 
+					if xl.type == "Brick":					
+						thisVol.numBricks += 1				# increase the brick count 
+
+					else:									# valid Xlator, so just add the type
+						if xl.type in layout:				# to layout list for propogation to 
+							pass							# owning volume object
+						else:	
+							layout.append(xl.type)
 	
-						else:									# valid Xlator, so just add the type
-							if xl.type in layout:				# to layout list for propogation to 
-								pass							# owning volume object
-							else:	
-								layout.append(xl.type)
-		
-				elif words[0] == 'option':
-					xl.options[words[1]] = words[2]
-					
-				elif words[0] == 'subvolumes':
-					xl.subvolumes = words[1:]
+			elif words[0] == 'option':
+				xl.options[words[1]] = words[2]
+				
+			elif words[0] == 'subvolumes':
+				xl.subvolumes = words[1:]
+				
+			elif words[0] == 'end-volume':
+				# only keep xlators that describe the volume layout
+				if xl.type in types.values():
 					
-				elif words[0] == 'end-volume':
-					# only keep xlators that describe the volume layout
-					if xl.type in types.values():
+					if xl.type == "Brick":
+						# Grab this translators hostname and filesystem name (brick)
+						thisHost = xl.options['remote-host']
+						thisPath = xl.options['remote-subvolume']
+															
+						ptr =  thisHost + ":" + thisPath		
 						
-						if xl.type == "Brick":
-							# Grab this translators hostname and filesystem name (brick)
-							thisHost = xl.options['remote-host']
-							thisPath = xl.options['remote-subvolume']
-																
-							ptr =  thisHost + ":" + thisPath		
-							
-							# the gCluster object maintains a list of bricks to translators
-							# used for file system size information tracking/calculations
-							self.brickXref[ptr] = thisVol
-							self.brick2Xlator[ptr] = xl				
-																
-						stack.append(xl)
-					xl = None
-	
-			# replace the subvolumes 'volname' by the xlator object
-			for xl in stack:
-				xl.subvolumes = [_xl for _xl in stack if _xl.name in xl.subvolumes]
-				for subvol in xl.subvolumes:
-					subvol.parent = xl
-		
-		
-			thisVol.graph = list(stack)
-			layout.reverse()								# Add the volume type description to the 
-			thisVol.volType = '-'.join(layout)				# volume object
-		
+						# the gCluster object maintains a list of bricks to translators
+						# used for file system size information tracking/calculations
+						self.brickXref[ptr] = thisVol
+						self.brick2Xlator[ptr] = xl				
+															
+					stack.append(xl)
+				xl = None
 
+		# replace the subvolumes 'volname' by the xlator object
+		for xl in stack:
+			xl.subvolumes = [_xl for _xl in stack if _xl.name in xl.subvolumes]
+			for subvol in xl.subvolumes:
+				subvol.parent = xl
+	
+	
+		thisVol.graph = list(stack)
+		layout.reverse()								# Add the volume type description to the 
+		thisVol.volType = '-'.join(layout)				# volume object
 	
+
+
 	def getVersion(self):
 		"""	Simple function to retrieve the version of gluster running on the node """
 		
@@ -404,6 +471,209 @@ class Cluster:
 			if node.state == 'connected':
 				self.activeNodes += 1
 			
+	def updateBricks(self,node):
+		"""	Apply a nodes brick information to the local xlator objects ready for roll-up into volume stats """
+		
+		for brickName in node.brickInfo:
+			xl = self.brick2Xlator.get(brickName)
+			if xl is None:
+				continue							# an agent's brick the volfiles here don't know about
+			xl.size = node.brickInfo[brickName][0]
+			xl.used = node.brickInfo[brickName][1]
+			xl.readRate, xl.writeRate = node.brickIO.get(brickName, [0, 0])[:2]
+			xl.clients = node.brickClients.get(brickName, 0)
+
+	def brickRows(self):
+		"""	Return (node, brick) for each brick, in node order, for the brick views """
+		
+		rows = []
+		for node in self.nodes:
+			prefix = node.hostName + ":"
+			rows.extend([(node, brick) for brick in sorted(self.brickXref) if brick.startswith(prefix)])
+		
+		return rows
+
+	def localBricks(self):
+		"""	Return {volume name: [brick paths]} for the bricks of each volume that are on this node """
+		
+		isLocal = {}
+		bricks = {}
+		for volume in self.volumes:
+			for xl in volume.graph:
+				if xl.type == "Brick":
+					host = xl.options.get('remote-host', '')
+					if host not in isLocal:
+						isLocal[host] = isLocalHost(host)
+					if isLocal[host]:
+						bricks.setdefault(volume.name, []).append(xl.options['remote-subvolume'])
+		
+		return bricks
+
+	def localNode(self):
+		"""	Return the name of the node gtop is running on, or '' when it's not one of the nodes """
+		
+		for node in self.nodes:
+			if isLocalHost(node.hostName):
+				return node.hostName
+		return ''
+
+	def peerAddresses(self):
+		"""	Return the IPv4 addresses the cluster's nodes are known by, which is the traffic gluster
+			generates between the peers (and from the clients using the same names) """
+		
+		addresses = []
+		for node in self.nodes:
+			addresses.extend(resolveAddresses(node.hostName))
+		
+		return sorted(set(addresses))
+
+	def nicRows(self):
+		"""	Return (node, nic) for each monitored interface, in node order, for the interface view """
+		
+		rows = []
+		for node in self.nodes:
+			rows.extend([(node, nic) for nic in node.nicStats])
+		
+		return rows
+
+	def daemonRows(self):
+		"""	Return (node, daemon) for each gluster related daemon, in node order, for the daemon view """
+		
+		rows = []
+		for node in self.nodes:
+			rows.extend([(node, daemon) for daemon in node.daemonStats])
+		
+		return rows
+
+	def loadRecording(self,rec):
+		"""	Build the cluster's nodes and volumes from the schema of a recording """
+		
+		for hostName in rec.hosts:
+			self.addHost(hostName=str(hostName))
+		
+		for volName, volText in rec.schema.get('volumes',{}).items():
+			self.addVolume(str(volName), plainStr(volText).splitlines())
+			
+		self.version = str(rec.schema.get('version',''))
+		self.peerCount = len(self.nodes)
+		self.hostMap = dict([(node.hostName,node) for node in self.nodes])
+		
+	def applySamples(self,rec,tickTime,nodeSamples,brickSamples):
+		"""	Apply the samples of a recorded tick to the nodes as if the data had been sent by the
+			worker processes. Consolidated samples (from a tier) apply the average values, with the
+			number of samples in the bucket and their max kept in sampleCount and samplePeaks """
+		
+		for sample in nodeSamples:
+			if sample[0] == 'H':
+				node = self.hostMap[rec.hosts[sample[3]]]
+				node.__dict__.update(unpackFlags(sample[2]))
+				node.timeStamp = epoch2Dt(sample[4])
+				values = sample[5:]
+				node.sampleCount = 1
+				node.samplePeaks = dict(zip(rec.metrics, values))
+			else:
+				node = self.hostMap[rec.hosts[sample[2]]]
+				values = sample[6::4]
+				node.sampleCount = sample[4]
+				node.samplePeaks = dict(zip(rec.metrics, sample[7::4]))
+				
+			node.state = STATENAMES.get(sample[1],'unknown')
+			for attr, value in zip(rec.metrics, values):
+				setattr(node, attr, int(value) if value == int(value) else value)
+			node.brickInfo = {}
+		
+		for sample in brickSamples:
+			brickName = str(rec.bricks[sample[1]])
+			node = self.hostMap.get(brickName.split(':')[0])
+			if node:
+				node.brickInfo[brickName] = list(sample[2:4]) if sample[0] == 'B' else list(sample[3:5])
+		
+		for node in self.nodes:
+			self.updateBricks(node)
+			
+		self.tickTime = tickTime
+		
+	def loadFeed(self,feed):
+		"""	Build the cluster's nodes and volumes from the description sent by gtopd """
+		
+		for hostName in feed.hosts:
+			self.addHost(hostName=hostName)
+			
+		for volName, volText in feed.hello.get('volumes',{}).items():
+			self.addVolume(str(volName), plainStr(volText).splitlines())
+			
+		self.version = str(feed.hello.get('version',''))
+		self.peerCount = feed.hello.get('peerCount',len(self.nodes))
+	
+	def applySnapshot(self,snapshot):
+		"""	Apply the node states from a gtopd snapshot. gtopd may be monitoring more nodes than
+			this viewer, so only the nodes we know about are updated """
+		
+		hostMap = dict([(node.hostName,node) for node in self.nodes])
+		
+		for state in snapshot['nodes']:
+			node = hostMap.get(state['hostName'])
+			if node:
+				applyNodeState(node, state)
+				self.updateBricks(node)
+				
+		self.tickTime = snapshot['tickTime']
+		
+	def applyAgents(self, listener):
+		"""	Apply the samples pushed by the gtop-agents, returning True when a sample run is complete -
+			every node has reported, or a refresh interval has passed. Nodes that haven't been heard
+			from for AGENTTIMEOUT seconds are reset to unknown, as a worker does when snmp fails """
+		
+		now = time.time()
+		if self.agentTick is None:
+			self.agentTick = now
+		
+		nodes = dict([(node.hostName, node) for node in self.nodes])
+		for hostName, state in listener.poll():
+			node = nodes[hostName]
+			applyNodeState(node, state)
+			self.updateBricks(node)
+			self.agentSeen[hostName] = now
+			self.agentRcvd.add(hostName)
+		
+		if len(self.agentRcvd) < len(self.nodes) and now - self.agentTick < refreshRate:
+			return False
+		
+		for node in self.nodes:
+			if now - self.agentSeen.get(node.hostName, self.agentTick) > AGENTTIMEOUT and node.state != 'unknown':
+				node.state = 'unknown'
+				node.reset()
+				self.updateBricks(node)
+		
+		self.agentRcvd.clear()
+		self.agentTick = now
+		self.tickTime = now
+		return True
+
+	def applyReplay(self,replay):
+		"""	Read the next tick from a recording, and apply it's samples to the nodes """
+		
+		tickTime, nodeSamples, brickSamples = replay.read()
+		self.applySamples(replay.rec, tickTime, nodeSamples, brickSamples)
+
+	def updateCapacity(self):
+		"""	Roll up the brick sizes into the volumes, and the volumes into the cluster capacity """
+		
+		raw = 0
+		usable = 0
+		used = 0 
+		for volume in self.volumes:
+			volume.updateVol()
+			raw += volume.rawSize
+			usable += volume.usableSize
+			used += volume.usedSize
+		
+		# Set the high level capacity information for the whole cluster	
+		self.rawCapacity = raw
+		self.usableCapacity = usable
+		self.usedCapacity = used
+		self.freeCapacity = usable - used
+
 	def updateStats(self):
 		"""	Process the nodes in the cluster, to create an aggregate view of the 
 			clusters throughput for display in the information window (top 3 lines 
@@ -423,6 +693,9 @@ class Cluster:
 			totalDiskR += node.blocksReadAvg
 			totalDiskW += node.blocksWriteAvg
 		
+		# Find the busiest single core in the cluster
+		gCluster.hotCore, gCluster.hotCoreNode = max([(node.coreMax, node.hostName) for node in gCluster.nodes if node.coreLoads] or [(0, '')])
+		
 		# Use the updated stats to derive averages and aggregates for the cluster	
 		if cpuStats:
 			
@@ -444,48 +717,22 @@ class Cluster:
 			
 		pass 
 	
-	def formatStats(self,prefix=""):
-		"""	Format the aggregate stats maintained in updateStats for display in batch mode """
-		
-		if FORMAT == "readable":
-			displayStats = prefix + " < ALL >".ljust(15) + " " \
-						+ "     " \
-						+ str(self.avgCPU).rjust(3) + " " \
-						+ "     " \
-						+ "     " \
-						+ "       " \
-						+ convertBytes(self.aggrNetIn).rjust(5) + "  " \
-						+ convertBytes(self.aggrNetOut).rjust(5) + "  " \
-						+ convertBytes(self.aggrDiskR*BLOCKSIZE).rjust(5) + "  " \
-						+ convertBytes(self.aggrDiskW*BLOCKSIZE).rjust(5)
-		else:
-			displayStats = prefix + ",<ALL>" + "," \
-						+ "," \
-						+ str(self.avgCPU) \
-						+ "," \
-						+ "," \
-						+ "," \
-						+ str(self.aggrNetIn) + "," \
-						+ str(self.aggrNetOut) + "," \
-						+ str(self.aggrDiskR*BLOCKSIZE) + "," \
-						+ str(self.aggrDiskW*BLOCKSIZE)
-#
-		return displayStats
-		
 	def SNMPcheck(self):
-		""" Try to do a high level snmpwalk to see if snmp is listening """
+		""" Ask each node for sysDescr to see if snmp is listening. The requests all go out together 
+			on one socket, so an unreachable node costs a single timeout rather than one per node """
 	
 		servers = list(self.nodes)							# Create a fresh copy of the list
 
+		client = AsyncSNMP(community=SNMPCOMMUNITY)
+		requests = [client.get(node.hostName, [SYSDESCR]) for node in servers]
+		client.wait(requests)
+		client.close()
 		
-		for node in servers:							# Process each server 
+		for node, request in zip(list(servers), requests):	# Process each server 
 			target = node.hostName
 			print "---> " + target + "",
-			s = SNMPsession(destHost=target,community=SNMPCOMMUNITY)
-			s.oid=netsnmp.Varbind('sysDescr')
-			validSNMP = s.query()						# Try a walk to see if SNMP responds
 			
-			if validSNMP:
+			if not request.error and request.varbinds and request.varbinds[0][1] is not None:
 				print "OK"
 			else:
 				print "not reachable over SNMP, dropping " + target + " from list"
@@ -494,6 +741,45 @@ class Cluster:
 		if len(servers) < len(self.nodes):				# if there has been a change, update the 
 			self.nodes = list(servers)					# cluster objects server list
 
+	def checkCaches(self, interval):
+		"""	Sampling faster than snmpd refreshes it's tables only repeats the cached values. For each node 
+			polled over snmp, lower the nsCacheTimeout of the tables gtop reads to the interval where the
+			agent allows it, returning a warning for each node whose data is still cached for longer """
+		
+		localNode = self.localNode() if LOCALPROC else ''
+		warnings = []
+		for node in self.nodes:
+			if node.hostName == localNode:
+				continue										# read from /proc, not snmp
+			
+			s = SNMPsession(destHost=node.hostName,community=SNMPCOMMUNITY)
+			
+			# nodes publishing the gtop summary are sampled by the helper, not from the caches
+			helperInterval = s.get([(intervalOID(GTOPSUMMARYOID), 0)])[0] if GTOPSUMMARYOID else None
+			if isinstance(helperInterval, (int, long)):
+				if helperInterval > interval:
+					warnings.append(node.hostName + " - gtop --pass-persist samples every " + str(helperInterval) + 
+									"s, add --interval " + str(interval) + " to it's pass_persist line")
+				continue
+			
+			timeouts = s.walk('nsCacheTimeout')
+			if not timeouts:
+				warnings.append(node.hostName + " - nsCacheTable isn't visible, it's data may be cached for several seconds")
+				continue
+			
+			cached = []
+			for iid, timeout in timeouts:
+				table = CACHEDTABLES.get(str(iid).strip('.'))
+				if table and isinstance(timeout, (int, long)) and timeout > interval:
+					if not s.set('nsCacheTimeout', iid, interval):
+						cached.append(table + " " + str(timeout) + "s")
+			
+			if cached:
+				warnings.append(node.hostName + " - the agent refused to lower it's cache timeouts (needs a write " +
+								"community), still cached: " + ", ".join(cached))
+		
+		return warnings
+
 	def dump(self):
 		"""	DEBUG routine to show what objects and attributes the cluster currently has """
 		
@@ -518,26 +804,133 @@ class Cluster:
 		
 
 def screenSize():
-	"""	Routine which uses stty to determine the size of the console window, Only used in
-		batch mode to trigger the headers to be re-displayed
+	"""	Return the size of the console window (rows, columns) """
 	
-		Requires - Linux stty command
-	"""
+	return termSize()
+
+
+def diskIOName(device, dmNames):
+	"""	Return the diskIOTable name for a device from dskTable e.g. /dev/sdb1 -> sdb1, and
+		/dev/mapper/vg-lv or /dev/vg/lv -> dm-N (using the /dev/mapper names from the host) """
 	
-	data = issueCMD('stty size')							# returns a single string "y x"
-	dimensions = data[0].split()							# split it up
-	y = int(dimensions[0])
-	x = int(dimensions[1])
+	name = os.path.basename(device)
+	
+	if device.startswith('/dev/mapper/'):
+		return dmNames.get(name, name)
+	
+	parts = device.split('/')
+	if len(parts) == 4 and parts[1] == 'dev':				# LVM /dev/vg/lv is /dev/mapper/vg-lv
+		mapperName = parts[2].replace('-','--') + '-' + parts[3].replace('-','--')
+		return dmNames.get(mapperName, name)
+	
+	return name
+
+
+# sysDescr.0, asked for by SNMPcheck
+SYSDESCR = '1.3.6.1.2.1.1.1.0'
+
+# seconds between snmpd's updates of the systemStats counters (not adjustable)
+SYSTEMSTATSINTERVAL = 5
+
+# nsCacheTable entries (by the cached table's OID) for the tables read every refresh
+CACHEDTABLES = {'1.3.6.1.2.1.2.2' : 'ifTable', '1.3.6.1.2.1.31.1.1' : 'ifXTable', 
+				'1.3.6.1.2.1.25.3.3' : 'hrProcessorTable', '1.3.6.1.2.1.25.2.3' : 'hrStorageTable',
+				'1.3.6.1.2.1.25.4.2' : 'hrSWRunTable', '1.3.6.1.2.1.25.5.1' : 'hrSWRunPerfTable',
+				'1.3.6.1.4.1.2021.13.15.1' : 'diskIOTable'}
+
+def isLocalHost(hostName):
+	"""	Is the given name/IP this host - by it's short name, or any address they share """
+	
+	localName = socket.gethostname()
+	localNames = [localName, localName.split('.')[0], os.getenv('HOSTNAME', localName).split('.')[0]]
+	if hostName.split('.')[0] in localNames:
+		return True
+	return bool(set(resolveAddresses(localName)) & set(resolveAddresses(hostName)))
+
+def connectionPort(iid, legacy=False):
+	"""	Return the local port from a tcpConnectionTable instance - addressType.length.address.port...
+		or for the older tcpConnTable (legacy) a.b.c.d.port... """
+	
+	parts = str(iid).split('.')
+	try:
+		if legacy:
+			return int(parts[4])
+		return int(parts[2 + int(parts[1])])
+	except (IndexError, ValueError):
+		return 0
+
 
-	return y,x
+def argValue(parms, option):
+	"""	Return the value following an option in a process's parameter string, or '' """
+	
+	words = parms.split()
+	if option in words[:-1]:
+		return words[words.index(option) + 1]
+	return ''
 
 
+def daemonLabel(name, parms, bricks):
+	"""	Identify a gluster related process from it's hrSWRunName and hrSWRunParameters, returning 
+		(daemon, detail) or None. A glusterfsd is matched to the brick it serves - the parameters are
+		truncated by the snmp agent, so when --brick-name is missing the brick is found from the 
+		volfile-id (volume.host.brick-path, with the path's / replaced by -) """
+	
+	if name == 'glusterfsd':
+		brickPath = argValue(parms, '--brick-name')
+		volFileId = argValue(parms, '--volfile-id')
+		for brick in sorted(bricks):
+			path = brick.split(':', 1)[1]
+			if path == brickPath or (volFileId and volFileId.endswith('.' + path.strip('/').replace('/', '-'))):
+				return ('glusterfsd', path)
+		return ('glusterfsd', brickPath or volFileId)
+	
+	if name == 'glusterfs':
+		if 'glustershd' in parms:
+			return ('glustershd', '')
+		if 'nfs' in parms:
+			return ('nfs', '')
+		return ('glusterfs', argValue(parms, '--volfile-id'))
+	
+	if 'gsyncd.py' in parms:
+		return ('gsyncd', '')
+	
+	if name in ('glusterd', 'ctdbd', 'smbd'):
+		return (name, '')
+	
+	return None
 
 
 class GLUSTERhost:
 	""" Class for gluster nodes, holding the hosts data and containing the methods
 		to populate and manage the data
 	"""
+	
+	# numeric attributes that describe a nodes sample, used when recording a session
+	metrics = ('procCount', 'cpuBusyPct', 'memTotal', 'memUsedPct', 'swapUsedPct',
+				'netInRate', 'netOutRate', 'blocksReadAvg', 'blocksWriteAvg')
+	
+	# activity metrics summarised by the report option
+	reportMetrics = ('cpuBusyPct', 'netInRate', 'netOutRate', 'blocksReadAvg', 'blocksWriteAvg')
+	
+	# UCD-DISKIO-MIB counters polled for the devices holding bricks, and the size of each counter
+	diskIOTags = ('diskIONReadX', 'diskIONWrittenX', 'diskIOReads', 'diskIOWrites')
+	diskIOWrap = (2**64, 2**64, 2**32, 2**32)
+	
+	# IF-MIB columns requested for each selected interface, and the size of the counters (ifHighSpeed
+	# is a gauge, so it's last and not differenced)
+	nicTags = ('ifHCInOctets', 'ifHCOutOctets', 'ifInErrors', 'ifOutErrors', 'ifInDiscards', 'ifHighSpeed')
+	nicWrap = (2**64, 2**64, 2**32, 2**32, 2**32)
+	
+	# scalars requested together in one get each refresh - memory (kB), the date, the raw cpu ticks and
+	# the block I/O counters of UCD-SNMP-MIB's systemStats
+	memTags = ('memTotalSwap', 'memAvailSwap', 'memTotalReal', 'memAvailReal')
+	cpuTags = ('ssCpuRawUser', 'ssCpuRawSystem', 'ssCpuRawWait', 'ssCpuRawIdle')
+	blockTags = ('ssIORawReceived', 'ssIORawSent')
+	scalarTags = memTags + ('hrSystemDate',) + cpuTags + blockTags
+	
+	# hrStorageTable columns requested for the filesystems holding bricks
+	storageTags = ('hrStorageAllocationUnits', 'hrStorageSize', 'hrStorageUsed')
+	
 	def __init__(self, hostName=None,state='unknown'):
 		# Need to audit the variable declarations, some may not be used..
 		
@@ -570,6 +963,10 @@ class GLUSTERhost:
 		self.cpuUserPct = 0
 		self.cpuIdlePct = 0
 		self.cpuBusyPct = 0						# Not USED
+		self.coreLoads = []						# hrProcessorLoad of each core
+		self.coreMax = 0						# busiest core %
+		self.coreSpread = 0						# busiest - idlest core %
+		self.coreSaturated = False				# a single core is above CORESATURATION
 		self.cpuSys = 0 
 		self.cpuUser = 0 
 		self.cpuIdle = 0
@@ -596,24 +993,39 @@ class GLUSTERhost:
 		self.lcpuWait = 0 
 		self.lblocksRead = 0					# used
 		self.lblocksWritten = 0 				# used
-		self.lnetIn = 0 						# used
-		self.lnetOut = 0						# used
+		self.lblocksTime = 0					# when the block counters last changed
+		self.lnicCounters = {}					# ifIndex -> last counters
+		self.lnicTime = 0						# when the interface counters were last read
 		self.ltotalChange = 0
-		self.nicList = []						# used
-		self.brickfsOffsets = []				# used
+		self.discovery = {}						# results of the one-off table walks e.g. 'nics' -> [[ifIndex, ifName]]
+		self.nicStats = []						# [name, Mbit/s, in bytes/s, out bytes/s, util %, errors/s, discards/s]
+		self.brickfsRows = []					# [hrStorageIndex, brick] of the brick filesystems
 		self.procCount = 0						# used
 		self.errMsg = ''
 		self.brickInfo = {}						# used, size[0] and used[1] info for each brick	
+		self.brickDevices = {}					# brick -> [device name, diskIOIndex]
+		self.nextDeviceMap = 0					# time of the next brick to device mapping, while any brick has no device
+		self.ldiskIO = {}						# diskIOIndex -> last diskIO counters
+		self.ldiskIOTime = 0					# when the diskIO counters were last read
+		self.brickIO = {}						# brick -> [read bytes/s, write bytes/s, read IOPS, write IOPS]
+		self.daemonCPU = {}						# hrSWRunIndex -> last hrSWRunPerfCPU (centi-seconds)
+		self.ldaemonTime = 0					# when the daemon cpu counters were last read
+		self.brickPorts = {}					# brick -> port it's glusterfsd listens on
+		self.brickClients = {}					# brick -> established tcp connections
+		self.nextConnScan = 0					# time of the next tcp connection table scan
+		self.daemonStats = []					# [daemon, detail, processes, cpu %, memory bytes]
 		self.ctdb = "."							# used
 		self.samba = "."						# used
 		self.nfs = "."							# used
 		self.selfHeal = "."						# used
 		self.georep = "."						# used
 		self.timeStamp = None					# used
+		self.sampleCount = 1					# samples in a recorded bucket (report)
+		self.samplePeaks = {}					# metric -> max in a recorded bucket (report)
 		
 		return 
 
-	def getData(self):
+	def getData(self, nameSpace):
 		
 		# Default is to assume snmp will work, and then turn off this state if 
 		# an error occurs
@@ -621,22 +1033,23 @@ class GLUSTERhost:
 		
 		s = SNMPsession(destHost=self.hostName,community=SNMPCOMMUNITY)
 		
+		# nodes running the gtop pass_persist helper publish the whole sample in one subtree
+		if self.getSummary(s):
+			return
+		
 		if self.procCount == 0:				# On 1st run, get the number of processors for this host
-			s.oid=netsnmp.Varbind('hrDeviceType')
 											# count hrDeviceProcessor occurances				
-			self.procCount = s.query().count('.1.3.6.1.2.1.25.3.1.3')
+			self.procCount = s.table(('hrDeviceType',)).columns['hrDeviceType'].count('.1.3.6.1.2.1.25.3.1.3')
 		
 		#------------------------------------------------------------------------------------------------------
-		# Get the memory usage stats from the server, and add to the memory stats
-		#------------------------------------------------------------------------------------------------------		
-		s.oid = netsnmp.Varbind('memory')
-		memInfo = s.query()
-		
-		if memInfo:										# if this is empty, host has stopped answering
-			self.swapTotal = memInfo[2]
-			self.swapAvail =  memInfo[3]
-			self.memTotal =  memInfo[4]
-			self.memAvail =  memInfo[5]
+		# The memory, date and systemStats scalars are fetched in a single get, by name, rather than walking
+		# the memory and systemStats groups and picking the values out by their position
+		#------------------------------------------------------------------------------------------------------
+		scalars = s.table(self.scalarTags, ['0'])
+		
+		memInfo = scalars.row('0', self.memTags)
+		if None not in memInfo:							# if this is empty, host has stopped answering
+			self.swapTotal, self.swapAvail, self.memTotal, self.memAvail = memInfo
 			self.swapUsedPct = 0 if int(self.swapTotal) == 0 else int(round((self.swapTotal - self.swapAvail)/float(self.swapTotal)*100))
 			self.memUsedPct = int(round((self.memTotal - self.memAvail)/float(self.memTotal)*100))
 		else:
@@ -647,12 +1060,9 @@ class GLUSTERhost:
 		#------------------------------------------------------------------------------------------------------
 		# Grab this systems current datetime 		
 		#------------------------------------------------------------------------------------------------------
-		s.oid = netsnmp.Varbind('hrSystemDate')
-		dateOct = s.query()										# SNMP returns this as an octet string
+		dateOct = scalars.value('hrSystemDate', '0')			# SNMP returns this as an octet string
 		if dateOct:
-			self.timeStamp = oct2DateTime(dateOct)
-			#syslog.syslog("sent data to main process for " + self.timeStamp)
-			#print self.timeStamp
+			self.timeStamp = oct2DateTime([dateOct])
 		else:
 			self.errMsg = "SNMP query for the datestamp - hrSystemDate - failed"
 			self.hostActive = False
@@ -660,81 +1070,42 @@ class GLUSTERhost:
 		
 
 		#------------------------------------------------------------------------------------------------------
-		# Process the systemStats table
+		# Process the systemStats counters
 		# NB. SNMP agent only polls every 5 seconds, current and lat have to be compared to calculate consumption
-		# SNMP data not that reliable for CPU info, so need to add try/except clauses
+		# SNMP data not that reliable for CPU info - a counter the agent doesn't have is None, and the
+		# difference from the last poll is used in it's place
 		#------------------------------------------------------------------------------------------------------
+		cpuTicks = scalars.row('0', self.cpuTags)
 		
-		s.oid = netsnmp.Varbind('systemStats')						# Grab the whole stats table
-		systemStats = s.query()		
-		
-		if systemStats:												# check we have data to process
-			
-			userDiff,sysDiff,waitDiff,idleDiff,totalDiff = 0,0,0,0,0
+		if [ticks for ticks in cpuTicks if ticks is not None]:	# check we have data to process
 			
-			if self.lcpuUser == 0:					# First run clause
-				self.lcpuUser = systemStats[11]
-			else:
-				
-				try:
-					userDiff = systemStats[11] - self.lcpuUser
-					if userDiff == 0:
-						userDiff = self.diffUser		# use value from last poll
-					else:
-						self.diffUser = userDiff
-					self.lcpuUser = systemStats[11]
-				except IndexError:
-					userDiff = self.diffUser
-					
-				
-			if self.lcpuSys == 0:
-				self.lcpuSys = systemStats[13]
-			else:
-				try:
-					sysDiff = systemStats[13] - self.lcpuSys
-					if sysDiff == 0:
-						sysDiff = self.diffSys		# use value from last poll
-					else:
-						self.diffSys = sysDiff
-					self.lcpuSys = systemStats[13]
-				except IndexError:
-					sysDiff = self.diffSys
-				
-				
-			if self.lcpuWait == 0:
-				self.lcpuWait = systemStats[15]
-			else:
-				
-				try:
-					waitDiff = systemStats[15] - self.lcpuWait
-					if waitDiff == 0:
-						waitDiff = self.diffWait		# use value from last poll
-					else:
-						self.diffWait = waitDiff
-					self.lcpuWait = systemStats[15]		
-				except IndexError:
-					waitDiff = self.diffWait
-	
-			if self.lcpuIdle == 0:
-				self.lcpuIdle = systemStats[14]
-			else:
-				try:
-					idleDiff = systemStats[14] - self.lcpuIdle
-					if idleDiff == 0:
-						idleDiff = self.diffIdle		# use value from last poll
+			diffs = []
+			for ticks, lastAttr, diffAttr in zip(cpuTicks, ('lcpuUser', 'lcpuSys', 'lcpuWait', 'lcpuIdle'),
+													('diffUser', 'diffSys', 'diffWait', 'diffIdle')):
+				if ticks is None:
+					diff = getattr(self, diffAttr)
+				elif getattr(self, lastAttr) == 0:			# First run clause
+					diff = 0
+					setattr(self, lastAttr, ticks)
+				else:
+					diff = ticks - getattr(self, lastAttr)
+					if diff == 0:
+						diff = getattr(self, diffAttr)		# use value from last poll
 					else:
-						self.diffIdle = idleDiff
-					self.lcpuIdle = systemStats[14]
-				except IndexError:
-					idleDiff = self.diffIdle
-					
+						setattr(self, diffAttr, diff)
+					setattr(self, lastAttr, ticks)
+				diffs.append(diff)
+			
+			userDiff, sysDiff, waitDiff, idleDiff = diffs
 			totalDiff = userDiff + sysDiff + waitDiff + idleDiff
 			
+			# systemStats is only refreshed every 5 seconds by the agent, so the share of the ticks is used
+			# rather than ticks per refresh - sampling more often would otherwise overstate the usage
 			if totalDiff > 0:						# Changes detected, updated counters
-				self.cpuUserPct = (userDiff / ((float(refreshRate) * 100) * self.procCount))*100
-				self.cpuSysPct = (sysDiff / ((float(refreshRate) * 100) * self.procCount))*100
-				self.cpuWaitPct = (waitDiff / ((float(refreshRate) * 100) * self.procCount))*100
-				self.cpuIdlePct = (idleDiff / ((float(refreshRate) * 100) * self.procCount))*100
+				self.cpuUserPct = (userDiff / float(totalDiff))*100
+				self.cpuSysPct = (sysDiff / float(totalDiff))*100
+				self.cpuWaitPct = (waitDiff / float(totalDiff))*100
+				self.cpuIdlePct = (idleDiff / float(totalDiff))*100
 				self.cpuBusyPct = int(self.cpuUserPct + self.cpuSysPct + self.cpuWaitPct)
 				
 				# After SNMP starts the numbers can be a little wierd. Catch them here and just reset to 0
@@ -744,26 +1115,26 @@ class GLUSTERhost:
 
 
 			#----------------------------------------------------------------------------------------
-			# Process high level IO stats ---> FIXME Add a try and except for IndexError
-			# SNMP block data is not available immediately
-			# takes about 30 secs for snmp agent to respond with so scans within this time frame, 
-			# will not populate list items 18 and 19 - which would trigger the IndexError exception
+			# Process high level IO stats
+			# SNMP block data is not available immediately - it takes about 30 secs for the snmp agent
+			# to provide ssIORawReceived/ssIORawSent, so scans within this time frame leave them None
 			#----------------------------------------------------------------------------------------		
-			if len(systemStats) >= 18:								
+			blocksRead, blocksWritten = scalars.row('0', self.blockTags)
+			if blocksRead is not None and blocksWritten is not None:
 			
+				# the counters move every SYSTEMSTATSINTERVAL, so the rate is taken over the time since they
+				# last changed, and held in between when sampling faster than that
+				now = time.time()
+				changed = (blocksRead != self.lblocksRead or blocksWritten != self.lblocksWritten)
 				if self.lblocksRead == 0:
-					self.lblocksRead= systemStats[19]
-				else:
-					blocksChanged = systemStats[19] - self.lblocksRead
-					self.lblocksRead = systemStats[19]
-					self.blocksReadAvg = blocksChanged / refreshRate
-					
-				if self.lblocksWritten == 0:
-					self.lblocksWritten = systemStats[18]
-				else:
-					blocksChanged = systemStats[18] - self.lblocksWritten
-					self.lblocksWritten = systemStats[18]
-					self.blocksWriteAvg = blocksChanged / refreshRate
+					self.lblocksRead, self.lblocksWritten = blocksRead, blocksWritten
+					self.lblocksTime = now
+				elif changed or now - self.lblocksTime >= SYSTEMSTATSINTERVAL + refreshRate:
+					elapsed = max(now - self.lblocksTime, refreshRate)
+					self.blocksReadAvg = (blocksRead - self.lblocksRead) / elapsed
+					self.blocksWriteAvg = (blocksWritten - self.lblocksWritten) / elapsed
+					self.lblocksRead, self.lblocksWritten = blocksRead, blocksWritten
+					self.lblocksTime = now
 
 				
 
@@ -772,6 +1143,22 @@ class GLUSTERhost:
 			self.hostActive = False
 			return													# Leave the getData thread
 		
+		#------------------------------------------------------------------------------------------------------
+		# Per core load (HOST-RESOURCES-MIB hrProcessorLoad). The systemStats figures are averaged across
+		# all the cores, so a brick process pinning a single core on a large node barely registers - the 
+		# load of each core shows that. The cores are found once, then requested together in one get
+		#------------------------------------------------------------------------------------------------------
+		if 'cpus' not in self.discovery:
+			self.discovery['cpus'] = s.table(('hrProcessorLoad',)).iids
+		
+		if self.discovery['cpus']:
+			coreLoads = s.table(('hrProcessorLoad',), self.discovery['cpus']).columns['hrProcessorLoad']
+			self.coreLoads = [load for load in coreLoads if load is not None]
+		if self.coreLoads:
+			self.coreMax = max(self.coreLoads)
+			self.coreSpread = self.coreMax - min(self.coreLoads)
+			self.coreSaturated = self.coreMax >= CORESATURATION
+		
 
 		#------------------------------------------------------------------------------------------------------
 		# Process the network stats data and add to this gluster host
@@ -784,93 +1171,137 @@ class GLUSTERhost:
 		# if the stats look like they have wholes in (0b), when there should have been load, use the snmpset on 
 		# each node (could at this to the snmpd startup preferably the rc.local file
 		#------------------------------------------------------------------------------------------------------
-		if not self.nicList:								# Only run this the first time a host is polled 
-															# to get a list of NICs to use for the aggregation
-			s.oid = netsnmp.Varbind('ifName')				# Query ifName table, then look for phys interfaces 
-			interfaces = s.query()							# we want to use based on the whiteList global var
-			ctr = 0
-			for ifname in interfaces:
-				if re.match(whiteList,ifname):
-					self.nicList.append(ctr)
-				ctr += 1	
-		
-		# Use 64bit network counters. -ve values will occur when the difference between current is at the start
-		# of the 64 range, and last reading was at the end. This is caught and corrected
-		s.oid = netsnmp.Varbind('ifHCInOctets')
-		netInData = s.query()
-		if netInData:
-				
-			netIn = sum([netInData[idx] for idx in self.nicList])
-				
-			if self.lnetIn == 0:
-				self.lnetIn = netIn
-				self.netInRate = 0
-			else:
-				
-				if netIn > self.lnetIn:
-					bytesChanged = netIn - self.lnetIn
-				else: 
-
-					# bytesChanged = (4294967296 - self.lnetIn) + netIn		# for counter32 variant
-					bytesChanged = (18446744073709600000 - self.lnetIn) + netIn
-					
-				self.lnetIn = netIn
-				self.netInRate = bytesChanged / float(refreshRate)
-		else:
-			self.errMsg = "ERR: snmp query for memory net in data failed"
+		if 'nics' not in self.discovery:					# Only run this the first time a host is polled 
+			self.discoverNics(s, nameSpace.peerAddresses)
+			if not self.discovery['nics']:
+				self.errMsg = "ERR: snmp query for the interface names failed"
+				self.hostActive = False
+				return
+		nicList = self.discovery['nics']
+		
+		# Fetch the counters for the selected interfaces in a single get, rather than walking each
+		# column of the ifTable/ifXTable. 64bit (HC) octet counters are used, and the difference is
+		# taken modulo the counter size to cope with the counter wrapping. Rates are over the measured
+		# time between the gets, not the nominal refresh interval
+		nicCounters = s.table(self.nicTags, [ifIndex for ifIndex, name in nicList])
+		if not [speed for speed in nicCounters.columns['ifHighSpeed'] if speed is not None]:
+			self.errMsg = "ERR: snmp query for the network counters failed"
 			self.hostActive = False
 			return													# Leave the getData thread
-			
-		# Using 64bit High capacity (HC) network counters - as above
-		s.oid = netsnmp.Varbind('ifHCOutOctets')
-		netOutData = s.query()
-		if netOutData:
 		
-			netOut = sum([netOutData[idx] for idx in self.nicList])
+		sampleTime = time.time()
+		elapsed = sampleTime - self.lnicTime if self.lnicTime else 0
+		self.lnicTime = sampleTime
+		
+		nicStats = []
+		for ifIndex, name in nicList:
+			counters = nicCounters.row(ifIndex, self.nicTags)
+			if None in counters:
+				continue									# interface has gone away
 			
-			if self.lnetOut == 0:
-				self.lnetOut = netOut
-				self.netOutRate = 0
+			speed = counters[-1]									# ifHighSpeed, Mbit/s
+			last = self.lnicCounters.get(ifIndex)
+			self.lnicCounters[ifIndex] = counters[:-1]
+			if last and elapsed > 0:
+				inRate, outRate, inErrs, outErrs, inDiscards = [((now - prev) % wrap) / elapsed 
+											for now, prev, wrap in zip(counters, last, self.nicWrap)]
 			else:
-				
-				if netOut > self.lnetOut:
-					bytesChanged = netOut - self.lnetOut
-				else:
-					bytesChanged = (18446744073709600000 - self.lnetOut) + netOut
-					
-				self.lnetOut = netOut
-				self.netOutRate = bytesChanged / float(refreshRate)
-		else:
-			self.errMsg = "ERR: snmp query for net out data failed"
-			self.hostActive = False
-			return
+				inRate, outRate, inErrs, outErrs, inDiscards = 0, 0, 0, 0, 0
+			
+			utilPct = int(max(inRate, outRate) * 8 * 100 / (speed * 1000000.0)) if speed else 0
+			nicStats.append([name, speed, inRate, outRate, utilPct, inErrs + outErrs, inDiscards])
+		
+		self.nicStats = nicStats
+		self.netInRate = sum([nic[2] for nic in nicStats])
+		self.netOutRate = sum([nic[3] for nic in nicStats])
 
  
 
+	def getSummary(self, s):
+		"""	Fetch the sample from the gtop summary subtree (gtop --pass-persist on the node) with a 
+			single GETBULK, returning True when it's been used. Nodes without the subtree, or whose helper
+			has gone away since, are found by the first poll the agent answers, and polled through the 
+			host resource tables from then on """
+		
+		if not GTOPSUMMARYOID or self.discovery.get('summary') is False:
+			return False
+		
+		pairs = s.subtree(GTOPSUMMARYOID)
+		if pairs == []:
+			self.discovery['summary'] = False				# the agent answered from outside the subtree
+			return False
+		
+		state = decodeSummary(pairs, self.hostName) if pairs else None
+		if 'summary' not in self.discovery and state is not None:
+			self.discovery['summary'] = True
+		
+		if not self.discovery.get('summary'):
+			return False								# not known yet when the request timed out
+		
+		if state is None:
+			self.errMsg = "snmp query for the gtop summary subtree failed"
+			self.hostActive = False
+		else:
+			applyNodeState(self, state)
+		return True
+
+	def discoverNics(self, s, peerAddresses):
+		"""	Choose the interfaces to monitor. The interfaces holding the addresses the peers are known
+			by (ipAddrTable) carry the gluster traffic, so they're used when there's a match. Otherwise
+			any interface with a non-loopback address is used, falling back to the interface name 
+			whiteList. ifStackTable is then used to drop interfaces that sit below another chosen 
+			interface (bond/team members, the parent of a vlan), so traffic isn't counted twice """
+		
+		# ifName is indexed by ifIndex, and ipAddrTable by the address itself, so the rows are matched
+		# by instance rather than by their position in separately walked columns
+		interfaces = s.table(['ifName'])
+		addresses = s.table(['ipAdEntIfIndex'])
+		
+		self.discovery['nics'] = []
+		ifNames = dict([(int(iid), name) for iid, name in zip(interfaces.iids, interfaces.columns['ifName']) 
+							if iid.isdigit() and name is not None])
+		if not ifNames:
+			return
+		
+		addrIndexes = [(addr, ifIndex) for addr, ifIndex in zip(addresses.iids, addresses.columns['ipAdEntIfIndex']) 
+							if ifIndex is not None]
+		
+		chosen = set([ifIndex for addr, ifIndex in addrIndexes if addr in peerAddresses])
+		if not chosen:
+			chosen = set([ifIndex for addr, ifIndex in addrIndexes if not addr.startswith('127.')])
+		if not chosen:
+			chosen = set([ifIndex for ifIndex, name in ifNames.items() if re.match(whiteList, name)])
+		
+		# ifStackStatus is indexed by <higher ifIndex>.<lower ifIndex>, 0 meaning nothing above/below
+		below = {}
+		for iid, status in s.walk('ifStackStatus'):
+			higher, sep, lower = str(iid).partition('.')
+			if higher.isdigit() and lower.isdigit() and int(higher) and int(lower):
+				below.setdefault(int(higher), []).append(int(lower))
+		
+		lower = set()
+		todo = list(chosen)
+		while todo:
+			for ifIndex in below.get(todo.pop(), []):
+				if ifIndex not in lower:
+					lower.add(ifIndex)
+					todo.append(ifIndex)
+		
+		self.discovery['nics'] = [[ifIndex, ifNames[ifIndex]] for ifIndex in sorted(chosen - lower) if ifIndex in ifNames]
+		
 	def getState(self):
 		""" Find out whether key gluster processes are active. 
 
 		"""
+		if self.discovery.get('summary'):
+			return												# already in the summary
+		
 		#print "getting state information"
 		s = SNMPsession(destHost=self.hostName,community=SNMPCOMMUNITY)
-		s.oid = netsnmp.Varbind('hrSWRunName')					# .1.3.6.1.2.1.25.4.2.1.2
-		processList = s.query()
+		processes = s.walk('hrSWRunName')						# .1.3.6.1.2.1.25.4.2.1.2
+		processList = [name for index, name in processes]
 		
-		if processList:
-			if 'glusterd' in processList:
-				self.state = 'connected'
-			else:
-				self.state = 'disconnected'
-			if 'ctdbd' in processList:
-				self.ctdb = 'Y'
-			else:
-				self.ctdb = '.'
-			if 'smbd' in processList:
-				self.samba = 'Y'
-			else:
-				self.samba = '.'
-				
-		else:
+		if not processList:
 			self.errMsg = "query for process list bombed"
 			self.hostActive = False
 			return 
@@ -878,181 +1309,542 @@ class GLUSTERhost:
 		# query of the hrSWRunName gives us the name of the process, but to look
 		# for gluster nfs and gluster self heal pids we need the hrSWRunParameters
 		
-		s.oid = netsnmp.Varbind('hrSWRunParameters')			# .1.3.6.1.2.1.25.4.2.1.5
-		paramList = s.query()
+		params = dict(s.walk('hrSWRunParameters'))				# .1.3.6.1.2.1.25.4.2.1.5
+		
+		if not params:
+			self.errMsg = "query for param list from process table failed"
+			self.hostActive = False
+			return
+		
+		daemons = self.processState(processes, params)
+		
+		# the cpu and memory usage of the gluster related processes is requested directly by their hrSWRunIndex
+		indexes = sorted(daemons)
+		values = s.get([(tag, index) for index in indexes for tag in ('hrSWRunPerfCPU', 'hrSWRunPerfMem')]) if indexes else []
+		usage = {}
+		for n, index in enumerate(indexes):
+			cpu, mem = values[n * 2:n * 2 + 2]
+			if isinstance(cpu, (int, long)) and isinstance(mem, (int, long)):
+				usage[index] = (cpu, mem)					# otherwise the process has exited
+		
+		self.daemonPerf(daemons, usage)
+	
+	def processState(self, processes, params):
+		"""	Set the node state and daemon flags from the process table - [(index, name)] and 
+			{index : parameters} - returning {index : (daemon, detail)} for the gluster related processes """
+		
+		processList = [name for index, name in processes]
+		
+		if 'glusterd' in processList:
+			self.state = 'connected'
+		else:
+			self.state = 'disconnected'
+		if 'ctdbd' in processList:
+			self.ctdb = 'Y'
+		else:
+			self.ctdb = '.'
+		if 'smbd' in processList:
+			self.samba = 'Y'
+		else:
+			self.samba = '.'
 		
 		self.nfs = "."
 		self.selfHeal = "."
 		self.georep = "."
 		
-		if paramList:	
+		# Look at the list of param's for all the processes
+		for parm in params.values():
 
-			# Look at the list of param's for all the processes
-			for parm in paramList:
-
-				# Ignore items that are not string objects
-				if isinstance(parm, basestring):
+			# Ignore items that are not string objects
+			if isinstance(parm, basestring):
+				
+				if parm[:2] in ["-f", "-s"]:
 					
-					if parm[:2] in ["-f", "-s"]:
-						
-						if "nfs" in parm:
-							self.nfs = "Y"
-						elif "glustershd" in parm:
-							self.selfHeal = "Y"
-					elif "gsyncd.py" in parm:
-							self.georep = "Y"
-							
-		else:
-			
-			self.errMsg = "query for param list from process table failed"
-			self.hostActive = False
-			return
-	
+					if "nfs" in parm:
+						self.nfs = "Y"
+					elif "glustershd" in parm:
+						self.selfHeal = "Y"
+				elif "gsyncd.py" in parm:
+						self.georep = "Y"
+		
+		# Keep the index of the gluster related processes, so their cpu and memory usage 
+		# can be found
+		daemons = {}
+		for index, name in processes:
+			parms = str(params.get(index, ''))
+			label = daemonLabel(str(name), parms, self.brickInfo)
+			if label:
+				daemons[index] = label
+				
+				# the brick's port, from --brick-port or the server xlator's listen-port option
+				brick = self.hostName + ":" + label[1]
+				port = argValue(parms, '--brick-port') or ''.join(re.findall(r'listen-port=(\d+)', parms)[:1])
+				if label[0] == 'glusterfsd' and brick in self.brickInfo and port.isdigit():
+					self.brickPorts[brick] = int(port)
+		
+		return daemons
 	
+	def getClientConnections(self):
+		"""	Count the established tcp connections to each brick's port. The connection table can be
+			large on a busy node, so it's only scanned every CONNINTERVAL seconds, a page at a time, 
+			counting as it goes rather than keeping the table. Agents without tcpConnectionTable 
+			(RFC 4022) fall back to the IPv4 only tcpConnTable """
+		
+		if self.discovery.get('summary') or not self.brickPorts or time.time() < self.nextConnScan:
+			return
+		self.nextConnScan = time.time() + CONNINTERVAL
+		
+		s = SNMPsession(destHost=self.hostName,community=SNMPCOMMUNITY)
+		ports = dict([(port, brick) for brick, port in self.brickPorts.items()])
+		counts = dict([(brick, 0) for brick in self.brickPorts])
+		
+		for tag, legacy in (('tcpConnectionState', False), ('tcpConnState', True)):
+			rows = 0
+			for iid, state in s.iterate(tag):
+				rows += 1
+				if state == 5:											# established
+					port = connectionPort(iid, legacy)
+					if port in ports:
+						counts[ports[port]] += 1
+			if rows:
+				break
+		
+		self.brickClients = counts
+	
+	def daemonPerf(self, daemons, usage):
+		"""	Total the cpu and memory of the gluster related processes for each daemon (smbd forks a 
+			process per client for example), from {index : (cpu centi-seconds, memory kB)}. CPU % is
+			relative to a single core, like top, over the measured time since the last sample """
+		
+		sampleTime = time.time()
+		elapsed = sampleTime - self.ldaemonTime if self.ldaemonTime else 0
+		self.ldaemonTime = sampleTime
+		
+		totals = {}
+		lastCPU = self.daemonCPU
+		self.daemonCPU = {}
+		for index, (cpu, mem) in usage.items():
+			if index not in daemons:
+				continue
+			
+			self.daemonCPU[index] = cpu
+			cpuPct = (cpu - lastCPU[index]) / elapsed if elapsed > 0 and cpu >= lastCPU.get(index, cpu + 1) else 0
+			
+			stats = totals.setdefault(daemons[index], [0, 0, 0])
+			stats[0] += 1
+			stats[1] += cpuPct
+			stats[2] += mem * 1024
+		
+		self.daemonStats = [[daemon, detail, count, int(round(cpuPct)), mem] 
+								for (daemon, detail), (count, cpuPct, mem) in sorted(totals.items())]
 	
 	def getDiskInfo(self, nameSpace):
 		"""	Use SNMP to get the current usage across mounted filesystems """
+		
+		if self.discovery.get('summary'):
+			return
 	
 		s = SNMPsession(destHost=self.hostName,community=SNMPCOMMUNITY)	
-																# first time through look through the filesystem
-		if not self.brickfsOffsets:								# descriptions, and if any match our bricks
-																# record the offset in the brickfsOffset list
+		
+		# first time through look through the filesystem descriptions, and if any match our bricks record
+		# the hrStorageIndex of the row. Only those rows are requested from then on
+		if not self.brickfsRows:
 			
-			s.oid = netsnmp.Varbind('hrStorageDescr') 			# .1.3.6.1.2.1.25.2.3.1.3
-			filesystems = s.query()
+			filesystems = s.table(('hrStorageDescr',)) 			# .1.3.6.1.2.1.25.2.3.1.3
 			
 			if filesystems:
-				
-				# Start at the end of the list and work backwards. Going forwards is problematic since
-				# some systems don't report descr/size/used in sync. For example, in F17 descr and size
-				# provide a field for Shared Memory, but used does not so using an index that starts at 
-				# the beginning results in index out of range conditions.
-				ctr = -1
-				for fs in reversed(filesystems):
-					ptr = self.hostName + ":" + fs
+				for iid, fs in zip(filesystems.iids, filesystems.columns['hrStorageDescr']):
+					ptr = self.hostName + ":" + str(fs)
 
 					if nameSpace.gCluster.brickXref.has_key(ptr):
-						self.brickfsOffsets.append([ctr,ptr])
+						self.brickfsRows.append([iid,ptr])
 
 						self.brickInfo[ptr]=[0,0]
-					ctr +=-1
 			else:
 				self.errMsg = "query to filesystems descr failed"
 				self.hostActive = False
 				return
 				
-		#print "diskinfo has found " + str(len(self.brickfsOffsets)) + " matching bricks"		# DEBUG
+		if not self.brickfsRows:
+			return
 		
+		# hrStorageSize/hrStorageUsed are in allocation units (usually 4k) - multiplying by 
+		# hrStorageAllocationUnits gives bytes
+		storage = s.table(self.storageTags, [iid for iid, ptr in self.brickfsRows])
 		
+		for iid, ptr in self.brickfsRows:
+			units, size, used = storage.row(iid, self.storageTags)
+			if size is None or used is None:
+				self.errMsg = "query for filesystem size/used data failed"
+				self.hostActive = False
+				return 
+			
+			self.brickInfo[ptr] = [size * (units or 4096), used * (units or 4096)]
 
-		s.oid = netsnmp.Varbind('hrStorageSize')				# .1.3.6.1.2.1.25.2.3.1.5
-																
-		sizeData = s.query()
-
-		if sizeData:
-			for ctr,ptr in self.brickfsOffsets:
 		
-
-				#if ctr <= len(sizeData):
-
-				# The sizes returned by the query are in allocation units, which is 4k 
-				# so by multipling by 4096 gives bytes
-				self.brickInfo[ptr][0] = int(sizeData[ctr]) * 4096	
-																
-		else:
-			self.errMsg = "query for filesystem size data failed"
-			self.hostActive = False
-			return 
+	
+	def unmappedBricks(self):
+		"""	Return the bricks that haven't been matched to their device yet """
 		
+		return [brick for brick in self.brickInfo if brick not in self.brickDevices]
+	
+	def mapBrickDevices(self, s):
+		"""	Find the diskIOTable row for the device holding each brick. UCD-SNMP-MIB's dskTable 
+			(includeAllDisks in snmpd.conf) gives the device for each mount point, and the gtopdm
+			extend gives the kernel names (dm-N) of device-mapper devices """
 		
-		s.oid = netsnmp.Varbind('hrStorageUsed')				# .1.3.6.1.2.1.25.2.3.1.6
-		usedData = s.query()
+		# dskTable rows are keyed by dskIndex and diskIOTable rows by diskIOIndex, so a disk missing
+		# from one column can't pair a path with the wrong device
+		disks = s.table(['dskPath', 'dskDevice'])
+		diskIO = s.table(['diskIODevice'])
 		
-		if usedData:
-			for ctr,ptr in self.brickfsOffsets:
-
-				#if ctr<= len(usedData):
-				self.brickInfo[ptr][1] = int(usedData[ctr]) * 4096
-					
-
-		else:
-			self.hostActive = False
-			self.errMsg = "query for filesystem used failed"
-			return 
-
+		if not (disks and diskIO):
+			return
 		
-	
-	def formatData(self,prefix=""):
-		"""	Function to format a hosts statistics ready for display to the UI or stdout """
+		# ls -l /dev/mapper output e.g. "lrwxrwxrwx. 1 root root 7 Oct 19 12:00 rhs_vg-brick1 -> ../dm-3"
+		dmNames = {}
+		for line in s.table(['nsExtendOutLine']).columns['nsExtendOutLine']:
+			words = str(line).split()
+			if len(words) > 2 and words[-2] == '->':
+				dmNames[words[-3]] = os.path.basename(words[-1])
+		
+		for iid in disks.iids:
+			path, device = disks.row(iid, ['dskPath', 'dskDevice'])
+			brick = self.hostName + ":" + str(path)
+			if path is None or device is None or brick not in self.brickInfo:
+				continue
+			
+			name = diskIOName(device, dmNames)
+			ioIndex = diskIO.find('diskIODevice', name)
+			if ioIndex is not None and ioIndex.isdigit():
+				self.brickDevices[brick] = [name, int(ioIndex)]
 		
-
-		if interactiveMode:
-
-			displayStats = nodeStatus[self.state].encode('utf-8') + " " + self.fmtdName + " " \
-						+ str(self.procCount).rjust(3) + "  " \
-						+ str(self.cpuBusyPct).rjust(3) + " "  \
-						+ convertBytes((self.memTotal*1024)).rjust(5) + "  " \
-						+ str(self.memUsedPct).rjust(3) + " " \
-						+ str(self.swapUsedPct).rjust(3) + "  " \
-						+ self.ctdb + " " \
-						+ self.samba + " " \
-						+ self.nfs + " " \
-						+ self.selfHeal + " " \
-						+ self.georep + "  " \
-						+ convertBytes(self.netInRate).rjust(5) + " " \
-						+ convertBytes(self.netOutRate).rjust(5) + "  " \
-						+ convertBytes(self.blocksReadAvg*BLOCKSIZE).rjust(5) + "  " \
-						+ convertBytes(self.blocksWriteAvg*BLOCKSIZE).rjust(5) + "  "
-						
-		else:
-			if FORMAT == 'readable':
-				displayStats = prefix + " " + self.fmtdName + " " \
-							+ str(self.procCount).rjust(3) + " " \
-							+ str(self.cpuBusyPct).rjust(3) + " "  \
-							+ convertBytes((self.memTotal*1024)).rjust(5) + "  " \
-							+ str(self.memUsedPct).rjust(3) + "  " \
-							+ str(self.swapUsedPct).rjust(3) + "  " \
-							+ convertBytes(self.netInRate).rjust(5) + "  " \
-							+ convertBytes(self.netOutRate).rjust(5) + "  " \
-							+ convertBytes(self.blocksReadAvg*BLOCKSIZE).rjust(5) + "  " \
-							+ convertBytes(self.blocksWriteAvg*BLOCKSIZE).rjust(5)
+	def getBrickIO(self):
+		"""	Use UCD-DISKIO-MIB to get the throughput and IOPS of the devices holding this hosts bricks.
+			Only the counters of those devices are requested, in a single get """
+		
+		if not self.brickInfo or self.discovery.get('summary'):
+			return
+			
+		s = SNMPsession(destHost=self.hostName,community=SNMPCOMMUNITY)
+		
+		# a dropped reply to the table walks shouldn't leave the bricks unmapped for good, so any
+		# brick without a device is tried again every CONNINTERVAL
+		if self.unmappedBricks() and time.time() >= self.nextDeviceMap:
+			self.nextDeviceMap = time.time() + CONNINTERVAL
+			self.mapBrickDevices(s)
+			
+		if not self.brickDevices:
+			return
+		
+		devices = sorted(set([idx for device, idx in self.brickDevices.values()]))
+		values = s.get([(tag, idx) for idx in devices for tag in self.diskIOTags])
+		
+		if len(values) != len(devices) * len(self.diskIOTags):
+			return												# leave the brick I/O as it was
+		
+		sampleTime = time.time()
+		elapsed = sampleTime - self.ldiskIOTime if self.ldiskIOTime else 0
+		self.ldiskIOTime = sampleTime
+		
+		diskIO = {}
+		for n, idx in enumerate(devices):
+			counters = values[n * len(self.diskIOTags):(n + 1) * len(self.diskIOTags)]
+			if [value for value in counters if not isinstance(value, (int, long))]:
+				continue									# device (diskIOTable row) has gone away
+			
+			last = self.ldiskIO.get(idx)
+			self.ldiskIO[idx] = counters
+			if last and elapsed > 0:
+				diskIO[idx] = [((now - prev) % wrap) / elapsed 
+								for now, prev, wrap in zip(counters, last, self.diskIOWrap)]
 			else:
-				displayStats = prefix + "," + self.hostName + "," \
-							+ str(self.procCount) + "," \
-							+ str(self.cpuBusyPct) + ","  \
-							+ str(self.memTotal*1024) + "," \
-							+ str(self.memUsedPct) + "," \
-							+ str(self.swapUsedPct) + "," \
-							+ str(self.netInRate) + "," \
-							+ str(self.netOutRate) + "," \
-							+ str(self.blocksReadAvg*BLOCKSIZE) + "," \
-							+ str(self.blocksWriteAvg*BLOCKSIZE)
+				diskIO[idx] = [0, 0, 0, 0]
+				
+		# bricks sharing a device report the same device activity
+		for brick, (device, idx) in self.brickDevices.items():
+			if idx in diskIO:
+				self.brickIO[brick] = diskIO[idx]
+	
+	def formatBrick(self, brick):
+		"""	Format the disk I/O for one of this hosts bricks, for the UI brick view """
+		
+		device = self.brickDevices.get(brick, ['-', 0])[0]
+		readRate, writeRate, readOps, writeOps = self.brickIO.get(brick, [0, 0, 0, 0])
+		name = brick if len(brick) < 31 else brick[:29] + ">"
+		
+		brickData = nodeStatus[self.state].encode('utf-8') + " " + name.ljust(30) + " " \
+					+ device[:8].ljust(8) + "  " \
+					+ convertBytes(readRate).rjust(6) + "  " \
+					+ convertBytes(writeRate).rjust(6) + "  " \
+					+ str(int(readOps)).rjust(6) + "  " \
+					+ str(int(writeOps)).rjust(6) + " " \
+					+ str(self.brickClients.get(brick, 0)).rjust(4)
+		
+		return brickData
+	
+	def formatNic(self, nic):
+		"""	Format the stats for one of this hosts interfaces, for the UI interface view """
+		
+		name, speed, inRate, outRate, utilPct, errRate, dropRate = nic
+		speed = (str(speed / 1000) + "G") if speed >= 1000 and speed % 1000 == 0 else (str(speed) + "M")
+		
+		nicData = nodeStatus[self.state].encode('utf-8') + " " + self.fmtdName + " " \
+					+ name[:10].ljust(10) + " " \
+					+ (speed if nic[1] else "-").rjust(5) + "  " \
+					+ convertBytes(inRate).rjust(6) + "  " \
+					+ convertBytes(outRate).rjust(6) + "  " \
+					+ str(utilPct).rjust(4) + "  " \
+					+ str(int(errRate)).rjust(6) + "  " \
+					+ str(int(dropRate)).rjust(6)
+		
+		return nicData
+	
+	def formatDaemon(self, daemon):
+		"""	Format the cpu/memory usage of one of this hosts daemons, for the UI daemon view """
+		
+		name, detail, count, cpuPct, mem = daemon
+		detail = detail if len(detail) < 27 else detail[:25] + ">"
+		
+		daemonData = nodeStatus[self.state].encode('utf-8') + " " + self.fmtdName + " " \
+					+ name[:10].ljust(10) + " " \
+					+ detail.ljust(26) + " " \
+					+ str(count).rjust(3) + "  " \
+					+ str(cpuPct).rjust(4) + "  " \
+					+ convertBytes(mem).rjust(6)
+		
+		return daemonData
+	
+	def formatData(self):
+		"""	Function to format a hosts statistics ready for display in the UI """
+		
+		displayStats = nodeStatus[self.state].encode('utf-8') + " " + self.fmtdName + " " \
+					+ str(self.procCount).rjust(3) + "  " \
+					+ str(self.cpuBusyPct).rjust(3) + ("!" if self.coreSaturated else " ")  \
+					+ convertBytes((self.memTotal*1024)).rjust(5) + "  " \
+					+ str(self.memUsedPct).rjust(3) + " " \
+					+ str(self.swapUsedPct).rjust(3) + "  " \
+					+ self.ctdb + " " \
+					+ self.samba + " " \
+					+ self.nfs + " " \
+					+ self.selfHeal + " " \
+					+ self.georep + "  " \
+					+ convertBytes(self.netInRate).rjust(5) + " " \
+					+ convertBytes(self.netOutRate).rjust(5) + "  " \
+					+ convertBytes(self.blocksReadAvg*BLOCKSIZE).rjust(5) + "  " \
+					+ convertBytes(self.blocksWriteAvg*BLOCKSIZE).rjust(5) + "  "
 					
 		return displayStats
 		
 
 	
+
+class LocalGLUSTERhost(GLUSTERhost):
+	"""	The node gtop (or gtop-agent) is running on. Its system stats, filesystem usage, disk I/O,
+		processes and connections are read straight from /proc, /sys and statvfs instead of through 
+		snmpd, so they're current rather than up to the agent's cache timeout old and cost no snmp
+		round trips """
+	
+	def reset(self):
+		GLUSTERhost.reset(self)
+		self.lcpuCounters = []					# last /proc/stat counters, total then each core
+		self.lnetDev = {}						# interface -> last /proc/net/dev counters
+		self.ldiskStats = {}					# device -> last /proc/diskstats counters
+		self.lsampleTime = 0					# when the system stats were last read
+		self.lbrickIOTime = 0					# when the brick device counters were last read
+	
+	def getData(self, nameSpace):
+		
+		self.hostActive = True
+		
+		try:
+			cpus = readCPU()
+			memInfo = readMemInfo()
+			netDev = readNetDev()
+			diskStats = readDiskStats()
+			if 'disks' not in self.discovery:
+				self.discovery['disks'] = physicalDisks()
+		except (IOError, OSError), e:
+			self.errMsg = "ERR: unable to read the local system stats - " + str(e)
+			self.hostActive = False
+			return
+		
+		sampleTime = time.time()
+		elapsed = sampleTime - self.lsampleTime if self.lsampleTime else 0
+		self.lsampleTime = sampleTime
+		self.timeStamp = datetime.datetime.now()
+		self.procCount = len(cpus) - 1
+		
+		# meminfo is in kB, the same units as the UCD-SNMP-MIB memory figures
+		self.memTotal = memInfo.get('MemTotal', 0)
+		self.memAvail = memInfo.get('MemFree', 0)
+		self.swapTotal = memInfo.get('SwapTotal', 0)
+		self.swapAvail = memInfo.get('SwapFree', 0)
+		self.swapUsedPct = 0 if self.swapTotal == 0 else int(round((self.swapTotal - self.swapAvail)/float(self.swapTotal)*100))
+		self.memUsedPct = 0 if self.memTotal == 0 else int(round((self.memTotal - self.memAvail)/float(self.memTotal)*100))
+		
+		#------------------------------------------------------------------------------------------------------
+		# cpu - the jiffies used since the last sample, as a % of all the jiffies in the interval. The
+		# per core load is everything but idle and iowait, matching hrProcessorLoad
+		#------------------------------------------------------------------------------------------------------
+		if len(self.lcpuCounters) == len(cpus):
+			diffs = [[max(count - last, 0) for count, last in zip(cpu, lcpu)] for cpu, lcpu in zip(cpus, self.lcpuCounters)]
+			user, nice, system, idle, iowait, irq, softirq, steal = diffs[0]
+			total = float(sum(diffs[0])) or 1.0
+			self.cpuUserPct = (user + nice) / total * 100
+			self.cpuSysPct = (system + irq + softirq) / total * 100
+			self.cpuWaitPct = iowait / total * 100
+			self.cpuIdlePct = idle / total * 100
+			self.cpuBusyPct = int(self.cpuUserPct + self.cpuSysPct + self.cpuWaitPct)
 			
-def printHeader(headerType='readable'):
+			self.coreLoads = [int(round((sum(core) - core[3] - core[4]) * 100.0 / (sum(core) or 1))) for core in diffs[1:]]
+			if self.coreLoads:
+				self.coreMax = max(self.coreLoads)
+				self.coreSpread = self.coreMax - min(self.coreLoads)
+				self.coreSaturated = self.coreMax >= CORESATURATION
+		self.lcpuCounters = cpus
+		
+		#------------------------------------------------------------------------------------------------------
+		# disk activity of the physical disks, in the same blocks as the systemStats ssIORaw counters
+		#------------------------------------------------------------------------------------------------------
+		sectorsRead = sum([diskStats[disk][1] for disk in self.discovery['disks'] if disk in diskStats])
+		sectorsWritten = sum([diskStats[disk][3] for disk in self.discovery['disks'] if disk in diskStats])
+		if elapsed:
+			self.blocksReadAvg = max(sectorsRead - self.lblocksRead, 0) * 512 / BLOCKSIZE / elapsed
+			self.blocksWriteAvg = max(sectorsWritten - self.lblocksWritten, 0) * 512 / BLOCKSIZE / elapsed
+		self.lblocksRead, self.lblocksWritten = sectorsRead, sectorsWritten
+		
+		#------------------------------------------------------------------------------------------------------
+		# network - the interfaces are chosen the same way as discoverNics does through snmp
+		#------------------------------------------------------------------------------------------------------
+		if 'nics' not in self.discovery:
+			self.discoverLocalNics(netDev, nameSpace.peerAddresses)
+		
+		nicStats = []
+		for name in self.discovery['nics']:
+			if name not in netDev:
+				continue									# interface has gone away
+			
+			counters = netDev[name]
+			last = self.lnetDev.get(name)
+			self.lnetDev[name] = counters
+			if last and elapsed:
+				inRate, outRate, inErrs, outErrs, inDiscards = [max(count - prev, 0) / elapsed 
+											for count, prev in zip(counters, last)]
+			else:
+				inRate, outRate, inErrs, outErrs, inDiscards = 0, 0, 0, 0, 0
+			
+			speed = ifSpeed(name)
+			utilPct = int(max(inRate, outRate) * 8 * 100 / (speed * 1000000.0)) if speed else 0
+			nicStats.append([name, speed, inRate, outRate, utilPct, inErrs + outErrs, inDiscards])
+		
+		self.nicStats = nicStats
+		self.netInRate = sum([nic[2] for nic in nicStats])
+		self.netOutRate = sum([nic[3] for nic in nicStats])
 	
-	if headerType == "readable":
-		global screenX, ScreenY
-		screenY,screenX = screenSize()						# test the screen size again incase window is resized
-		hdrs=[]
+	def discoverLocalNics(self, netDev, peerAddresses):
+		"""	Choose the interfaces to monitor from /proc/net/dev, preferring those holding a peer address,
+			then any with a non-loopback address, then the whiteList, and dropping the members of a 
+			chosen bond/team or vlan """
+		
+		names = [name for name in netDev if name != 'lo']
+		addresses = dict([(name, ifAddress(name)) for name in names])
+		
+		chosen = set([name for name in names if addresses[name] and addresses[name] in peerAddresses])
+		if not chosen:
+			chosen = set([name for name in names if addresses[name] and not addresses[name].startswith('127.')])
+		if not chosen:
+			chosen = set([name for name in names if re.match(whiteList, name)])
+		
+		below = set()
+		for name in chosen:
+			below.update(ifLower(name))
+		
+		self.discovery['nics'] = sorted(chosen - below)
 	
-		hdrs.append("                             CPU        Memory %  Network AVG   Disk I/O AVG")
-		hdrs.append("  Time    Gluster Node   C/T  %   RAM  Real Swap    In    Out   Reads Writes")
-		hdrs.append("-------- --------------- --- --- ----- ----|---- ------|------ ------|------")
+	def getState(self):
+		"""	Process state and the gluster daemons' cpu/memory from /proc/<pid> """
 		
-		for line in hdrs:
-			print line
+		try:
+			processes = readProcesses()
+		except OSError, e:
+			self.errMsg = "ERR: unable to read the local process table - " + str(e)
+			self.hostActive = False
+			return
+		
+		daemons = self.processState([(pid, name) for pid, name, parms, cpu, mem in processes],
+									dict([(pid, parms) for pid, name, parms, cpu, mem in processes]))
+		self.daemonPerf(daemons, dict([(pid, (cpu, mem)) for pid, name, parms, cpu, mem in processes]))
+	
+	def getClientConnections(self):
+		"""	Count the established connections to each brick's port from /proc/net/tcp and tcp6 """
+		
+		if not self.brickPorts or time.time() < self.nextConnScan:
+			return
+		self.nextConnScan = time.time() + CONNINTERVAL
+		
+		try:
+			counts = readTcpEstablished(self.brickPorts.values())
+		except IOError:
+			return
+		self.brickClients = dict([(brick, counts[port]) for brick, port in self.brickPorts.items()])
+	
+	def getDiskInfo(self, nameSpace):
+		"""	statvfs each of this hosts bricks """
+		
+		if 'bricks' not in self.discovery:
+			prefix = self.hostName + ":"
+			self.discovery['bricks'] = [brick for brick in nameSpace.gCluster.brickXref if brick.startswith(prefix)]
+		
+		for brick in self.discovery['bricks']:
+			try:
+				self.brickInfo[brick] = list(fsUsage(brick[len(self.hostName) + 1:]))
+			except OSError:
+				self.brickInfo.pop(brick, None)				# brick filesystem isn't mounted
+	
+	def getBrickIO(self):
+		"""	Throughput and IOPS of the devices holding this hosts bricks, from /proc/diskstats """
+		
+		if not self.brickInfo:
+			return
+		
+		# a brick that isn't mounted yet is tried again every CONNINTERVAL
+		unmapped = self.unmappedBricks()
+		if unmapped and time.time() >= self.nextDeviceMap:
+			self.nextDeviceMap = time.time() + CONNINTERVAL
+			for brick in unmapped:
+				device = blockDevice(brick[len(self.hostName) + 1:])
+				if device:
+					self.brickDevices[brick] = [device, 0]
+		
+		if not self.brickDevices:
+			return
 		
-		triggerRow = screenY - len(hdrs)
+		try:
+			diskStats = readDiskStats()
+		except IOError:
+			return												# leave the brick I/O as it was
+		
+		sampleTime = time.time()
+		elapsed = sampleTime - self.lbrickIOTime if self.lbrickIOTime else 0
+		self.lbrickIOTime = sampleTime
+		
+		diskIO = {}
+		for device in set([device for device, idx in self.brickDevices.values()]):
+			if device not in diskStats:
+				continue
+			reads, sectorsRead, writes, sectorsWritten = diskStats[device]
+			last = self.ldiskStats.get(device)
+			self.ldiskStats[device] = diskStats[device]
+			if last and elapsed:
+				diskIO[device] = [max(sectorsRead - last[1], 0) * 512 / elapsed, max(sectorsWritten - last[3], 0) * 512 / elapsed,
+									max(reads - last[0], 0) / elapsed, max(writes - last[2], 0) / elapsed]
+			else:
+				diskIO[device] = [0, 0, 0, 0]
 		
-		return triggerRow
-	
-	else:
-		print "TimeStamp,GlusterNode,Cores,CPU%,RAM,Real%,Swap%,NetInBytes,NetOutBytes,DiskReadAVG,DiskWriteAVG"
+		for brick, (device, idx) in self.brickDevices.items():
+			if device in diskIO:
+				self.brickIO[brick] = diskIO[device]
 
 
 def serverOK(server):
@@ -1213,38 +2005,52 @@ def getGroupServers(targetGroup):
 	
 	return serverString	
 
+def gatherSample(thisHost, nameSpace):
+	"""	Gather a node's sample for one refresh """
+	
+	# Get the system stats for this host
+	thisHost.getData(nameSpace)
+	
+	if thisHost.hostActive:
+		
+		if nameSpace.gatherAll:
+			
+			# Get the filesystem data
+			thisHost.getDiskInfo(nameSpace)
+			
+			if thisHost.hostActive:
+				
+				# Get the disk I/O of the devices holding the bricks
+				thisHost.getBrickIO()
+				
+				# Get the status of the nodes (look for key processes on the node)
+				thisHost.getState()
+				
+				# Count the client connections to the bricks (every CONNINTERVAL)
+				thisHost.getClientConnections()
+	
+	# if snmp fails in any of the above steps the hostActive flag is false, so 
+	# change the nodes state and reset it's stats until snmp starts working again
+	if not thisHost.hostActive:
+		thisHost.state = 'unknown'
+		thisHost.reset()
+
 def worker(connection,nameSpace,hostName):
 	""" Process forked by the main process to just perform the data gathering
 		Once the data is collected from SNMP the resulting object is passed back
 		on the pipe to the main process.
 	"""
 	
-	thisHost = GLUSTERhost(hostName=hostName)
+	# the node gtop is running on reads it's stats from /proc rather than snmp
+	if hostName == nameSpace.localNode:
+		thisHost = LocalGLUSTERhost(hostName=hostName)
+	else:
+		thisHost = GLUSTERhost(hostName=hostName)
 	
 	while True:
 		try:	
 
-			# Get the system stats for this host
-			thisHost.getData()
-			
-			if thisHost.hostActive:
-				
-				if nameSpace.interactiveMode:
-					
-					# Get the filesystem data
-					thisHost.getDiskInfo(nameSpace)
-					
-					if thisHost.hostActive:
-						
-						# Get the status of the nodes (look for key processes on the node)
-						thisHost.getState()
-			
-			# if snmp fails in any of the above steps the hostActive flag is false, so 
-			# change the nodes state and reset it's stats until snmp starts working again
-			if not thisHost.hostActive:
-				thisHost.state = 'unknown'
-				thisHost.reset()
-				pass 
+			gatherSample(thisHost, nameSpace)
 			
 			dataFeed = thisHost
 			connection.send(dataFeed)
@@ -1261,6 +2067,68 @@ def worker(connection,nameSpace,hostName):
 
 	sys.exit(12)
 
+def runAgent(gCluster, sender):
+	"""	gtop-agent - gather this node's sample every refresh and push it to the collectors, rather
+		than have each collector poll it over snmp. The worker loop does the gathering, with the 
+		sender standing in for the pipe back to the main process """
+	
+	hostName = gCluster.localNode()
+	nameSpace = Namespace(gCluster=gCluster, peerAddresses=gCluster.peerAddresses(), interactiveMode=False,
+							localNode=hostName if LOCALPROC else '', gatherAll=True)
+	worker(sender, nameSpace, hostName)
+
+def runPassPersist(gCluster, stdout):
+	"""	snmpd pass_persist helper - gather this node's sample from /proc every refresh, and answer 
+		snmpd's requests for the gtop summary subtree from it """
+	
+	hostName = gCluster.localNode()
+	nameSpace = Namespace(gCluster=gCluster, peerAddresses=gCluster.peerAddresses(), interactiveMode=False,
+							localNode=hostName, gatherAll=True)
+	thisHost = LocalGLUSTERhost(hostName=hostName)
+	
+	def gather():
+		gatherSample(thisHost, nameSpace)
+		return thisHost
+	
+	PassPersist(GTOPSUMMARYOID, gather, refreshRate, sys.stdin, stdout).run()
+
+def pollWorkers(nodeRcvd):
+	"""	Pick up any node objects sent by the worker processes, returning True once every node
+		has reported in for this sample run """
+	
+	for node in gCluster.nodes:
+		
+		# Check if there is anything ready from the worker processes associated with each node
+		if node.parentCon.poll():
+			
+			#syslog.syslog("data received on connection for " + node.hostName)
+								
+			# We have a object passed from subprocess, add this nodes name to a list to 
+			# signify it's been seen. if there are slower processes  we could get mutiple 
+			# receives from the same host - but we should only count the most recent which is why a 
+			# list not counter is used
+			if node.hostName not in nodeRcvd:
+				nodeRcvd.append(node.hostName)
+				
+			
+			# Grab the workers node object
+			updatedNode = node.parentCon.recv()
+			
+			# Appy the workers node attributes to the local copy of the host object
+			node.__dict__.update(updatedNode.__dict__)
+			
+			# Process the brick information to update the local xlator objects ready for roll-up into volume stats
+			gCluster.updateBricks(node)
+
+	if len(nodeRcvd) == len(gCluster.nodes):
+		
+		# reset the 'node seen' list
+		del nodeRcvd[:]
+		gCluster.tickTime = time.time()
+		return True
+	
+	return False
+
 def refreshInfoWindow(win):
 	"""	Routine to refresh the contents of the info window based on the aggregated
 		metrics held by the cluster object (which is fed by the node and volume objects) """
@@ -1286,19 +2154,26 @@ def refreshInfoWindow(win):
 	else:
 		deltaSecs = 0
 		
-	infoLine1_p1 = "gtop - " + gCluster.version[:11] + " " + \
+	if replay:
+		label = "paused" if replay.paused else "replay " + str(replay.speed) + "x"
+	else:
+		label = gCluster.version
+		
+	infoLine1_p1 = "gtop - " + label[:11].ljust(11) + " " + \
 				str(gCluster.peerCount).rjust(3) + " nodes,"
 
 	infoLine1_p2 = " active" + \
 				" CPU%:" + str(gCluster.avgCPU).rjust(3) + " Avg," + \
 				str(gCluster.peakCPU).rjust(3) + " peak" + " Skew:" + \
 				str(deltaSecs).rjust(3) + "s " + \
-				strftime(timeTemplate, gmtime())
+				strftime(timeTemplate, gmtime(gCluster.tickTime))
 				
-	infoLine2 =	"Activity: Network:" + convertBytes(gCluster.aggrNetIn).rjust(5) + " in," + \
-				convertBytes(gCluster.aggrNetOut).rjust(5) + " out" + \
-				"    Disk:" + convertBytes(gCluster.aggrDiskR*BLOCKSIZE).rjust(5) + " reads," + \
-				convertBytes(gCluster.aggrDiskW*BLOCKSIZE).rjust(5) + " writes        "
+	# 80 columns - the hot core's node name gets what's left after the rates
+	infoLine2 =	"Activity: Net:" + convertBytes(gCluster.aggrNetIn).rjust(5) + "/" + \
+				convertBytes(gCluster.aggrNetOut).rjust(5) + " in/out" + \
+				" Disk:" + convertBytes(gCluster.aggrDiskR*BLOCKSIZE).rjust(5) + "/" + \
+				convertBytes(gCluster.aggrDiskW*BLOCKSIZE).rjust(5) + " rd/wr" + \
+				"  Core:" + str(gCluster.hotCore).rjust(3) + "% " + gCluster.hotCoreNode[:13].ljust(13)
 				
 	infoLine3 = "Storage:" + str(len(gCluster.volumes)).rjust(2) + " volumes," + \
 				str(len(gCluster.brickXref)).rjust(3) + " bricks / " + \
@@ -1323,15 +2198,99 @@ def refreshInfoWindow(win):
 	
 	return 
 
-def refreshNodePad(pad,dh,vh,cursor,toprow):
-	"""	Function to display the node data to the screen """
+def nodeHeadings(view):
+	"""	Return the heading lines for the node area, for the current view """
+	
+	if view == 'bricks':
+		return ("                                             Throughput         IOPS",
+				"S Brick                          Device     Reads  Writes   Reads  Writes Clnt")
+	
+	if view == 'nics':
+		return ("                                           Throughput",
+				"S Gluster Node     Interface  Speed      In     Out  Util%  Errs/s Drops/s")
+	
+	if view == 'daemons':
+		return ("",
+				"S Gluster Node     Daemon     Brick/Volume              Procs  CPU%  Memory")
+	
+	if view == 'profile':
+		return ("                                                   Latency",
+				"Volume           Fop                Calls       Avg       Max   %Lat")
+	
+	return ("                       CPU       Memory %   Daemons     Network     Disk I/O",
+			"S Gluster Node     C/T  %   RAM  Real|Swap C-S-N-H-G   In  | Out  Reads | Writes")
+
+
+def nodeRowCount(view):
+	"""	Number of rows shown in the node area for the current view """
+	
+	if view == 'bricks':
+		return len(gCluster.brickRows())
+	if view == 'nics':
+		return len(gCluster.nicRows())
+	if view == 'daemons':
+		return len(gCluster.daemonRows())
+	if view == 'profile':
+		return len(profileRows())
+	return len(gCluster.nodes)
+
+
+def formatLatency(usecs):
+	"""	Show a latency in microseconds as us, ms or s """
+	
+	if usecs < 1000:
+		return '%dus' % usecs
+	if usecs < 1000000:
+		return '%.1fms' % (usecs / 1000.0)
+	return '%.1fs' % (usecs / 1000000.0)
+
+
+def profileRows(maxFops=6):
+	"""	Format the cached gluster volume profile/top results of each volume, for the profile panel.
+		The busiest fops (by share of the latency) are shown, followed by the most read/written files """
+	
+	rows = []
+	for volume in gCluster.volumes:
+		profile = profiler.cache.get(volume.name) if profiler else None
+		name = volume.fmtdName.ljust(16)
+		
+		if profile is None:
+			rows.append(name + " waiting for gluster volume profile")
+		elif profile.error:
+			rows.append(name + " " + profile.error[:60])
+		else:
+			for fop, calls, avgLatency, maxLatency, pctLatency in profile.fops[:maxFops]:
+				rows.append(name + " " + fop[:14].ljust(14) + str(calls).rjust(10) + "  " \
+							+ formatLatency(avgLatency).rjust(8) + "  " + formatLatency(maxLatency).rjust(8) + "  " \
+							+ ('%.1f' % pctLatency).rjust(5))
+				name = " " * 16
+			for op, count, fileName in profile.topFiles:
+				fileName = fileName if len(fileName) < 37 else "<" + fileName[-35:]
+				rows.append(" " * 16 + " " + ("top " + op).ljust(14) + str(count).rjust(10) + "  " + fileName)
+	
+	return rows
+
+
+def refreshNodePad(pad,dh,vh,cursor,toprow,view='nodes'):
+	"""	Function to display the node data to the screen. The view shows the nodes, the 
+		disk I/O of each brick, the traffic on each network interface, the resources used
+		by each gluster daemon or the volume profile panel """
+	
+	if view == 'bricks':
+		rows = [node.formatBrick(brick) for node, brick in gCluster.brickRows()]
+	elif view == 'nics':
+		rows = [node.formatNic(nic) for node, nic in gCluster.nicRows()]
+	elif view == 'daemons':
+		rows = [node.formatDaemon(daemon) for node, daemon in gCluster.daemonRows()]
+	elif view == 'profile':
+		rows = profileRows()
+	else:
+		rows = [node.formatData() for node in gCluster.nodes]
 	
+	pad.erase()
 	ypos = 0 
 	tgt = cursor + toprow
-	for node in gCluster.nodes:
-						
-		# format this nodes output and display
-		nodeData = node.formatData()
+	for nodeData in rows[:pad.getmaxyx()[0]]:
 		
 		if ypos == tgt:
 			pad.addstr(ypos,0,nodeData,rowHighlight)
@@ -1345,7 +2304,16 @@ def refreshNodePad(pad,dh,vh,cursor,toprow):
 
 
 
-def refreshVolumePad(pad,vh,cursor,toprow):
+def volumeHeading(view):
+	"""	Return the heading line for the volume area, for the current view """
+	
+	if view == 'heal':
+		return "Volume           Brk  Type Size  Used  Free   Pending  Drain/s  Volume Usage   "
+	
+	return "Volume           Brk  Type Size  Used  Free  Reads Writes Clnt  Volume Usage   "
+
+
+def refreshVolumePad(pad,vh,cursor,toprow,view='volumes'):
 	"""	function to write out the volume data to a given window area on the screen """
 	
 	ypos = 0
@@ -1353,7 +2321,7 @@ def refreshVolumePad(pad,vh,cursor,toprow):
 			
 	for volume in gCluster.volumes:
 
-		volData = volume.formatVol()
+		volData = volume.formatVol(view)
 		if ypos == tgt:
 			pad.addstr(ypos,0,volData,rowHighlight)
 		else:
@@ -1398,6 +2366,93 @@ def getWindowSizes(screen):
 
 	return volHeight, dataHeight
 
+def report(fileName, timeRange):
+	"""	Stream the samples of a recording between two times, and print the p50/p95/p99/max of 
+		the activity metrics for each node and the cluster. Quantile sketches are used so memory
+		use is the same regardless of the size of the time range. 
+	"""
+	
+	# Labels for the report, and the multiplier to turn the metric into bytes (None = a percentage)
+	labels = {'cpuBusyPct' : ('CPU Busy %', None), 
+				'netInRate' : ('Network In', 1), 
+				'netOutRate' : ('Network Out', 1), 
+				'blocksReadAvg' : ('Disk Reads', BLOCKSIZE), 
+				'blocksWriteAvg' : ('Disk Writes', BLOCKSIZE)}
+	quantiles = (0.5, 0.95, 0.99)
+	
+	# times without a date are taken to be on the last day of the recording
+	rec = RecordFile(fileName)
+	newest = rec.lastTime()
+	rec.close()
+	
+	fromText, sep, toText = timeRange.partition('..')
+	fromTime = parseTime(fromText, newest) if fromText else None
+	toTime = parseTime(toText, newest) if toText else None
+	
+	rec = selectTier(fileName, fromTime)
+	gCluster.loadRecording(rec)
+	
+	# one sketch per metric, for each node and the cluster as a whole
+	nodeSketches = dict([(node.hostName, [QuantileSketch() for m in GLUSTERhost.reportMetrics]) for node in gCluster.nodes])
+	clusterSketches = [QuantileSketch() for m in Cluster.metrics]
+	
+	# The consolidated tiers hold bucket averages. Each average is weighted by the number of samples
+	# in it's bucket, and the bucket's max is used for the max column. The peaks of the nodes may not 
+	# coincide, so the cluster's max from a tier (the nodes' peaks added together, or averaged for 
+	# cpu) is an upper bound
+	samples = 0
+	first = last = None
+	for tickTime, nodeSamples, brickSamples in rec.ticks(fromTime, toTime):
+		
+		gCluster.applySamples(rec, tickTime, nodeSamples, brickSamples)
+		gCluster.updateStats()
+		
+		for node in gCluster.nodes:
+			if node.state == 'unknown':
+				continue
+			for sketch, attr in zip(nodeSketches[node.hostName], GLUSTERhost.reportMetrics):
+				sketch.add(getattr(node, attr), node.sampleCount, node.samplePeaks.get(attr))
+		
+		peaks = [[node.samplePeaks.get(attr, 0) for node in gCluster.nodes] for attr in GLUSTERhost.reportMetrics]
+		peaks[0] = sum(peaks[0]) / len(peaks[0]) if peaks[0] else 0
+		count = max([node.sampleCount for node in gCluster.nodes] or [1])
+		for sketch, attr, peak in zip(clusterSketches, Cluster.metrics, peaks):
+			sketch.add(getattr(gCluster, attr), count, peak if attr == 'avgCPU' else sum(peak))
+		
+		samples += 1
+		first = tickTime if first is None else first
+		last = tickTime
+	
+	if not samples:
+		print "ERR: " + rec.fileName + " has no samples for the range " + timeRange
+		return
+	
+	resolution = str(rec.step) + "s averages (max is the peak sample)" if rec.step else str(rec.interval) + "s samples"
+	print "\nReport from " + strftime('%Y-%m-%d %H:%M:%S', gmtime(first)) + " to " + \
+			strftime('%Y-%m-%d %H:%M:%S', gmtime(last)) + " (UTC), " + str(samples) + " x " + \
+			resolution + " from " + rec.fileName + "\n"
+	
+	print "Node            Metric           p50     p95     p99     max"
+	print "--------------- ------------ ------- ------- ------- -------"
+	
+	rows = [(" < ALL >", clusterSketches)] + \
+			[(node.fmtdName, nodeSketches[node.hostName]) for node in gCluster.nodes]
+	
+	for name, sketches in rows:
+		for sketch, attr in zip(sketches, GLUSTERhost.reportMetrics):
+			label, scale = labels[attr]
+			values = [sketch.quantile(q) for q in quantiles] + [sketch.max or 0]
+			if scale is None:
+				values = [str(int(round(value))) for value in values]
+			else:
+				values = [convertBytes(value * scale) for value in values]
+				
+			print name.ljust(15)[:15] + " " + label.ljust(12) + " " + " ".join([value.rjust(7) for value in values])
+			name = ""
+			
+	rec.close()
+	
+
 def main(gCluster):
 	""" Main processing and Contol loop
 	"""
@@ -1416,9 +2471,16 @@ def main(gCluster):
 	# Create a namespace that parent objects can be attached to for visibility in the child processes
 	ns = mgr.Namespace()
 	ns.gCluster = gCluster
+	ns.peerAddresses = gCluster.peerAddresses()
+	ns.localNode = gCluster.localNode() if LOCALPROC else ''
 	ns.interactiveMode = interactiveMode
+	
+	# UI mode, recordings, the exporter, gtopd and the bricks batch mode need the filesystem and process state, 
+	# not just the system stats
+	ns.gatherAll = interactiveMode or headless or recorder is not None or BGMODE == 'bricks'
 
-	for node in gCluster.nodes:
+	# workers are only needed when this process is doing the data gathering
+	for node in (gCluster.nodes if not (replay or feed or listener) else []):
 		
 		parentCon, childCon = Pipe()
 		node.parentCon, node.childCon = parentCon, childCon
@@ -1453,6 +2515,8 @@ def main(gCluster):
 		sortVolName = True
 		sortVolFree = False
 		sortVolSize = False
+		sortVolRead = False
+		sortVolWrite = False
 		sortNodeName = True
 		sortNodeCPU = False
 		sortNodeNetIn = False
@@ -1463,18 +2527,25 @@ def main(gCluster):
 		infoWindow = curses.newwin(infoHeight,80,0,0)
 		volumePad = curses.newpad(MAXVOLS,80)
 
-		nodePad = curses.newpad(MAXNODES,80)
+		nodePad = curses.newpad(max(MAXNODES,MAXBRICKS),80)
+		
+		# the node area shows the nodes, or the disk I/O of each brick ('b' toggles)
+		nodeView = 'nodes'
+		
+		# the volume area shows the throughput, or the self-heal backlog ('h' toggles)
+		volumeView = 'volumes'
 
 		pVolTop = 0
 		pNodeTop = 0
 		refreshInfoWindow(infoWindow)
 
 
-		stdscr.addstr(3,0,"Volume           Bricks   Type   Size   Used   Free   Volume Usage              ",titleHighlight) 
+		stdscr.addstr(3,0,volumeHeading(volumeView),titleHighlight) 
 		stdscr.addstr(5,0,"Please wait...",curses.A_BLINK)
 
-		stdscr.addstr(vh+3,0,"                       CPU       Memory %   Daemons     Network     Disk I/O")
-		stdscr.addstr(vh+4,0,"S Gluster Node     C/T  %   RAM  Real|Swap C-S-N-H-G   In  | Out  Reads | Writes",titleHighlight)
+		headings = nodeHeadings(nodeView)
+		stdscr.addstr(vh+3,0,headings[0])
+		stdscr.addstr(vh+4,0,headings[1],titleHighlight)
 
 		stdscr.noutrefresh()			
 
@@ -1482,14 +2553,11 @@ def main(gCluster):
 		# flush the updates to the screen
 		curses.doupdate()								
 		#exit(0) 	# DEBUG
-	else:
+	elif not headless:
 		
-		# Set "batch mode" counters and write column headers to stdout
-		rowNum = 1										
-		if showHeaders:									
-			triggerRow = printHeader()
-		else:
-			printHeader(headerType='raw')					
+		# Batch mode - each sample run is written to stdout in the selected format
+		output = WRITERS[FORMAT](outputFile or sys.stdout, BATCHFIELDS, BLOCKSIZE, timeTemplate, showHeaders, BGMODE)
+		output.start(gCluster)
 
 	startTime = int(time.time())
 	
@@ -1498,37 +2566,60 @@ def main(gCluster):
 	while True:
 		try:
 			
-			for node in gCluster.nodes:
+			# Sample data comes from the worker processes, or a recording when replaying
+			if replay:
+				tickReady = replay.due()
+				if tickReady:
+					gCluster.applyReplay(replay)
+				elif replay.finished() and not interactiveMode:
+					break
+			elif feed:
+				snapshot = feed.poll()
+				if feed.lost:
+					errorType = "daemon"
+					break
+				tickReady = snapshot is not None
+				if tickReady:
+					gCluster.applySnapshot(snapshot)
+			elif listener:
+				tickReady = gCluster.applyAgents(listener)
+			else:
+				tickReady = pollWorkers(nodeRcvd)
 				
-				# Check if there is anything ready from the worker processes associated with each node
-				if node.parentCon.poll():
-					
-					#syslog.syslog("data received on connection for " + node.hostName)
-										
-					# We have a object passed from subprocess, add this nodes name to a list to 
-					# signify it's been seen. if there are slower processes  we could get mutiple 
-					# receives from the same host - but we should only count the most recent which is why a 
-					# list not counter is used
-					if node.hostName not in nodeRcvd:
-						nodeRcvd.append(node.hostName)
-						
-					
-					# Grab the workers node object
-					updatedNode = node.parentCon.recv()
-					
-					# Appy the workers node attributes to the local copy of the host object
-					node.__dict__.update(updatedNode.__dict__)
-					
-					# Process the brick information to update the local xlator objects ready for roll-up into volume stats
-					for brickName in node.brickInfo:
-						xl = gCluster.brick2Xlator[brickName]
-						xl.size = node.brickInfo[brickName][0]
-						xl.used = node.brickInfo[brickName][1]
+			if publisher:
+				publisher.service()
+				
+			if sink:
+				sink.service()
+				
+			if healScanner:
+				healScanner.service()
 
-			if len(nodeRcvd) == len(gCluster.nodes):
+			if tickReady:
+				
+				# process the bricks/volumes to update the capacity roll-up stats
+				gCluster.updateCapacity()
+				
+				if healScanner:
+					healScanner.update(gCluster.volumes)
 				
-				# reset the 'node seen' list
-				nodeRcvd = []
+				# Update the rollup stats based on current node metrics
+				gCluster.updateStats()
+				
+				# Manage the active node count
+				gCluster.updateActive()
+				
+				if recorder:
+					recorder.writeTick(gCluster.tickTime, gCluster)
+				
+				if exporter:
+					exporter.update(gCluster, BLOCKSIZE)
+					
+				if publisher:
+					publisher.publish(gCluster)
+					
+				if sink:
+					sink.tick(gCluster.tickTime, gCluster, BLOCKSIZE)
 				
 				# Handle the output - UI or stdout
 
@@ -1537,68 +2628,25 @@ def main(gCluster):
 					#-----------------------------------------------------------------------------------
 					# Update the screen
 					#-----------------------------------------------------------------------------------					
-					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop)
-					
-					# process the bricks/volumes to update roll-up stats
-					raw = 0
-					usable = 0
-					used = 0 
-					for volume in gCluster.volumes:
-						volume.updateVol()
-						raw += volume.rawSize
-						usable += volume.usableSize
-						used += volume.usedSize
+					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
 					
-					refreshVolumePad(volumePad,vh,volumeCursor,pVolTop)
-					
-					# Set the high level capacity information for the whole cluster	
-					gCluster.rawCapacity = raw
-					gCluster.usableCapacity = usable
-					gCluster.usedCapacity = used
-					gCluster.freeCapacity = usable - used
-						
-					# Update the rollup stats based on current node metrics
-					gCluster.updateStats()
+					refreshVolumePad(volumePad,vh,volumeCursor,pVolTop,volumeView)
 					
-					# Manage the active node count
-					gCluster.updateActive()
-		
 					refreshInfoWindow(infoWindow)
 					
 					# flush all screen changes to the physical screen
 					curses.doupdate()
 					
-				else:
+				elif not headless:
 					
 					#-----------------------------------------------------------------------------------
 					# Send output to stdout
 					#-----------------------------------------------------------------------------------
-					tstamp = strftime(timeTemplate, gmtime())
-					if timeStamps:
-						prefix = tstamp
-					else:
-						prefix = "" 
-					
-					if BGMODE in ['summary','all']:
-						gCluster.updateStats()
-						displayStats = gCluster.formatStats(prefix)
-						print displayStats
-						if showHeaders:
-							rowNum += 1
-						
-					if BGMODE in ['nodes','all']:
-						
-						for node in gCluster.nodes:
-							
-							displayStats = node.formatData(prefix)
-							print displayStats
-							if showHeaders:
-								rowNum += 1
-							
-					if showHeaders:							# if headers are needed then 
-						if rowNum > triggerRow:
-							triggerRow = printHeader()
-							rowNum = 1			
+					try:
+						output.tick(gCluster.tickTime, gCluster)
+					except IOError, e:
+						errorType = "output"
+						break
 
 				pass 
 			
@@ -1624,7 +2672,7 @@ def main(gCluster):
 							# just move the highlighted row
 							volumeCursor +=1
 							
-						refreshVolumePad(volumePad,vh,volumeCursor,pVolTop)
+						refreshVolumePad(volumePad,vh,volumeCursor,pVolTop,volumeView)
 						volumePad.refresh(pVolTop,0,4,0,vh,80)
 						
 				# UP arrow Pressed		
@@ -1636,19 +2684,19 @@ def main(gCluster):
 						else:
 							volumeCursor -= 1
 							
-						refreshVolumePad(volumePad,vh,volumeCursor,pVolTop)
+						refreshVolumePad(volumePad,vh,volumeCursor,pVolTop,volumeView)
 						volumePad.refresh(pVolTop,0,4,0,vh,80)						
 
 				# '+' pressed
 				elif keypress == 43:
-					if (nodeCursor + pNodeTop) < (len(gCluster.nodes) -1):
+					if (nodeCursor + pNodeTop) < (nodeRowCount(nodeView) -1):
 						if nodeCursor == dh :
 							pNodeTop += 1
 						else:
 							
 							nodeCursor +=1
 							
-						refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop)
+						refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
 						nodePad.refresh(pNodeTop,0,vh+5,0,vh+5+dh,80)
 
 				# '-' pressed - CHANGES		
@@ -1659,7 +2707,7 @@ def main(gCluster):
 						else:
 							nodeCursor -= 1
 							
-						refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop)
+						refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
 						nodePad.refresh(pNodeTop,0,vh+5,0,vh+5+dh,80)			
 
 	
@@ -1672,7 +2720,7 @@ def main(gCluster):
 						
 					volumeCursor = 0							# reset highlight
 					pVolTop = 0									# reset the pad offset 
-					refreshVolumePad(volumePad,vh,volumeCursor,pVolTop)
+					refreshVolumePad(volumePad,vh,volumeCursor,pVolTop,volumeView)
 					volumePad.refresh(pVolTop,0,4,0,vh,80)
 					
 				elif keypress in [ord('s'),ord('S')]:
@@ -1684,7 +2732,7 @@ def main(gCluster):
 						
 					volumeCursor = 0							# reset highlight
 					pVolTop = 0
-					refreshVolumePad(volumePad,vh,volumeCursor,pVolTop)
+					refreshVolumePad(volumePad,vh,volumeCursor,pVolTop,volumeView)
 					volumePad.refresh(pVolTop,0,4,0,vh,80)
 
 				elif keypress in [ord('f'),ord('F')]:
@@ -1696,9 +2744,33 @@ def main(gCluster):
 						
 					volumeCursor = 0							# reset highlight etc
 					pVolTop = 0
-					refreshVolumePad(volumePad,vh,volumeCursor,pVolTop)
+					refreshVolumePad(volumePad,vh,volumeCursor,pVolTop,volumeView)
 					volumePad.refresh(pVolTop,0,4,0,vh,80)					
 					
+				elif keypress in [ord('e'),ord('E')]:
+					sortVolRead = not sortVolRead
+					if sortVolRead:
+						gCluster.volumes.sort(key=lambda volume: volume.readRate,reverse=True)
+					else:
+						gCluster.volumes.sort(key=lambda volume: volume.readRate)
+						
+					volumeCursor = 0							# reset highlight etc
+					pVolTop = 0
+					refreshVolumePad(volumePad,vh,volumeCursor,pVolTop,volumeView)
+					volumePad.refresh(pVolTop,0,4,0,vh,80)
+					
+				elif keypress in [ord('t'),ord('T')]:
+					sortVolWrite = not sortVolWrite
+					if sortVolWrite:
+						gCluster.volumes.sort(key=lambda volume: volume.writeRate,reverse=True)
+					else:
+						gCluster.volumes.sort(key=lambda volume: volume.writeRate)
+						
+					volumeCursor = 0							# reset highlight etc
+					pVolTop = 0
+					refreshVolumePad(volumePad,vh,volumeCursor,pVolTop,volumeView)
+					volumePad.refresh(pVolTop,0,4,0,vh,80)
+					
 				elif keypress in [ord('n'),ord('N')]:
 					sortNodeName = not sortNodeName
 					if sortNodeName:
@@ -1709,7 +2781,7 @@ def main(gCluster):
 					pNodeTop = 0
 					nodeCursor = 0
 					
-					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop)
+					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
 					nodePad.refresh(0,0,vh+5,0,vh+5+dh,80)
 						
 				elif keypress in [ord('c'),ord('C')]:
@@ -1722,7 +2794,7 @@ def main(gCluster):
 					pNodeTop = 0
 					nodeCursor = 0					
 					
-					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop)
+					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
 					nodePad.refresh(0,0,vh+5,0,vh+5+dh,80)
 					
 				elif keypress in [ord('i'),ord('I')]:
@@ -1735,7 +2807,7 @@ def main(gCluster):
 					pNodeTop = 0
 					nodeCursor = 0
 					
-					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop)
+					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
 					nodePad.refresh(0,0,vh+5,0,vh+5+dh,80)
 										
 				elif keypress in [ord('o'),ord('O')]:
@@ -1748,7 +2820,7 @@ def main(gCluster):
 					pNodeTop = 0
 					nodeCursor = 0
 					
-					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop)
+					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
 					nodePad.refresh(0,0,vh+5,0,vh+5+dh,80)
 
 				elif keypress in [ord('r'),ord('R')]:
@@ -1761,7 +2833,7 @@ def main(gCluster):
 					pNodeTop = 0
 					nodeCursor = 0					
 					
-					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop)
+					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
 					nodePad.refresh(0,0,vh+5,0,vh+5+dh,80)
 										
 				elif keypress in [ord('w'),ord('W')]:
@@ -1774,10 +2846,84 @@ def main(gCluster):
 					pNodeTop = 0
 					nodeCursor = 0
 					
-					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop)
+					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
 					nodePad.refresh(0,0,vh+5,0,vh+5+dh,80)
 										
 
+				elif keypress in [ord('h'),ord('H')]:
+					volumeView = 'volumes' if volumeView == 'heal' else 'heal'
+					
+					stdscr.addstr(3,0,volumeHeading(volumeView),titleHighlight)
+					stdscr.noutrefresh()
+					
+					refreshVolumePad(volumePad,vh,volumeCursor,pVolTop,volumeView)
+					curses.doupdate()
+					
+				elif keypress in [ord('b'),ord('B')]:
+					nodeView = 'nodes' if nodeView == 'bricks' else 'bricks'
+					
+					headings = nodeHeadings(nodeView)
+					stdscr.move(vh+3,0)
+					stdscr.clrtoeol()
+					stdscr.addstr(vh+3,0,headings[0])
+					stdscr.addstr(vh+4,0,headings[1],titleHighlight)
+					stdscr.noutrefresh()
+					
+					pNodeTop = 0
+					nodeCursor = 0
+					
+					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
+					curses.doupdate()
+					
+				elif keypress in [ord('x'),ord('X')]:
+					nodeView = 'nodes' if nodeView == 'nics' else 'nics'
+					
+					headings = nodeHeadings(nodeView)
+					stdscr.move(vh+3,0)
+					stdscr.clrtoeol()
+					stdscr.addstr(vh+3,0,headings[0])
+					stdscr.addstr(vh+4,0,headings[1],titleHighlight)
+					stdscr.noutrefresh()
+					
+					pNodeTop = 0
+					nodeCursor = 0
+					
+					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
+					curses.doupdate()
+					
+				elif keypress in [ord('p'),ord('P')]:
+					nodeView = 'nodes' if nodeView == 'daemons' else 'daemons'
+					
+					headings = nodeHeadings(nodeView)
+					stdscr.move(vh+3,0)
+					stdscr.clrtoeol()
+					stdscr.addstr(vh+3,0,headings[0])
+					stdscr.addstr(vh+4,0,headings[1],titleHighlight)
+					stdscr.noutrefresh()
+					
+					pNodeTop = 0
+					nodeCursor = 0
+					
+					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
+					curses.doupdate()
+					
+				elif keypress in [ord('g'),ord('G')] and profiler:
+					nodeView = 'nodes' if nodeView == 'profile' else 'profile'
+					profiler.enable()
+					
+					headings = nodeHeadings(nodeView)
+					stdscr.move(vh+3,0)
+					stdscr.clrtoeol()
+					stdscr.addstr(vh+3,0,headings[0])
+					stdscr.addstr(vh+4,0,headings[1],titleHighlight)
+					stdscr.noutrefresh()
+					
+					pNodeTop = 0
+					nodeCursor = 0
+					
+					refreshNodePad(nodePad,dh,vh,nodeCursor,pNodeTop,nodeView)
+					curses.doupdate()
+					
 				elif keypress == curses.KEY_RESIZE:
 					# user has attempted to resize the window, which is not supported (yet!)
 					# so just tell them they're naughty and exit ;o)
@@ -1788,7 +2934,20 @@ def main(gCluster):
 					errorType="dump"
 					break
 				
-			sleep(0.1)									# Pause for a 1/10 second
+				# replay controls - pause, and seek back/forward a minute
+				elif replay and keypress == ord(' '):
+					replay.togglePause()
+					refreshInfoWindow(infoWindow)
+					curses.doupdate()
+				
+				elif replay and keypress in [ord('<'),ord(',')]:
+					replay.seek(-max(1, 60 / replay.rec.interval))
+					
+				elif replay and keypress in [ord('>'),ord('.')]:
+					replay.seek(max(1, 60 / replay.rec.interval))
+				
+			if not (replay and replay.due()):
+				sleep(0.1)								# Pause for a 1/10 second
 														
 		except KeyboardInterrupt:						# Catch CTRL-C from the user to leave the program
 			break
@@ -1808,8 +2967,40 @@ def main(gCluster):
 		del infoWindow
 		del volumePad
 		resetScreen(stdscr)
+	elif not headless:
+		try:
+			output.close()
+		except IOError, e:
+			errorType = "output"
+		
+		if outputFile and outputFile.dropped:
+			print "WARN: " + str(outputFile.dropped) + " sample runs were dropped, the output file writes fell behind"
 
 	
+	if recorder:
+		recorder.close()
+	
+	if exporter:
+		exporter.stop()
+	
+	if publisher:
+		publisher.close()
+		
+	if sink:
+		sink.close()
+	
+	if profiler:
+		profiler.stop()
+		
+	if feed:
+		feed.close()
+	
+	if listener:
+		listener.close()
+	
+	if replay:
+		replay.close()
+	
 	# Clear up the forked processes
 	for p in gCluster.processList:
 		#print "killing " + str(p.pid)									# DEBUG
@@ -1820,6 +3011,12 @@ def main(gCluster):
 	if 	errorType == "resize":
 		print "ERR: Resizing the window is not currently supported"
 	
+	if errorType == "daemon":
+		print "ERR: Lost the connection to gtopd on " + GTOPDSOCKET
+	
+	if errorType == "output":
+		print "ERR: " + str(e)
+	
 	if errorType == "dump":
 		print "node area " + str(dh)
 		print "volume area " + str(vh)
@@ -1854,17 +3051,32 @@ if __name__ == "__main__":
 	usageInfo = "%prog [options] argument \n\n" + \
 				"This program uses snmp to gather and present various operational metrics\n" + \
 				"from gluster nodes to provide a single view of a cluster, that refreshes\n" + \
-				"every 5 seconds." 
+				"every 5 seconds (--interval)." 
 
-	bgModeOptions = ['nodes', 'all', 'summary']
-	dataFormatOptions = ['raw','readable']
+	bgModeOptions = ['nodes', 'all', 'summary', 'bricks']
+	dataFormatOptions = ['raw','readable','json','binary']
 
 	parser = OptionParser(usage=usageInfo,version="%prog 1.0.0")
 	parser.add_option("-n","--no-heading",dest="showHeaders",action="store_false",default=True,help="suppress headings")
 	parser.add_option("-s","--servers",dest="serverList",default=[],type="string",help="Comma separated list of names/IP (default uses gluster's peers file)")
-	parser.add_option("-b","--bg-mode",dest="bgMode",default="nodes",type="string",help="Which data to display in 'batch' mode " + str(bgModeOptions) + ", (default is nodes)")
-	parser.add_option("-f","--format",dest="dataFormat",default="readable",type="string",help="Output type raw or readable(default)")
+	parser.add_option("-b","--bg-mode",dest="bgMode",default=None,type="string",help="Which data to display in 'batch' mode " + str(bgModeOptions) + ", (default is nodes)")
+	parser.add_option("-f","--format",dest="dataFormat",default=None,type="string",help="Output type " + str(dataFormatOptions) + " - raw is CSV (default is readable)")
+	parser.add_option("--fields",dest="fields",default="",type="string",help="Comma separated list of the batch mode fields to show " + str(FIELDNAMES))
+	parser.add_option("-o","--output",dest="outputFile",default="",type="string",help="Write the batch output to rotating, compressed files named FILE.YYYYmmdd-HHMMSS instead of stdout")
 	parser.add_option("-g","--server-group",dest="groupName",default="",type="string",help="Name of a server group define in the users XML config file)")
+	parser.add_option("--record",dest="recordFile",default="",type="string",help="Append the raw node and brick samples to a binary recording file")
+	parser.add_option("--replay",dest="replayFile",default="",type="string",help="Play back a recording through the UI, or batch mode when -b or -f are given")
+	parser.add_option("--speed",dest="speed",default="1",type="string",help="Replay speed e.g. 4x (default 1x, 0 plays back as fast as possible)")
+	parser.add_option("--report",dest="reportRange",default="",type="string",help="Summarise a recording (given as the argument) between FROM..TO (UTC), either time may be omitted")
+	parser.add_option("--exporter",dest="exporter",default="",type="string",help="Run without output, serving OpenMetrics on [host]:port/metrics and a JSON event stream on /events")
+	parser.add_option("--sink",dest="sink",default="",type="string",help="Also send each refresh's metrics to graphite://, graphite+udp:// or statsd://host[:port]")
+	parser.add_option("--daemon",dest="daemon",action="store_true",default=False,help="Run as gtopd - gather the data once and publish it to the gtop viewers attached to it's socket")
+	parser.add_option("--no-daemon",dest="noDaemon",action="store_true",default=False,help="Gather the data directly, even if gtopd is running")
+	parser.add_option("--agent",dest="agent",default="",type="string",help="Run as gtop-agent on a gluster node, pushing it's samples to the comma separated collectors host[:port]")
+	parser.add_option("--listen",dest="listen",default="",type="string",help="Receive the samples pushed by gtop-agents on [host:]port (udp), instead of polling the nodes over snmp")
+	parser.add_option("--pass-persist",dest="passPersist",action="store_true",default=False,help="Run as the snmpd pass_persist helper publishing this node's gtop summary subtree (see snmpd.conf_gtop)")
+	parser.add_option("-i","--interval",dest="interval",default=0,type="int",help="Seconds between samples (default 5). Below 5, the nodes' snmp cache timeouts are checked and lowered where the agent allows")
+	parser.add_option("--start",dest="startTime",default="",type="string",help="Start the replay at a given time (UTC) - 'YYYY-MM-DD HH:MM:SS' or 'HH:MM:SS'")
 
 	(options, args) = parser.parse_args()
 	
@@ -1873,15 +3085,47 @@ if __name__ == "__main__":
 		print "-s and -g options are mutually exclusive, use either not both"
 		exit(4)
 		
+	if options.replayFile and (options.serverList or options.groupName or options.recordFile or options.exporter):
+		print "--replay can not be used with the -s, -g, --record or --exporter options"
+		exit(4)
+	
+	if options.agent and (options.serverList or options.groupName or options.replayFile or options.recordFile or 
+							options.exporter or options.listen or options.daemon):
+		print "--agent only runs the agent, it can not be used with other modes"
+		exit(4)
+	
+	if options.interval < 0:
+		print "--interval needs to be a whole number of seconds, 1 or more"
+		exit(4)
+	
+	if options.listen and options.replayFile:
+		print "--listen can not be used with --replay"
+		exit(4)
+	
+	# snmpd reads the pass_persist responses from stdout, so nothing else can be written there
+	protocolOut = sys.stdout
+	if options.passPersist:
+		if options.serverList or options.groupName or options.replayFile or options.agent:
+			sys.stderr.write("--pass-persist can not be used with other modes\n")
+			exit(4)
+		sys.stdout = open(os.devnull, 'w')
+	
+	# a replay uses the UI, unless batch output has been asked for
+	batchMode = options.serverList or options.groupName or \
+				(options.replayFile and (options.bgMode or options.dataFormat))
+		
 	# if user provides a server or group list, check the background mode is OK to use	
-	if options.serverList or options.groupName:
-		if options.bgMode and options.bgMode in bgModeOptions:
+	if batchMode:
+		options.bgMode = options.bgMode or "nodes"
+		options.dataFormat = options.dataFormat or "readable"
+		
+		if options.bgMode in bgModeOptions:
 			BGMODE = options.bgMode
 		else:
 			print "invalid option supplied on -b option. Valid options are " + str(bgModeOptions)
 			exit(4)
 		
-		if options.dataFormat and options.dataFormat in dataFormatOptions:
+		if options.dataFormat in dataFormatOptions:
 			
 			# Need to check if option is raw, if so then headers aren't needed, but an initial
 			# csv based header row is - no pagination
@@ -1893,9 +3137,24 @@ if __name__ == "__main__":
 		else:
 			print "Invalid output option specified. Valid options are - " + str(dataFormatOptions)
 			exit(4)
+		
+	if options.outputFile and not batchMode:
+		print "--output is only used in batch mode (-s, -g or a --replay with -b/-f)"
+		exit(4)
+		
+	try:
+		if options.bgMode == 'bricks':
+			BATCHFIELDS = selectFields(options.fields, BRICKFIELDS)
+		else:
+			BATCHFIELDS = selectFields(options.fields)
+	except ValueError, e:
+		print "Invalid --fields option, " + str(e) + ". Valid fields are " + str(BRICKFIELDNAMES if options.bgMode == 'bricks' else FIELDNAMES)
+		exit(4)
+
+	# interface name prefixes used when the interfaces can't be chosen from their addresses
+	whiteList = ['eth','wlan','em','ib','en','bond','team']		# wlan for testing ONLY!
+	whiteList = r'^(' + r'|'.join(whiteList) + r')'
 
-	whiteList = ['eth','wlan','em','ib']						# wlan for testing ONLY!
-	whiteList = r'|'.join([name + "*" for name in whiteList])
 	baseInstall = '/var/lib/glusterd'
 	
 	SNMPCOMMUNITY = 'gluster'
@@ -1904,7 +3163,7 @@ if __name__ == "__main__":
 	block=u'\u2588'
 	
 	# Size of maximum bar for a volume at 100% full
-	barWidth = 20									
+	barWidth = 10									
 	pctPerBlock = 100 / barWidth 	
 	
 	timeTemplate = 	'%H:%M:%S'
@@ -1956,10 +3215,55 @@ if __name__ == "__main__":
 	# Maximums used to define the virtual size of the volume and node display areas
 	MAXVOLS  = 64
 	MAXNODES = 64
+	MAXBRICKS = 256
 	
 	# Set refresh interval to align with SNMP agent refresh interval of 5 seconds
 	refreshRate = 5								
 	
+	# UNIX socket used by gtopd to publish data to gtop viewers
+	GTOPDSOCKET = '/var/run/gtopd.sock'
+	
+	# Batch output files (output option) - a new file is started after OUTPUTMAXMB of output or 
+	# OUTPUTMAXHOURS, compressed with gzip, zstd or none. OUTPUTKEEP limits the files kept (0 = all)
+	OUTPUTMAXMB = 100
+	OUTPUTMAXHOURS = 24
+	OUTPUTCOMPRESS = 'gzip'
+	OUTPUTKEEP = 0
+	
+	# Metric path prefix and maximum datagram size used when sending metrics to graphite/statsd
+	SINKPREFIX = 'gtop'
+	SINKMTU = 1432
+	
+	# Number of sample runs between full keyframes on the /events stream
+	SSEKEYFRAME = 12
+	
+	# A node is flagged when any one of it's cores is at least this busy (%)
+	CORESATURATION = 90
+	
+	# Read the stats of the node gtop runs on from /proc and /sys instead of snmp (0 = use snmp)
+	LOCALPROC = 1
+	
+	# Shared key the gtop-agent datagrams are signed with ('' = unsigned), and the seconds a collector
+	# waits for a node's datagrams before showing it as unknown
+	AGENTKEY = ''
+	AGENTTIMEOUT = 15
+	
+	# OID of the summary subtree published by gtop --pass-persist through snmpd ('' = don't look for it)
+	GTOPSUMMARYOID = '.1.3.6.1.4.1.8072.9999.9999.47'
+	
+	# Seconds between scans of the tcp connection table for the brick client counts
+	CONNINTERVAL = 60
+	
+	# gluster cli used by the profile panel, how often it's run for each volume and how long it's given
+	GLUSTERCLI = 'gluster'
+	PROFILEINTERVAL = 60
+	PROFILETIMEOUT = 10
+	
+	# Retention of the raw samples, 1 minute and 1 hour tiers of a recording (0 = keep everything)
+	RECORDRAWHOURS = 48
+	RECORDMINUTEDAYS = 31
+	RECORDHOURDAYS = 732
+	
 	volDir = os.path.join(baseInstall,'vols')
 	peersDir = os.path.join(baseInstall,'peers')
 
@@ -1979,10 +3283,68 @@ if __name__ == "__main__":
 	
 		
 	
+	if options.interval:
+		refreshRate = options.interval
+	
+	replay = None
+	
+	# gtopd is the same program, started with --daemon or through a link called gtopd
+	daemonMode = options.daemon or os.path.basename(sys.argv[0]).startswith('gtopd')
+	
+	# the exporter and gtopd run without any UI or stdout output
+	headless = bool(options.exporter) or daemonMode or bool(options.agent) or options.passPersist
+	
+	# If gtopd is running, attach to it rather than polling the nodes ourselves
+	feed = None
+	listener = None
+	if not (daemonMode or options.noDaemon or options.reportRange or options.replayFile or options.agent or options.listen 
+			or options.passPersist) \
+		and os.path.exists(GTOPDSOCKET):
+		try:
+			feed = DaemonFeed(GTOPDSOCKET)
+		except (socket.error, DaemonError), e:
+			print "gtopd socket " + GTOPDSOCKET + " is not usable (" + str(e) + "), gathering data directly"
+			feed = None
+	
+	if options.reportRange:
+		
+		if len(args) != 1:
+			print "ERR: --report needs the recording file to be given e.g. gtop --report 09:00..17:00 /var/tmp/gtop.rec"
+			exit(4)
+		
+		try:
+			report(args[0], options.reportRange)
+		except (RecordError, IOError), e:
+			print "ERR: Unable to report on " + args[0] + " - " + str(e)
+			exit(4)
+			
+	elif options.replayFile:
+		
+		# Replays build the cluster from the recording, so no peers, SNMP or volfiles are needed
+		try:
+			replay = Replay(options.replayFile, speed=float(options.speed.lower().rstrip('x')))
+			if options.startTime:
+				replay.seekTime(parseTime(options.startTime, replay.index[0][0] if replay.index else None))
+		except (RecordError, IOError, ValueError), e:
+			print "ERR: Unable to replay " + options.replayFile + " - " + str(e)
+			exit(4)
+			
+		print "Replaying " + str(len(replay.index)) + " samples from " + options.replayFile
+		gCluster.loadRecording(replay.rec)
+		gCluster.volumes.sort(key=lambda volume: volume.name)
+		
+		interactiveMode = not batchMode
+		timeStamps = True
+		screenY,screenX = screenSize()
+		if interactiveMode and screenY <= 9:
+			print "ERR: console/xterm needs to be > 9 rows in size"
+			exit(8)
+	
 	# Check if user has supplied an override for the servers to monitor
-	if options.serverList or options.groupName:			
+	elif options.serverList or options.groupName:			
 												
-		screenY,screenX = screenSize()
+		if not headless:
+			screenY,screenX = screenSize()
 		interactiveMode = False
 		timeStamps = True
 
@@ -2001,46 +3363,180 @@ if __name__ == "__main__":
 		if serverList:
 			print "Checking supplied server list is usable.."
 			gCluster.validateServers(serverList)
+			
+		# brick output needs the volume layout, which is only available on a gluster node
+		if options.bgMode == 'bricks':
+			if os.path.isdir(volDir):
+				gCluster.getGlusterVols()
+			else:
+				print "ERR: -b bricks needs the volume configuration under " + volDir + " (run on a gluster node)"
+				exit(4)
+			
+		# gtopd can only be used when it's monitoring all the servers we need
+		if feed:
+			if [node for node in gCluster.nodes if node.hostName not in feed.hosts]:
+				feed.close()
+				feed = None
+			else:
+				print "Attached to gtopd on " + GTOPDSOCKET
 		
 	else:
 		
-		print "Checking for glusterfs peers file"
+		# the UI needs gtopd to be monitoring the peers (not a server list) to have the volume information
+		if feed and not feed.hello.get('peers'):
+			feed.close()
+			feed = None
 		
-		# Populate cluster hosts from peers file
-		gCluster.getGlusterPeers()				
+		if feed:
+			print "Attached to gtopd on " + GTOPDSOCKET
+			gCluster.loadFeed(feed)
+		else:
+			print "Checking for glusterfs peers file"
+			
+			# Populate cluster hosts from peers file
+			gCluster.getGlusterPeers()				
 		
 		# If we have nodes - then program is running on a node so enable all the local gathering
 		if gCluster.nodes:						
-			interactiveMode = True
-			screenY,screenX = screenSize()
-			if screenY <= 9:
-				print "ERR: console/xterm needs to be > 9 rows in size"
-				exit(8)
+			interactiveMode = not headless
+			if interactiveMode:
+				screenY,screenX = screenSize()
+				if screenY <= 9:
+					print "ERR: console/xterm needs to be > 9 rows in size"
+					exit(8)
+				
+			if not feed:
+				# Build a volume list based on the hosts vol file(s)
+				gCluster.getGlusterVols()
+				
+				# Grab the glusterfs version from the running host
+				gCluster.getVersion()				
 				
-			# Build a volume list based on the hosts vol file(s)
-			gCluster.getGlusterVols()
 			gCluster.volumes.sort(key=lambda volume: volume.name)		
-			
-			# Grab the glusterfs version from the running host
-			gCluster.getVersion()				
 		else:
 			print "ERR: No gluster configuration present at " + peersDir
 			pass 
 
 
 
-	if gCluster.nodes:
+	if options.reportRange:
+		pass
 		
-		gCluster.nodes.sort(key=lambda node: node.hostName)		# sort the list of hosts, by host name
+	elif gCluster.nodes:
 		
-		print "Checking SNMP is available on the selected hosts.."
+		gCluster.nodes.sort(key=lambda node: node.hostName)		# sort the list of hosts, by host name
 		
-		# Check SNMP is responding on each host before we try and use them
-		gCluster.SNMPcheck()					
+		if not (replay or feed or options.listen or options.agent or options.passPersist):
+			print "Checking SNMP is available on the selected hosts.."
+			
+			# Check SNMP is responding on each host before we try and use them
+			gCluster.SNMPcheck()					
+			
+			# snmpd caches most tables for a few seconds, so faster sampling needs the caches lowered
+			if refreshRate < 5:
+				print "Checking the snmp cache timeouts for " + str(refreshRate) + "s sampling.."
+				for warning in gCluster.checkCaches(refreshRate):
+					print "WARN: " + warning
+		
+		# gtop-agent only gathers this node's samples and sends them on
+		if options.agent:
+			
+			if not gCluster.localNode():
+				print "ERR: --agent needs to run on one of the gluster nodes"
+				exit(4)
+			try:
+				sender = AgentSender(options.agent, key=AGENTKEY)
+			except (AgentError, socket.error), e:
+				print "ERR: Unable to send to " + options.agent + " - " + str(e)
+				exit(4)
+			print "gtop-agent pushing samples for " + gCluster.localNode() + " to " + options.agent
+			runAgent(gCluster, sender)
+		
+		elif options.passPersist:
+			
+			if not gCluster.localNode():
+				sys.stderr.write("ERR: --pass-persist needs to run on one of the gluster nodes\n")
+				exit(4)
+			runPassPersist(gCluster, protocolOut)
 		
 		# If there are still nodes after all the checks they're OK to use
-		if gCluster.nodes:						
+		elif gCluster.nodes:						
 		
+			recorder = None
+			if options.recordFile:
+				try:
+					recorder = Recorder(options.recordFile, gCluster, GLUSTERhost.metrics, refreshRate,
+										retention=RECORDRAWHOURS*3600,
+										tiers=[(60, RECORDMINUTEDAYS*86400), (3600, RECORDHOURDAYS*86400)])
+				except (RecordError, IOError), e:
+					print "ERR: Unable to record to " + options.recordFile + " - " + str(e)
+					exit(4)
+				print "Recording samples to " + options.recordFile
+			
+			exporter = None
+			if options.exporter:
+				try:
+					exporter = Exporter(options.exporter, keyframe=SSEKEYFRAME)
+				except (socket.error, ValueError), e:
+					print "ERR: Unable to start the exporter on " + options.exporter + " - " + str(e)
+					exit(4)
+				print "Serving metrics on " + options.exporter + "/metrics and events on /events"
+			
+			if options.listen:
+				try:
+					listener = AgentListener(options.listen, [node.hostName for node in gCluster.nodes], key=AGENTKEY,
+												resync=AGENTTIMEOUT)
+				except (socket.error, ValueError), e:
+					print "ERR: Unable to listen for gtop-agents on " + options.listen + " - " + str(e)
+					exit(4)
+				print "Receiving gtop-agent samples on " + options.listen
+			
+			outputFile = None
+			if options.outputFile:
+				try:
+					outputFile = RotatingFile(options.outputFile, maxBytes=OUTPUTMAXMB*1048576, maxAge=OUTPUTMAXHOURS*3600,
+												compress=OUTPUTCOMPRESS, keep=OUTPUTKEEP)
+				except IOError, e:
+					print "ERR: Unable to write output to " + options.outputFile + " - " + str(e)
+					exit(4)
+				print "Writing output to " + options.outputFile + ".*"
+			
+			sink = None
+			if options.sink:
+				try:
+					sink = MetricSink(options.sink, prefix=SINKPREFIX, mtu=SINKMTU)
+				except (SinkError, socket.error, ValueError), e:
+					print "ERR: Unable to send metrics to " + options.sink + " - " + str(e)
+					exit(4)
+				print "Sending metrics to " + options.sink
+			
+			# count the self-heal backlog of this node's bricks for the volume area's heal view
+			healScanner = None
+			profiler = None
+			if interactiveMode and not replay:
+				localBricks = gCluster.localBricks()
+				if localBricks:
+					healScanner = HealScanner(localBricks, interval=refreshRate)
+				
+				# volume profile panel - the gluster cli is only run once the panel is first shown
+				if gCluster.volumes:
+					profiler = ProfileCollector([volume.name for volume in gCluster.volumes], GLUSTERCLI, 
+												PROFILEINTERVAL, PROFILETIMEOUT)
+			
+			publisher = None
+			if daemonMode:
+				hello = {'hosts' : [node.hostName for node in gCluster.nodes],
+						'volumes' : gCluster.volFiles,
+						'version' : gCluster.version,
+						'peerCount' : gCluster.peerCount,
+						'interval' : refreshRate,
+						'peers' : not (options.serverList or options.groupName)}
+				try:
+					publisher = Publisher(GTOPDSOCKET, hello)
+				except (DaemonError, socket.error, OSError), e:
+					print "ERR: Unable to start gtopd on " + GTOPDSOCKET + " - " + str(e)
+					exit(4)
+				print "gtopd publishing to " + GTOPDSOCKET
 		
 			# Call the main processing loop
 			main(gCluster)						
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+#
+#	gtop - A performance and capacity monitoring program for glusterfs clusters
+#
+#	gtop-agent : push mode - nodes send their samples to the gtop collectors over udp
+#
+#   Copyright (C) 2013 Paul Cuzner
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Protocol
+# Each refresh, a node running gtop --agent sends one datagram to each collector (gtop --listen)
+# holding everything the collector would otherwise poll over snmp. All values are network order.
+#
+#	header		magic 'GTA2', state, daemon flags, core saturated, host active,
+#				node timestamp (epoch), sender session id, sequence number
+#	scalars		the integer then float node attributes below
+#	strings		host name, error message
+#	cores		count, then the load (%) of each core
+#	nics		count, then per interface - name, speed, in/out bytes/s, util %, errors/s, discards/s
+#	bricks		count, then per brick - path, device, which values are present, size, used,
+#				read/write bytes/s, read/write IOPS, port, client connections
+#	daemons		count, then per daemon - name, detail, processes, cpu %, memory bytes
+#
+# Strings are a 2 byte length followed by the bytes. Brick paths are sent without the host name,
+# the collector adds the name it knows the node by. When a key is configured, a truncated
+# HMAC-SHA256 of the datagram is appended and checked by the collector.
+#
+# Ordering doesn't depend on the nodes' clocks. Each sender picks a random session id when it starts
+# and numbers it's datagrams; the collector only applies a datagram with a later sequence number
+# (compared modulo 2**32, so the count can wrap) than the last one from that node, which also stops
+# the newest datagram being replayed. A new session id (the agent restarted), or a gap of more than
+# the resync time since the node was last heard from, resets the sequence.
+#
+
+import socket, errno
+import struct
+import hmac, hashlib
+import random
+import time
+
+from gtop_iputils import resolveAddresses
+from gtop_record import STATECODES, STATENAMES, packFlags, unpackFlags, dt2Epoch
+
+MAGIC = 'GTA2'
+HEADER = struct.Struct('!4sBBBBdII')
+
+INTATTRS = ('procCount', 'cpuBusyPct', 'coreMax', 'coreSpread', 'memTotal', 'memAvail', 'memUsedPct',
+			'swapTotal', 'swapAvail', 'swapUsedPct')
+FLOATATTRS = ('cpuUserPct', 'cpuSysPct', 'cpuWaitPct', 'cpuIdlePct', 'netInRate', 'netOutRate',
+			'blocksReadAvg', 'blocksWriteAvg')
+SCALARS = struct.Struct('!' + 'q' * len(INTATTRS) + 'd' * len(FLOATATTRS))
+
+COUNT = struct.Struct('!H')
+NIC = struct.Struct('!IddHdd')
+BRICK = struct.Struct('!BQQddddHI')
+DAEMON = struct.Struct('!HIq')
+
+# brick values present flags
+HASINFO, HASIO, HASPORT, HASCLIENTS = 1, 2, 4, 8
+
+DIGESTSIZE = 16
+
+# udp port the collector listens on by default
+DEFAULTPORT = 24099
+
+# largest datagram accepted
+MAXDATAGRAM = 65507
+
+# sequence numbers are 32 bit, and compared by serial number arithmetic (RFC 1982)
+SEQMOD = 2**32
+
+
+class AgentError(Exception):
+	pass
+
+
+def packStr(value):
+	value = str(value)[:65535]
+	return COUNT.pack(len(value)) + value
+
+
+def encodeNode(node, session=0, sequence=0):
+	"""	Encode a node's sample as a datagram """
+
+	prefix = node.hostName + ":"
+	parts = [HEADER.pack(MAGIC, STATECODES.get(node.state, 0), packFlags(node), int(node.coreSaturated),
+						int(node.hostActive), dt2Epoch(node.timeStamp), session, sequence % SEQMOD),
+			SCALARS.pack(*([int(getattr(node, attr)) for attr in INTATTRS] +
+							[float(getattr(node, attr)) for attr in FLOATATTRS])),
+			packStr(node.hostName), packStr(node.errMsg)]
+
+	parts.append(COUNT.pack(len(node.coreLoads)))
+	parts.append(struct.pack('!' + 'B' * len(node.coreLoads), *[min(max(int(load), 0), 255) for load in node.coreLoads]))
+
+	parts.append(COUNT.pack(len(node.nicStats)))
+	for name, speed, inRate, outRate, utilPct, errs, discards in node.nicStats:
+		parts.append(packStr(name) + NIC.pack(speed, inRate, outRate, min(utilPct, 65535), errs, discards))
+
+	bricks = sorted(set(node.brickInfo) | set(node.brickDevices) | set(node.brickPorts) | set(node.brickClients))
+	parts.append(COUNT.pack(len(bricks)))
+	for brick in bricks:
+		present = (HASINFO if brick in node.brickInfo else 0) | (HASIO if brick in node.brickIO else 0) | \
+					(HASPORT if brick in node.brickPorts else 0) | (HASCLIENTS if brick in node.brickClients else 0)
+		size, used = node.brickInfo.get(brick, [0, 0])
+		readRate, writeRate, readOps, writeOps = node.brickIO.get(brick, [0, 0, 0, 0])
+		path = brick[len(prefix):] if brick.startswith(prefix) else brick
+		parts.append(packStr(path) + packStr(node.brickDevices.get(brick, [''])[0]) +
+					BRICK.pack(present, size, used, readRate, writeRate, readOps, writeOps,
+								node.brickPorts.get(brick, 0), node.brickClients.get(brick, 0)))
+
+	parts.append(COUNT.pack(len(node.daemonStats)))
+	for daemon, detail, count, cpuPct, mem in node.daemonStats:
+		parts.append(packStr(daemon) + packStr(detail) + DAEMON.pack(count, int(cpuPct), mem))
+
+	return ''.join(parts)
+
+
+class Reader:
+	"""	Sequential unpacking of a datagram """
+
+	def __init__(self, data):
+		self.data = data
+		self.pos = 0
+
+	def unpack(self, fmt):
+		values = fmt.unpack_from(self.data, self.pos)
+		self.pos += fmt.size
+		return values
+
+	def count(self):
+		return self.unpack(COUNT)[0]
+
+	def string(self):
+		size = self.count()
+		if self.pos + size > len(self.data):
+			raise struct.error("string runs past the end of the datagram")
+		value = self.data[self.pos:self.pos + size]
+		self.pos += size
+		return value
+
+
+def decodeNode(data, hostName=None):
+	"""	Decode a datagram, returning (host name, session id, sequence number, node state). The state is
+		in the form applyNodeState takes, with the brick paths prefixed by hostName (default the
+		sender's name) """
+
+	r = Reader(data)
+	magic, state, flags, coreSaturated, hostActive, timeStamp, session, sequence = r.unpack(HEADER)
+	if magic != MAGIC:
+		raise AgentError("not a gtop-agent datagram")
+
+	scalars = r.unpack(SCALARS)
+	nodeState = dict(zip(INTATTRS + FLOATATTRS, scalars))
+	nodeState.update(unpackFlags(flags))
+	sender = r.string()
+	prefix = (hostName or sender) + ":"
+	nodeState.update({'state' : STATENAMES.get(state, 'unknown'), 'coreSaturated' : bool(coreSaturated),
+					'hostActive' : bool(hostActive), 'timeStamp' : timeStamp, 'errMsg' : r.string()})
+
+	cores = r.count()
+	nodeState['coreLoads'] = list(r.unpack(struct.Struct('!' + 'B' * cores)))
+
+	nodeState['nicStats'] = []
+	for n in range(r.count()):
+		name = r.string()
+		nodeState['nicStats'].append([name] + list(r.unpack(NIC)))
+
+	brickInfo, brickIO, brickDevices, brickPorts, brickClients = {}, {}, {}, {}, {}
+	for n in range(r.count()):
+		brick = prefix + r.string()
+		device = r.string()
+		present, size, used, readRate, writeRate, readOps, writeOps, port, clients = r.unpack(BRICK)
+		if present & HASINFO:
+			brickInfo[brick] = [size, used]
+		if present & HASIO:
+			brickIO[brick] = [readRate, writeRate, readOps, writeOps]
+		if device:
+			brickDevices[brick] = [device, 0]
+		if present & HASPORT:
+			brickPorts[brick] = port
+		if present & HASCLIENTS:
+			brickClients[brick] = clients
+	nodeState.update({'brickInfo' : brickInfo, 'brickIO' : brickIO, 'brickDevices' : brickDevices,
+					'brickPorts' : brickPorts, 'brickClients' : brickClients})
+
+	nodeState['daemonStats'] = []
+	for n in range(r.count()):
+		daemon, detail = r.string(), r.string()
+		nodeState['daemonStats'].append([daemon, detail] + list(r.unpack(DAEMON)))
+
+	if r.pos != len(data):
+		raise AgentError("trailing data in datagram")
+
+	return sender, session, sequence, nodeState
+
+
+def senderName(data):
+	"""	Return the host name a datagram was sent by, without decoding the rest of it """
+
+	r = Reader(data)
+	r.unpack(HEADER)
+	r.unpack(SCALARS)
+	return r.string()
+
+
+def sign(data, key):
+	return data + hmac.new(key, data, hashlib.sha256).digest()[:DIGESTSIZE]
+
+
+def verify(data, key):
+	"""	Return the datagram without it's digest, or None when the digest doesn't match """
+
+	body, digest = data[:-DIGESTSIZE], data[-DIGESTSIZE:]
+	if len(data) <= DIGESTSIZE or not hmac.compare_digest(hmac.new(key, body, hashlib.sha256).digest()[:DIGESTSIZE], digest):
+		return None
+	return body
+
+
+def parseAddress(address, defaultPort=DEFAULTPORT, defaultHost=''):
+	"""	Split [host][:port] into (host, port) """
+
+	host, sep, port = address.rpartition(':')
+	if not sep:
+		host, port = (address, '') if not address.isdigit() else ('', address)
+	return host or defaultHost, int(port or defaultPort)
+
+
+class AgentSender:
+	"""	Node side - sends a node's sample to each collector. Has the same send() as the Pipe
+		connection a worker process reports through, so the worker loop drives it unchanged """
+
+	def __init__(self, collectors, key=''):
+
+		self.key = str(key) if key else ''					# an all digit key comes through gtoprc.xml as an int
+		self.collectors = []
+		for collector in collectors.split(','):
+			host, port = parseAddress(collector.strip())
+			addresses = resolveAddresses(host)
+			if not addresses:
+				raise AgentError("unable to resolve collector " + host)
+			self.collectors.append((addresses[0], port))
+
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.errors = 0
+		self.session = random.randint(1, SEQMOD - 1)
+		self.sequence = 0
+
+	def send(self, node):
+
+		self.sequence = (self.sequence + 1) % SEQMOD
+		data = encodeNode(node, self.session, self.sequence)
+		if self.key:
+			data = sign(data, self.key)
+		for collector in self.collectors:
+			try:
+				self.sock.sendto(data, collector)
+			except socket.error:
+				self.errors += 1								# collector unreachable, try again next time
+
+	def close(self):
+		self.sock.close()
+
+
+class AgentListener:
+	"""	Collector side - a non-blocking udp socket the agents' datagrams are read from in the main
+		loop. Each datagram is matched to one of the collector's nodes by the sender's name (full or
+		short) or, failing that, by the address it came from """
+
+	def __init__(self, address, hosts, key='', resync=15):
+
+		self.key = str(key) if key else ''
+		self.resync = resync
+		self.hosts = list(hosts)
+		self.names = {}
+		self.addresses = {}
+		for host in self.hosts:
+			self.names.setdefault(host, host)
+			self.names.setdefault(host.split('.')[0], host)
+			for addr in resolveAddresses(host):
+				self.addresses.setdefault(addr, host)
+
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.sock.bind(parseAddress(address))
+		self.sock.setblocking(0)
+
+		self.lastSeq = {}									# host -> [session, sequence, time received]
+		self.dropped = 0
+
+	def nodeName(self, sender, addr):
+
+		return self.names.get(sender) or self.names.get(sender.split('.')[0]) or self.addresses.get(addr)
+
+	def inSequence(self, hostName, session, sequence, now):
+		"""	Is the datagram later than the last one applied for the node - recording it when it is """
+
+		last = self.lastSeq.get(hostName)
+		if last and last[0] == session and now - last[2] <= self.resync:
+			ahead = (sequence - last[1]) % SEQMOD
+			if ahead == 0 or ahead >= SEQMOD // 2:
+				return False									# a repeat, or older than the last one
+		self.lastSeq[hostName] = [session, sequence, now]
+		return True
+
+	def poll(self):
+		"""	Read the waiting datagrams, returning [(host name, node state)]. Datagrams that are
+			corrupt, unsigned, from an unknown node, repeated or older than one already applied are
+			dropped """
+
+		received = []
+		while True:
+			try:
+				data, (addr, port) = self.sock.recvfrom(MAXDATAGRAM)
+			except socket.error, e:
+				if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+					self.dropped += 1
+				break
+
+			if self.key:
+				data = verify(data, self.key)
+				if data is None:
+					self.dropped += 1
+					continue
+
+			try:
+				hostName = self.nodeName(senderName(data), addr)
+				if not hostName:
+					raise AgentError("unknown node")
+				sender, session, sequence, nodeState = decodeNode(data, hostName)
+			except (struct.error, AgentError):
+				self.dropped += 1
+				continue
+
+			if not self.inSequence(hostName, session, sequence, time.time()):
+				self.dropped += 1								# arrived out of order, or replayed
+				continue
+			received.append((hostName, nodeState))
+
+		return received
+
+	def close(self):
+		self.sock.close()
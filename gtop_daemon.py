@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+#
+#	gtop - A performance and capacity monitoring program for glusterfs clusters
+#
+#	gtop-daemon : snapshot publishing (gtopd) and the matching viewer feed
+#
+#   Copyright (C) 2013 Paul Cuzner
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Protocol
+# gtopd listens on a UNIX socket. Each message is a 4 byte length (network order) followed by
+# a JSON document. On connect a viewer is sent a 'hello' describing the cluster (hosts, volfiles,
+# version) followed by the most recent snapshot, so it can display data straight away. After
+# that a snapshot is sent at the end of each sample run.
+#
+# All the socket handling is non-blocking and driven from the gtop main loop - a viewer that
+# stops reading is disconnected once it has too much data queued, rather than holding up the
+# collection for everyone else.
+#
+
+import os, stat
+import socket, errno
+import struct
+import json
+
+from gtop_record import dt2Epoch, epoch2Dt
+
+LENGTH = struct.Struct('!I')
+
+# node attributes that are not sent to viewers
+PRIVATEATTRS = ('parentCon', 'childCon')
+
+# Disconnect a viewer once this much data is waiting to be sent to it
+MAXPENDING = 4 * 1024 * 1024
+
+
+class DaemonError(Exception):
+	pass
+
+
+def frame(doc):
+	"""	Encode a document as a length prefixed message """
+
+	data = json.dumps(doc, separators=(',',':'))
+	return LENGTH.pack(len(data)) + data
+
+
+def nodeState(node):
+	"""	Return the attributes of a node that are sent to the viewers """
+
+	state = dict([(k,v) for k,v in node.__dict__.items() if k not in PRIVATEATTRS])
+	state['timeStamp'] = dt2Epoch(node.timeStamp)
+	return state
+
+
+class Publisher:
+	"""	Server side of the gtopd socket """
+
+	def __init__(self, path, hello):
+
+		self.path = path
+		self.hello = frame(dict(hello, type='hello'))
+		self.last = ''										# most recent snapshot message
+		self.clients = {}									# socket -> pending output
+
+		if os.path.exists(path):
+			if stat.S_ISSOCK(os.stat(path).st_mode) and self.alive(path):
+				raise DaemonError("gtopd is already running on " + path)
+			os.unlink(path)
+
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.bind(path)
+		os.chmod(path, 0666)								# read only data, same as the snmp community
+		self.sock.listen(16)
+		self.sock.setblocking(0)
+
+	def alive(self, path):
+		"""	Is there a daemon listening on the socket already? """
+
+		s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			s.connect(path)
+			return True
+		except socket.error:
+			return False
+		finally:
+			s.close()
+
+	def service(self):
+		"""	Accept new viewers and push out any pending data, called from the main loop """
+
+		while True:
+			try:
+				conn, addr = self.sock.accept()
+			except socket.error, e:
+				if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+					break
+				raise
+			conn.setblocking(0)
+			self.clients[conn] = self.hello + self.last
+
+		for conn in self.clients.keys():
+			self.flush(conn)
+
+	def flush(self, conn):
+
+		pending = self.clients[conn]
+		if not pending:
+			return
+		try:
+			sent = conn.send(pending)
+			self.clients[conn] = pending[sent:]
+		except socket.error, e:
+			if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+				self.drop(conn)
+
+	def drop(self, conn):
+		del self.clients[conn]
+		conn.close()
+
+	def publish(self, cluster):
+		"""	Send a snapshot of the cluster to every viewer. The snapshot is encoded once, no
+			matter how many viewers are attached """
+
+		self.last = frame({'type' : 'snapshot',
+							'tickTime' : cluster.tickTime,
+							'nodes' : [nodeState(node) for node in cluster.nodes]})
+
+		for conn in self.clients.keys():
+			if len(self.clients[conn]) > MAXPENDING:
+				self.drop(conn)
+			else:
+				self.clients[conn] += self.last
+				self.flush(conn)
+
+	def close(self):
+		for conn in self.clients.keys():
+			self.drop(conn)
+		self.sock.close()
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+
+
+class DaemonFeed:
+	"""	Viewer side of the gtopd socket """
+
+	def __init__(self, path, timeout=2):
+
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.settimeout(timeout)
+		self.sock.connect(path)
+		self.buffer = ''
+		self.lost = False
+
+		# the hello is sent as soon as we connect, so wait for it
+		self.hello = self.readMessage()
+		if self.hello is None or self.hello.get('type') != 'hello':
+			raise DaemonError("unexpected response from gtopd on " + path)
+
+		self.sock.setblocking(0)
+		self.hosts = [str(name) for name in self.hello['hosts']]
+
+	def readMessage(self):
+		"""	Blocking read of a single message """
+
+		while True:
+			doc = self.nextMessage()
+			if doc is not None:
+				return doc
+			data = self.sock.recv(65536)
+			if not data:
+				return None
+			self.buffer += data
+
+	def nextMessage(self):
+		"""	Return the next complete message in the buffer, or None """
+
+		if len(self.buffer) < LENGTH.size:
+			return None
+		size = LENGTH.unpack(self.buffer[:LENGTH.size])[0]
+		if len(self.buffer) < LENGTH.size + size:
+			return None
+		doc = json.loads(self.buffer[LENGTH.size:LENGTH.size + size])
+		self.buffer = self.buffer[LENGTH.size + size:]
+		return doc
+
+	def poll(self):
+		"""	Read whatever the daemon has sent, returning the most recent snapshot (or None). Older
+			snapshots that have queued up are skipped """
+
+		while True:
+			try:
+				data = self.sock.recv(65536)
+			except socket.error, e:
+				if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+					break
+				self.lost = True
+				break
+			if not data:
+				self.lost = True
+				break
+			self.buffer += data
+
+		latest = None
+		doc = self.nextMessage()
+		while doc is not None:
+			if doc.get('type') == 'snapshot':
+				latest = doc
+			doc = self.nextMessage()
+
+		return latest
+
+	def close(self):
+		self.sock.close()
+
+
+def applyNodeState(node, state):
+	"""	Apply a node's state from a snapshot to the viewers copy of the node """
+
+	state = dict([(str(k), plainStr(v)) for k,v in state.items()])
+	state['timeStamp'] = epoch2Dt(state['timeStamp'])
+	state['brickInfo'] = dict([(str(k),v) for k,v in state['brickInfo'].items()])
+	state['brickIO'] = dict([(str(k),v) for k,v in state.get('brickIO',{}).items()])
+	state['brickDevices'] = dict([(str(k),[str(v[0]),v[1]]) for k,v in state.get('brickDevices',{}).items()])
+	state['brickPorts'] = dict([(str(k),v) for k,v in state.get('brickPorts',{}).items()])
+	state['brickClients'] = dict([(str(k),v) for k,v in state.get('brickClients',{}).items()])
+	state['nicStats'] = [[str(nic[0])] + nic[1:] for nic in state.get('nicStats',[])]
+	state['daemonStats'] = [[str(daemon[0]), str(daemon[1])] + daemon[2:] for daemon in state.get('daemonStats',[])]
+	node.__dict__.update(state)
+
+
+def plainStr(value):
+	"""	json returns unicode strings, but the display code works with byte strings """
+
+	if isinstance(value, unicode):
+		return value.encode('utf-8')
+	return value
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+#
+#	gtop - A performance and capacity monitoring program for glusterfs clusters
+#
+#	gtop-export : HTTP endpoints publishing the cluster state held by gtop
+#
+#   Copyright (C) 2013 Paul Cuzner
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# The HTTP server runs in a thread of the main gtop process. Scrapes never trigger any SNMP
+# activity - the response is rendered once per sample run by the main loop (update) and
+# handed to the server as a single string, so a scrape is just a write of that buffer.
+#
+# Endpoints
+#	/metrics .. OpenMetrics text format
+#	/events  .. server-sent events stream of JSON. A client first receives a 'keyframe' event
+#				holding the full node, volume and cluster rows, followed by a 'delta' event per
+#				sample run that only holds the fields that have changed. A keyframe is repeated
+#				every 'keyframe' sample runs, and sent to any client that falls too far behind.
+#
+
+import threading
+import collections
+import json
+import socket
+import BaseHTTPServer, SocketServer
+
+CONTENTTYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# (label, GLUSTERhost attribute) of the daemons reported for each node
+DAEMONS = (('ctdb','ctdb'), ('samba','samba'), ('nfs','nfs'), ('self-heal','selfHeal'), ('geo-rep','georep'))
+
+
+def parseAddress(address):
+	"""	Convert [host]:port to a (host, port) tuple, an empty host listens on all interfaces """
+
+	host, sep, port = address.rpartition(':')
+	return host, int(port)
+
+
+def escape(value):
+	"""	Escape a label value for the OpenMetrics text format """
+
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricFamily:
+	"""	Collects the samples of a single metric, so each family is written as one block """
+
+	def __init__(self, name, help, type='gauge'):
+		self.name = name
+		self.lines = ['# TYPE ' + name + ' ' + type, '# HELP ' + name + ' ' + help]
+
+	def add(self, value, **labels):
+		if labels:
+			labelText = ','.join([key + '="' + escape(labels[key]) + '"' for key in sorted(labels)])
+			self.lines.append(self.name + '{' + labelText + '} ' + repr(float(value)))
+		else:
+			self.lines.append(self.name + ' ' + repr(float(value)))
+
+
+def renderOpenMetrics(cluster, blockSize):
+	"""	Render the node, brick, volume and cluster metrics in OpenMetrics text format """
+
+	families = []
+	def family(name, help):
+		f = MetricFamily(name, help)
+		families.append(f)
+		return f
+
+	nodeUp = family('gtop_node_up', 'Node is answering SNMP requests')
+	nodeConnected = family('gtop_node_glusterd_running', 'glusterd is running on the node')
+	cpus = family('gtop_node_cpus', 'Number of processors (cores/threads)')
+	cpuBusy = family('gtop_node_cpu_busy_percent', 'CPU busy (user+sys+wait) percentage')
+	coreMax = family('gtop_node_cpu_core_max_percent', 'Load of the busiest core (hrProcessorLoad)')
+	coreSpread = family('gtop_node_cpu_core_spread_percent', 'Load difference between the busiest and idlest core')
+	memTotal = family('gtop_node_memory_bytes', 'Real memory size')
+	memUsed = family('gtop_node_memory_used_percent', 'Real memory used percentage')
+	swapUsed = family('gtop_node_swap_used_percent', 'Swap used percentage')
+	netIn = family('gtop_node_network_receive_bytes_per_second', 'Network receive rate')
+	netOut = family('gtop_node_network_transmit_bytes_per_second', 'Network transmit rate')
+	diskR = family('gtop_node_disk_read_bytes_per_second', 'Disk read rate')
+	diskW = family('gtop_node_disk_write_bytes_per_second', 'Disk write rate')
+	daemons = family('gtop_node_daemon_running', 'Gluster related daemon is running on the node')
+	daemonCPU = family('gtop_daemon_cpu_percent', 'CPU used by the daemon, relative to one core (hrSWRunPerfCPU)')
+	daemonMem = family('gtop_daemon_memory_bytes', 'Memory used by the daemon (hrSWRunPerfMem)')
+	brickSize = family('gtop_brick_size_bytes', 'Size of the filesystem holding the brick')
+	brickUsed = family('gtop_brick_used_bytes', 'Used space of the filesystem holding the brick')
+	brickClients = family('gtop_brick_client_connections', 'Established tcp connections to the brick')
+
+	for node in cluster.nodes:
+		name = node.hostName
+		nodeUp.add(0 if node.state == 'unknown' else 1, node=name)
+		nodeConnected.add(1 if node.state == 'connected' else 0, node=name)
+		cpus.add(node.procCount, node=name)
+		cpuBusy.add(node.cpuBusyPct, node=name)
+		coreMax.add(node.coreMax, node=name)
+		coreSpread.add(node.coreSpread, node=name)
+		memTotal.add(node.memTotal * 1024, node=name)
+		memUsed.add(node.memUsedPct, node=name)
+		swapUsed.add(node.swapUsedPct, node=name)
+		netIn.add(node.netInRate, node=name)
+		netOut.add(node.netOutRate, node=name)
+		diskR.add(node.blocksReadAvg * blockSize, node=name)
+		diskW.add(node.blocksWriteAvg * blockSize, node=name)
+
+		for daemon, attr in DAEMONS:
+			daemons.add(1 if getattr(node, attr) == 'Y' else 0, node=name, daemon=daemon)
+
+		for daemon, detail, count, cpuPct, mem in node.daemonStats:
+			daemonCPU.add(cpuPct, node=name, daemon=daemon, instance=detail)
+			daemonMem.add(mem, node=name, daemon=daemon, instance=detail)
+
+		for brickName, (size, used) in sorted(node.brickInfo.items()):
+			volume = cluster.brickXref[brickName].name if brickName in cluster.brickXref else ''
+			brickSize.add(size, node=name, brick=brickName, volume=volume)
+			brickUsed.add(used, node=name, brick=brickName, volume=volume)
+			brickClients.add(node.brickClients.get(brickName, 0), node=name, brick=brickName, volume=volume)
+
+	volBricks = family('gtop_volume_bricks', 'Number of bricks in the volume')
+	volUsable = family('gtop_volume_usable_bytes', 'Usable capacity of the volume')
+	volUsed = family('gtop_volume_used_bytes', 'Used capacity of the volume')
+	volRead = family('gtop_volume_read_bytes_per_second', 'Client read rate of the volume, from the brick devices')
+	volWrite = family('gtop_volume_write_bytes_per_second', 'Client write rate of the volume, from the brick devices')
+	volClients = family('gtop_volume_clients', 'Most connections to any one brick of the volume')
+
+	for volume in cluster.volumes:
+		volBricks.add(volume.numBricks, volume=volume.name, type=volume.volType)
+		volUsable.add(volume.usableSize, volume=volume.name, type=volume.volType)
+		volUsed.add(volume.usedSize, volume=volume.name, type=volume.volType)
+		volRead.add(volume.readRate, volume=volume.name, type=volume.volType)
+		volWrite.add(volume.writeRate, volume=volume.name, type=volume.volType)
+		volClients.add(volume.clients, volume=volume.name, type=volume.volType)
+
+	for name, help, value in (
+			('gtop_cluster_nodes_active', 'Nodes with glusterd running', cluster.activeNodes),
+			('gtop_cluster_cpu_busy_avg_percent', 'Average CPU busy across the nodes', cluster.avgCPU),
+			('gtop_cluster_cpu_busy_peak_percent', 'Highest CPU busy across the nodes', cluster.peakCPU),
+			('gtop_cluster_cpu_core_max_percent', 'Load of the busiest core across the nodes', cluster.hotCore),
+			('gtop_cluster_network_receive_bytes_per_second', 'Total network receive rate', cluster.aggrNetIn),
+			('gtop_cluster_network_transmit_bytes_per_second', 'Total network transmit rate', cluster.aggrNetOut),
+			('gtop_cluster_disk_read_bytes_per_second', 'Total disk read rate', cluster.aggrDiskR * blockSize),
+			('gtop_cluster_disk_write_bytes_per_second', 'Total disk write rate', cluster.aggrDiskW * blockSize),
+			('gtop_cluster_raw_bytes', 'Raw capacity of all bricks', cluster.rawCapacity),
+			('gtop_cluster_usable_bytes', 'Usable capacity of all volumes', cluster.usableCapacity),
+			('gtop_cluster_used_bytes', 'Used capacity of all volumes', cluster.usedCapacity)):
+		family(name, help).add(value)
+
+	lines = []
+	for f in families:
+		lines.extend(f.lines)
+	lines.append('# EOF\n')
+
+	return '\n'.join(lines)
+
+
+def clusterState(cluster, blockSize):
+	"""	Return the node, volume and cluster rows sent on the event stream, keyed by node/volume name """
+
+	nodes = {}
+	for node in cluster.nodes:
+		nodes[node.hostName] = {'state' : node.state,
+								'cpus' : node.procCount,
+								'cpuBusy' : node.cpuBusyPct,
+								'coreMax' : node.coreMax,
+								'coreSaturated' : node.coreSaturated,
+								'memBytes' : node.memTotal * 1024,
+								'memUsedPct' : node.memUsedPct,
+								'swapUsedPct' : node.swapUsedPct,
+								'netIn' : round(node.netInRate, 1),
+								'netOut' : round(node.netOutRate, 1),
+								'diskRead' : node.blocksReadAvg * blockSize,
+								'diskWrite' : node.blocksWriteAvg * blockSize,
+								'daemons' : dict([(daemon, getattr(node, attr) == 'Y') for daemon, attr in DAEMONS])}
+
+	volumes = {}
+	for volume in cluster.volumes:
+		volumes[volume.name] = {'type' : volume.volType,
+								'bricks' : volume.numBricks,
+								'usable' : volume.usableSize,
+								'used' : volume.usedSize,
+								'free' : volume.freeSpace,
+								'read' : round(volume.readRate, 1),
+								'write' : round(volume.writeRate, 1),
+								'clients' : volume.clients}
+
+	totals = {'activeNodes' : cluster.activeNodes,
+				'cpuAvg' : cluster.avgCPU,
+				'cpuPeak' : cluster.peakCPU,
+				'hotCore' : cluster.hotCore,
+				'hotCoreNode' : cluster.hotCoreNode,
+				'netIn' : round(cluster.aggrNetIn, 1),
+				'netOut' : round(cluster.aggrNetOut, 1),
+				'diskRead' : cluster.aggrDiskR * blockSize,
+				'diskWrite' : cluster.aggrDiskW * blockSize,
+				'raw' : cluster.rawCapacity,
+				'usable' : cluster.usableCapacity,
+				'used' : cluster.usedCapacity}
+
+	return {'time' : cluster.tickTime, 'nodes' : nodes, 'volumes' : volumes, 'cluster' : totals}
+
+
+def changedFields(old, new):
+	"""	Return the fields of a row that differ from the previous version of the row """
+
+	return dict([(key, value) for key, value in new.items() if old.get(key) != value])
+
+
+def stateDelta(old, new):
+	"""	Return the rows and fields that have changed between two cluster states """
+
+	delta = {'time' : new['time']}
+
+	for section in ('nodes', 'volumes'):
+		rows = {}
+		for name, row in new[section].items():
+			changed = changedFields(old[section].get(name, {}), row)
+			if changed:
+				rows[name] = changed
+		if rows:
+			delta[section] = rows
+
+	changed = changedFields(old['cluster'], new['cluster'])
+	if changed:
+		delta['cluster'] = changed
+
+	return delta
+
+
+def formatEvent(seq, event, doc):
+	return 'id: ' + str(seq) + '\nevent: ' + event + '\ndata: ' + json.dumps(doc, separators=(',',':')) + '\n\n'
+
+
+class EventStream:
+	"""	Holds the encoded events shared by all the /events clients. Each sample run is diffed
+		and encoded once, however many clients are connected """
+
+	def __init__(self, keyframe=12, backlog=32):
+
+		self.keyframeEvery = keyframe
+		self.cond = threading.Condition()
+		self.seq = 0
+		self.state = None
+		self.keyframe = None									# full state of the latest sample run
+		self.events = collections.deque(maxlen=backlog)		# recent (seq, event text)
+
+	def publish(self, state):
+
+		self.cond.acquire()
+		try:
+			self.seq += 1
+			self.keyframe = formatEvent(self.seq, 'keyframe', state)
+
+			if self.state is None or self.seq % self.keyframeEvery == 0:
+				event = self.keyframe
+			else:
+				event = formatEvent(self.seq, 'delta', stateDelta(self.state, state))
+
+			self.events.append((self.seq, event))
+			self.state = state
+			self.cond.notifyAll()
+		finally:
+			self.cond.release()
+
+	def next(self, seq, timeout):
+		"""	Wait for the events after seq, returning (newSeq, text). If the client has missed
+			events that are no longer held, the current keyframe is returned instead """
+
+		self.cond.acquire()
+		try:
+			if self.seq == seq:
+				self.cond.wait(timeout)
+			if self.seq == seq:
+				return seq, ''
+
+			if seq == 0 or self.events[0][0] > seq + 1:
+				return self.seq, self.keyframe
+			return self.seq, ''.join([event for eventSeq, event in self.events if eventSeq > seq])
+		finally:
+			self.cond.release()
+
+
+class ExportServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+
+class ExportHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""	Serve the pre-rendered buffers held by the exporter """
+
+	def do_GET(self):
+		exporter = self.server.exporter
+
+		if self.path.split('?')[0] == '/metrics':
+			body = exporter.metrics
+			self.send_response(200)
+			self.send_header('Content-Type', CONTENTTYPE)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		elif self.path.split('?')[0] == '/events':
+			self.streamEvents(exporter.events)
+
+		else:
+			self.send_error(404)
+
+	def streamEvents(self, stream):
+		"""	Send the event stream until the client goes away """
+
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/event-stream')
+		self.send_header('Cache-Control', 'no-cache')
+		self.end_headers()
+
+		seq = 0
+		try:
+			while True:
+				seq, text = stream.next(seq, 15)
+				self.wfile.write(text or ': keepalive\n\n')
+				self.wfile.flush()
+		except socket.error:
+			pass
+
+	def log_message(self, format, *args):
+		pass											# keep scrapes out of the console/stdout
+
+
+class Exporter:
+	"""	HTTP server thread publishing the cluster metrics and event stream """
+
+	def __init__(self, address, keyframe=12):
+
+		self.metrics = '# EOF\n'							# replaced as a whole on each update
+		self.events = EventStream(keyframe)
+
+		self.server = ExportServer(parseAddress(address), ExportHandler)
+		self.server.exporter = self
+
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def update(self, cluster, blockSize):
+		"""	Render the current state of the cluster, called once per sample run """
+
+		self.metrics = renderOpenMetrics(cluster, blockSize)
+		self.events.publish(clusterState(cluster, blockSize))
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+#
+#	gtop - A performance and capacity monitoring program for glusterfs clusters
+#
+#	gtop-heal : self-heal backlog of the bricks on the local node
+#
+#   Copyright (C) 2013 Paul Cuzner
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Each file needing a heal has an entry (a hard link named by it's gfid) in the brick's
+# .glusterfs/indices/xattrop directory, alongside the xattrop-<uuid> base file. Counting the
+# entries gives the pending heals for the brick, and the change between counts the drain rate.
+#
+# The index can hold millions of entries, so it's counted a slice at a time from the gtop main
+# loop, resuming where it left off on the next pass. A brick whose index directory mtime hasn't
+# changed since the last count isn't read again.
+#
+
+import os
+import time
+import ctypes, ctypes.util
+
+try:
+	from scandir import scandir							# python-scandir, reads the directory lazily
+except ImportError:
+	scandir = None
+
+XATTROP = os.path.join('.glusterfs', 'indices', 'xattrop')
+
+# number of entries counted between checks of the time slice
+CHECKEVERY = 256
+
+
+class Dirent64(ctypes.Structure):
+	_fields_ = [('d_ino', ctypes.c_uint64), ('d_off', ctypes.c_int64), ('d_reclen', ctypes.c_ushort),
+				('d_type', ctypes.c_ubyte), ('d_name', ctypes.c_char * 256)]
+
+try:
+	libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+	libc.opendir.argtypes = [ctypes.c_char_p]
+	libc.opendir.restype = ctypes.c_void_p
+	libc.readdir64.argtypes = [ctypes.c_void_p]
+	libc.readdir64.restype = ctypes.POINTER(Dirent64)
+	libc.closedir.argtypes = [ctypes.c_void_p]
+except (OSError, AttributeError):
+	libc = None											# no glibc, fall back to os.listdir
+
+
+class DirectoryReader:
+	"""	Iterate over the names in a directory with opendir/readdir. The kernel hands them over a
+		buffer at a time, so a huge directory is never read in one go the way os.listdir reads it """
+
+	def __init__(self, path):
+
+		self.dirp = libc.opendir(path)
+		if not self.dirp:
+			err = ctypes.get_errno()
+			raise OSError(err, os.strerror(err), path)
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+
+		while self.dirp:
+			ctypes.set_errno(0)
+			entry = libc.readdir64(self.dirp)
+			if not entry:
+				err = ctypes.get_errno()
+				self.close()
+				if err:
+					raise OSError(err, os.strerror(err))
+				break
+			name = entry.contents.d_name
+			if name not in ('.', '..'):
+				return name
+		raise StopIteration
+
+	def close(self):
+
+		if self.dirp:
+			libc.closedir(self.dirp)
+			self.dirp = None
+
+	__del__ = close
+
+
+def indexEntries(path):
+	"""	Return an iterator over the names in a directory, read lazily """
+
+	if scandir:
+		return (entry.name for entry in scandir(path))
+	if libc:
+		return DirectoryReader(path)
+	return iter(os.listdir(path))
+
+
+class BrickBacklog:
+	"""	Pending heal count of a single brick """
+
+	def __init__(self, path):
+
+		self.indexDir = os.path.join(path, XATTROP)
+		self.pending = None									# entries at the last complete count
+		self.rate = 0										# entries healed/sec, negative when growing
+		self.countTime = 0									# when the last count started
+		self.mtime = None									# index mtime at the last count
+
+		self.entries = None									# the count in progress
+		self.partial = 0
+		self.startTime = 0
+
+	def start(self, now):
+		"""	Begin a count of the index, returning False when the index is unchanged (or missing) """
+
+		try:
+			mtime = os.stat(self.indexDir).st_mtime
+		except OSError:
+			self.pending, self.rate, self.mtime = None, 0, None
+			return False
+
+		if mtime == self.mtime:
+			self.finish(self.pending, now)
+			return False
+
+		try:
+			self.entries = indexEntries(self.indexDir)
+		except OSError:
+			return False
+		self.mtime = mtime
+		self.partial = 0
+		self.startTime = now
+		return True
+
+	def step(self, deadline):
+		"""	Continue the count until the deadline, returning True once it's complete """
+
+		seen = 0
+		try:
+			for name in self.entries:
+				if not name.startswith('xattrop-'):
+					self.partial += 1
+				seen += 1
+				if seen % CHECKEVERY == 0 and time.time() >= deadline:
+					return False
+		except OSError:
+			self.mtime = None								# directory went away, count again next time
+
+		self.entries = None
+		self.finish(self.partial, self.startTime)
+		return True
+
+	def finish(self, count, now):
+
+		if self.pending is not None and count is not None and now > self.countTime:
+			self.rate = (self.pending - count) / (now - self.countTime)
+		self.pending = count
+		self.countTime = now
+
+
+class HealScanner:
+	"""	Counts the heal backlog of the local bricks of each volume, every interval seconds """
+
+	def __init__(self, volumeBricks, interval=5, timeSlice=0.05):
+
+		self.interval = interval
+		self.timeSlice = timeSlice
+		self.volumes = dict([(volName, [BrickBacklog(path) for path in paths])
+								for volName, paths in volumeBricks.items()])
+		self.queue = []										# bricks still to count this interval
+		self.nextRun = 0
+
+	def service(self):
+		"""	Spend up to timeSlice counting, called from the main loop """
+
+		now = time.time()
+		if not self.queue:
+			if now < self.nextRun:
+				return
+			self.nextRun = now + self.interval
+			self.queue = [backlog for volName in sorted(self.volumes) for backlog in self.volumes[volName]]
+
+		deadline = now + self.timeSlice
+		while self.queue:
+			backlog = self.queue[0]
+			if backlog.entries is None and not backlog.start(time.time()):
+				self.queue.pop(0)
+				continue
+			if not backlog.step(deadline):
+				return
+			self.queue.pop(0)
+
+	def update(self, volumes):
+		"""	Set the pending heal count and drain rate of the volumes with local bricks """
+
+		for volume in volumes:
+			backlogs = [backlog for backlog in self.volumes.get(volume.name, []) if backlog.pending is not None]
+			if backlogs:
+				volume.healPending = sum([backlog.pending for backlog in backlogs])
+				volume.healRate = sum([backlog.rate for backlog in backlogs])
+			else:
+				volume.healPending = None
+				volume.healRate = 0
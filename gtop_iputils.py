@@ -19,9 +19,66 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import socket
+import socket, errno, select
+import struct
+import random
+import time
 import netsnmp
 
+# netsnmp varbind types that hold numbers, and the exceptions an agent returns in place of a value
+NUMERICTYPES = frozenset(['INTEGER', 'INTEGER32', 'UNSIGNED32', 'UINTEGER', 'COUNTER', 'COUNTER64', 'GAUGE', 'TICKS'])
+MISSINGTYPES = frozenset(['NOSUCHOBJECT', 'NOSUCHINSTANCE', 'ENDOFMIBVIEW', 'NULL', None])
+
+
+def typedColumn(varbinds):
+	"""	Return the values of a column's varbinds. A column holds a single type, so it's checked once and
+		the whole column converted together, rather than testing every value with isdigit(). Missing
+		values (and rows a walk didn't return - None in varbinds) are None """
+	
+	values = [None if varbind is None or varbind.type in MISSINGTYPES else varbind.val for varbind in varbinds]
+	types = set([varbind.type for varbind in varbinds if varbind is not None]) - MISSINGTYPES
+	if types and types <= NUMERICTYPES:
+		if None in values:
+			values = [None if value is None else int(value) for value in values]
+		else:
+			values = map(int, values)
+	return values
+
+
+class SNMPTable:
+	"""	Typed values of some of a table's columns, keyed by instance. iids holds the row instances in 
+		order and columns maps each tag to it's values in the same order (None where a row is missing) """
+	
+	def __init__(self, iids, columns):
+		
+		self.iids = iids
+		self.columns = columns
+		self.rowIndex = dict([(iid, n) for n, iid in enumerate(iids)])
+	
+	def __len__(self):
+		return len(self.iids)
+	
+	def value(self, tag, iid, default=None):
+		
+		n = self.rowIndex.get(str(iid))
+		value = self.columns[tag][n] if n is not None else None
+		return default if value is None else value
+	
+	def row(self, iid, tags):
+		"""	Return a row's values for the given columns, in order """
+		
+		n = self.rowIndex.get(str(iid))
+		return [self.columns[tag][n] if n is not None else None for tag in tags]
+	
+	def find(self, tag, value):
+		"""	Return the instance of the first row where the column holds value, or None """
+		
+		for iid, cell in zip(self.iids, self.columns[tag]):
+			if cell == value:
+				return iid
+		return None
+
+
 class SNMPsession:
 	
 	def __init__(self,
@@ -55,6 +112,128 @@ class SNMPsession:
 
 		return result
 		
+	def get(self, varList):
+		"""	Issue a single snmpget for a list of (tag, instance) pairs, returning the values in the 
+			same order. Values that are missing on the host are returned as None
+		"""
+		
+		varbinds = netsnmp.VarList(*[netsnmp.Varbind(tag, str(iid)) for tag, iid in varList])
+		snmpOut = netsnmp.snmpget(varbinds, Version=self.version, DestHost=self.destHost, Community=self.community, Retries=0, Timeout=100000)
+		
+		result = []
+		for element in snmpOut:
+			if element is not None and element.isdigit():
+				result.append(int(element))
+			else:
+				result.append(element)
+		
+		return result
+	
+	def set(self, tag, iid, value, valueType='INTEGER'):
+		"""	Issue an snmpset of a single instance, returning True when the agent accepted it """
+		
+		varbind = netsnmp.Varbind(tag, str(iid), str(value), valueType)
+		return bool(netsnmp.snmpset(varbind, Version=self.version, DestHost=self.destHost, Community=self.community, Retries=0, Timeout=100000))
+	
+	def walk(self, tag):
+		"""	Walk a table column returning (instance, value) pairs, for tables where the index carries
+			the information e.g. ifStackTable
+		"""
+		
+		varList = netsnmp.VarList(netsnmp.Varbind(tag))
+		netsnmp.snmpwalk(varList, Version=self.version, DestHost=self.destHost, Community=self.community, Retries=0, Timeout=100000)
+		
+		result = []
+		for varbind in varList:
+			value = varbind.val
+			if value is not None and value.isdigit():
+				value = int(value)
+			result.append((varbind.iid, value))
+		
+		return result
+	
+	def iterate(self, tag, pageSize=64):
+		"""	Walk a table column a page at a time with GETBULK, yielding (instance, value) pairs. Unlike
+			walk() the table is never held in memory, so it suits large tables e.g. tcpConnectionTable
+		"""
+		
+		session = netsnmp.Session(Version=self.version, DestHost=self.destHost, Community=self.community, Retries=0, Timeout=100000)
+		iid = ''
+		while True:
+			varList = netsnmp.VarList(netsnmp.Varbind(tag, iid))
+			session.getbulk(0, pageSize, varList)
+			
+			for varbind in varList:
+				if varbind.tag != tag or varbind.type == 'ENDOFMIBVIEW':
+					return										# walked off the end of the column
+				value = varbind.val
+				if value is not None and value.isdigit():
+					value = int(value)
+				yield varbind.iid, value
+			
+			if not varList or varList[-1].iid == iid:
+				return
+			iid = varList[-1].iid
+	
+	def subtree(self, oid, pageSize=256):
+		"""	Fetch everything below a numeric OID with GETBULK - a single request unless the agent has
+			to split the response. Returns (oid below the given one, value) pairs, with the values left
+			as strings, an empty list when the agent answered but the subtree doesn't exist, or None 
+			when the agent didn't answer
+		"""
+		
+		session = netsnmp.Session(Version=self.version, DestHost=self.destHost, Community=self.community, 
+									Retries=0, Timeout=100000, UseNumeric=1)
+		base = oid.strip('.')
+		start = '.' + base
+		result = []
+		while True:
+			varList = netsnmp.VarList(netsnmp.Varbind(start))
+			session.getbulk(0, pageSize, varList)
+			
+			if not [varbind for varbind in varList if varbind.type]:
+				return None										# timed out - the request varbind is untouched
+			
+			for varbind in varList:
+				full = varbind.tag.strip('.') + ('.' + varbind.iid if varbind.iid else '')
+				if not full.startswith(base + '.') or varbind.type == 'ENDOFMIBVIEW':
+					return result								# walked off the end of the subtree
+				result.append((full[len(base) + 1:], varbind.val))
+			
+			if not varList or '.' + full == start:
+				return result
+			start = '.' + full
+	
+	def table(self, tags, iids=None):
+		"""	Fetch columns of a table as an SNMPTable. Given the instances, exactly those rows are 
+			requested in a single get (scalars are instance '0'). Otherwise each column is walked, and 
+			the rows matched up by instance - a row an agent skips in one column doesn't shift the rest.
+			A host that doesn't answer gives an empty table, or rows of None for a get
+		"""
+		
+		if iids is not None:
+			iids = [str(iid) for iid in iids]
+			varList = netsnmp.VarList(*[netsnmp.Varbind(tag, iid) for tag in tags for iid in iids])
+			netsnmp.snmpget(varList, Version=self.version, DestHost=self.destHost, Community=self.community, Retries=0, Timeout=100000)
+			
+			columns = {}
+			for n, tag in enumerate(tags):
+				columns[tag] = typedColumn(varList[n * len(iids):(n + 1) * len(iids)])
+			return SNMPTable(iids, columns)
+		
+		walked = []
+		for tag in tags:
+			varList = netsnmp.VarList(netsnmp.Varbind(tag))
+			netsnmp.snmpwalk(varList, Version=self.version, DestHost=self.destHost, Community=self.community, Retries=0, Timeout=100000)
+			walked.append(dict([(varbind.iid, varbind) for varbind in varList]))
+		
+		rows = sorted(set([iid for cells in walked for iid in cells]), 
+						key=lambda iid: [int(arc) for arc in iid.split('.') if arc.isdigit()])
+		columns = {}
+		for tag, cells in zip(tags, walked):
+			columns[tag] = typedColumn([cells.get(iid) for iid in rows])
+		return SNMPTable(rows, columns)
+
 def validIPv4(ip):
 	"""	Attempt to use the inet_aton function to validate whether a given IP is valid or not """
 	
@@ -77,6 +256,16 @@ def forwardDNS(name):
 	
 	return result	
 	
+def resolveAddresses(name):
+	"""	Return all the IPv4 addresses a name resolves to, or an empty list """
+	
+	try:
+		result = socket.gethostbyname_ex(name)[2]
+	except (socket.gaierror, socket.herror):
+		result = []
+	
+	return result
+	
 def reverseDNS(ip):
 	"""	Use socket module to find name from IP, or just return the IP"""
 	try:
@@ -87,3 +276,373 @@ def reverseDNS(ip):
 		result = "" 
 	
 	return result
+
+
+#------------------------------------------------------------------------------------------------------
+# Native SNMPv2c client. Messages are BER encoded here and sent from a single non-blocking udp socket, 
+# so requests to any number of hosts can be in flight at once - each response is matched back to it's
+# request by the request-id. Values are decoded straight to python types (Counter64 -> long, 
+# OctetString -> str etc.) rather than through netsnmp's strings.
+#------------------------------------------------------------------------------------------------------
+
+# BER/SNMP tags
+INTEGER, OCTETSTRING, NULL, OBJECTID, SEQUENCE = 0x02, 0x04, 0x05, 0x06, 0x30
+IPADDRESS, COUNTER32, GAUGE32, TIMETICKS, OPAQUE, COUNTER64 = 0x40, 0x41, 0x42, 0x43, 0x44, 0x46
+NOSUCHOBJECT, NOSUCHINSTANCE, ENDOFMIBVIEW = 0x80, 0x81, 0x82
+GETREQUEST, GETNEXTREQUEST, RESPONSE, SETREQUEST, GETBULKREQUEST = 0xA0, 0xA1, 0xA2, 0xA3, 0xA5
+
+UNSIGNEDTAGS = (COUNTER32, GAUGE32, TIMETICKS, COUNTER64)
+
+ERRORSTATUS = ('noError', 'tooBig', 'noSuchName', 'badValue', 'readOnly', 'genErr', 'noAccess', 'wrongType',
+				'wrongLength', 'wrongEncoding', 'wrongValue', 'noCreation', 'inconsistentValue', 
+				'resourceUnavailable', 'commitFailed', 'undoFailed', 'authorizationError', 'notWritable',
+				'inconsistentName')
+
+
+class SNMPError(Exception):
+	pass
+
+
+class EndOfMibView:
+	"""	Value returned past the end of the agent's MIB view """
+	
+	def __repr__(self):
+		return 'endOfMibView'
+
+endOfMibView = EndOfMibView()
+
+
+def berLength(size):
+	
+	if size < 0x80:
+		return chr(size)
+	octets = ''
+	while size:
+		octets = chr(size & 0xff) + octets
+		size >>= 8
+	return chr(0x80 | len(octets)) + octets
+
+def berEncode(tag, payload):
+	return chr(tag) + berLength(len(payload)) + payload
+
+def encodeInteger(value, tag=INTEGER):
+	"""	Minimal two's complement (unsigned types get a leading 0 when the top bit is set) """
+	
+	octets = ''
+	while True:
+		octets = chr(value & 0xff) + octets
+		value >>= 8
+		if (value == 0 and not ord(octets[0]) & 0x80) or (value == -1 and ord(octets[0]) & 0x80):
+			break
+	return berEncode(tag, octets)
+
+def encodeOID(oid):
+	
+	arcs = [int(arc) for arc in str(oid).strip('.').split('.')]
+	if len(arcs) < 2:
+		raise SNMPError("invalid OID " + str(oid))
+	octets = ''
+	for arc in [arcs[0] * 40 + arcs[1]] + arcs[2:]:
+		chunk = chr(arc & 0x7f)
+		arc >>= 7
+		while arc:
+			chunk = chr(0x80 | (arc & 0x7f)) + chunk
+			arc >>= 7
+		octets += chunk
+	return berEncode(OBJECTID, octets)
+
+def encodeValue(value, tag=None):
+	"""	Encode a varbind value - None is NULL (for requests), ints are INTEGER unless a tag is given.
+		The exception tags (noSuchObject etc.) carry no value """
+	
+	if tag in (NULL, NOSUCHOBJECT, NOSUCHINSTANCE, ENDOFMIBVIEW) or (value is None and tag is None):
+		return berEncode(tag or NULL, '')
+	if tag is None:
+		tag = INTEGER if isinstance(value, (int, long)) else OCTETSTRING
+	if tag in (INTEGER,) + UNSIGNEDTAGS:
+		return encodeInteger(value, tag)
+	if tag == OBJECTID:
+		return encodeOID(value)
+	if tag == IPADDRESS:
+		return berEncode(tag, socket.inet_aton(value))
+	return berEncode(tag, str(value))
+
+def oidKey(oid):
+	"""	'1.3.6.1' -> (1, 3, 6, 1), for comparing OIDs in lexicographic order """
+	
+	return tuple([int(arc) for arc in str(oid).strip('.').split('.')])
+
+def decodeTLV(data, pos):
+	"""	Return (tag, start of value, end of value) of the element at pos """
+	
+	if pos + 2 > len(data):
+		raise SNMPError("truncated message")
+	tag, size = ord(data[pos]), ord(data[pos + 1])
+	pos += 2
+	if size & 0x80:
+		count = size & 0x7f
+		if count == 0 or count > 4 or pos + count > len(data):
+			raise SNMPError("unsupported length")
+		size = 0
+		for octet in data[pos:pos + count]:
+			size = (size << 8) | ord(octet)
+		pos += count
+	if pos + size > len(data):
+		raise SNMPError("truncated message")
+	return tag, pos, pos + size
+
+def decodeInteger(octets, signed=True):
+	
+	value = 0
+	for octet in octets:
+		value = (value << 8) | ord(octet)
+	if signed and octets and ord(octets[0]) & 0x80:
+		value -= 1 << (8 * len(octets))
+	return value
+
+def decodeOID(octets):
+	
+	if not octets:
+		raise SNMPError("empty OID")
+	arcs = []
+	arc = 0
+	for octet in octets:
+		arc = (arc << 7) | (ord(octet) & 0x7f)
+		if not ord(octet) & 0x80:
+			arcs.append(arc)
+			arc = 0
+	first = min(arcs[0] // 40, 2) if arcs else 0
+	return '.'.join([str(arc) for arc in [first, arcs[0] - 40 * first] + arcs[1:]])
+
+def decodeValue(tag, octets):
+	"""	Convert a varbind value to it's python type. noSuchObject/noSuchInstance are None, like the
+		missing values of SNMPsession.get """
+	
+	if tag == INTEGER:
+		return decodeInteger(octets)
+	if tag in UNSIGNEDTAGS:
+		return decodeInteger(octets, signed=False)
+	if tag == OBJECTID:
+		return decodeOID(octets)
+	if tag == IPADDRESS:
+		return socket.inet_ntoa(octets) if len(octets) == 4 else octets
+	if tag in (NULL, NOSUCHOBJECT, NOSUCHINSTANCE):
+		return None
+	if tag == ENDOFMIBVIEW:
+		return endOfMibView
+	return octets											# OctetString, Opaque
+
+def encodeMessage(community, pduType, requestId, varbinds, field1=0, field2=0):
+	"""	Build a v2c message. field1/field2 are error-status/index, or non-repeaters/max-repetitions
+		for a GETBULK. varbinds are (oid, value) or (oid, value, tag) """
+	
+	encoded = ''.join([berEncode(SEQUENCE, encodeOID(varbind[0]) + encodeValue(*varbind[1:])) for varbind in varbinds])
+	pdu = encodeInteger(requestId) + encodeInteger(field1) + encodeInteger(field2) + berEncode(SEQUENCE, encoded)
+	return berEncode(SEQUENCE, encodeInteger(1) + berEncode(OCTETSTRING, community) + berEncode(pduType, pdu))
+
+def decodeMessage(data):
+	"""	Return (community, pdu type, request-id, error-status, error-index, [(oid, value)]) """
+	
+	tag, pos, end = decodeTLV(data, 0)
+	if tag != SEQUENCE:
+		raise SNMPError("not an SNMP message")
+	
+	fields = []
+	for expected in (INTEGER, OCTETSTRING):
+		tag, start, pos = decodeTLV(data, pos)
+		if tag != expected:
+			raise SNMPError("malformed message header")
+		fields.append(data[start:pos])
+	if decodeInteger(fields[0]) != 1:
+		raise SNMPError("not an SNMPv2c message")
+	
+	pduType, pos, end = decodeTLV(data, pos)
+	values = []
+	for n in range(3):
+		tag, start, pos = decodeTLV(data, pos)
+		if tag != INTEGER:
+			raise SNMPError("malformed PDU")
+		values.append(decodeInteger(data[start:pos]))
+	
+	tag, pos, end = decodeTLV(data, pos)
+	varbinds = []
+	while pos < end:
+		tag, start, pos = decodeTLV(data, pos)
+		oidTag, oidStart, oidEnd = decodeTLV(data, start)
+		valueTag, valueStart, valueEnd = decodeTLV(data, oidEnd)
+		if oidTag != OBJECTID:
+			raise SNMPError("malformed varbind")
+		varbinds.append((decodeOID(data[oidStart:oidEnd]), decodeValue(valueTag, data[valueStart:valueEnd])))
+	
+	return fields[1], pduType, values[0], values[1], values[2], varbinds
+
+
+class SNMPRequest:
+	"""	A request in flight. Once done, varbinds holds the [(oid, value)] response, or error says why
+		there isn't one """
+	
+	def __init__(self, host, address, message, requestId, retries):
+		
+		self.host = host
+		self.address = address
+		self.message = message
+		self.requestId = requestId
+		self.retries = retries
+		self.sent = 0
+		self.done = False
+		self.varbinds = []
+		self.error = ''
+
+
+class AsyncSNMP:
+	"""	SNMPv2c over one non-blocking udp socket. get/getNext/getBulk send a request and return it 
+		straight away, poll() collects the responses (and resends requests that have timed out) and
+		wait() polls until a set of requests are all done """
+	
+	def __init__(self, community='gluster', timeout=1.0, retries=1, port=161):
+		
+		self.community = community
+		self.timeout = timeout
+		self.retries = retries
+		self.port = port
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.setblocking(0)
+		self.pending = {}									# request-id -> SNMPRequest
+		self.nextId = random.randint(1, 2**30)
+		self.addresses = {}									# host -> (ip, port)
+	
+	def address(self, host):
+		"""	Resolve host or host:port, once """
+		
+		if host not in self.addresses:
+			name, sep, port = host.partition(':')
+			ip = forwardDNS(name)
+			if not ip:
+				raise SNMPError("unable to resolve " + name)
+			self.addresses[host] = (ip, int(port or self.port))
+		return self.addresses[host]
+	
+	def request(self, host, pduType, varbinds, field1=0, field2=0):
+		
+		requestId = self.nextId
+		self.nextId = self.nextId % (2**31 - 1) + 1
+		request = SNMPRequest(host, None, encodeMessage(self.community, pduType, requestId, varbinds, field1, field2),
+								requestId, self.retries)
+		try:
+			request.address = self.address(host)
+		except SNMPError, e:
+			request.done, request.error = True, str(e)
+			return request
+		
+		self.pending[requestId] = request
+		self.transmit(request)
+		return request
+	
+	def get(self, host, oids):
+		return self.request(host, GETREQUEST, [(oid, None) for oid in oids])
+	
+	def getNext(self, host, oids):
+		return self.request(host, GETNEXTREQUEST, [(oid, None) for oid in oids])
+	
+	def getBulk(self, host, oids, maxRepetitions=64, nonRepeaters=0):
+		return self.request(host, GETBULKREQUEST, [(oid, None) for oid in oids], nonRepeaters, maxRepetitions)
+	
+	def transmit(self, request):
+		
+		try:
+			self.sock.sendto(request.message, request.address)
+		except socket.error, e:
+			if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+				self.finish(request, "send failed - " + str(e))
+				return
+		request.sent = time.time()
+	
+	def finish(self, request, error=''):
+		
+		self.pending.pop(request.requestId, None)
+		request.done = True
+		request.error = error
+	
+	def poll(self, timeout=0):
+		"""	Handle the responses that have arrived, waiting up to timeout seconds for the first one.
+			Returns the requests completed by this call """
+		
+		completed = []
+		if self.pending and select.select([self.sock], [], [], timeout)[0]:
+			while True:
+				try:
+					data, source = self.sock.recvfrom(65535)
+				except socket.error, e:
+					break										# EAGAIN - nothing more to read
+				try:
+					community, pduType, requestId, status, index, varbinds = decodeMessage(data)
+				except SNMPError:
+					continue									# not something we can use
+				
+				request = self.pending.get(requestId)
+				if request is None or pduType != RESPONSE or source != request.address:
+					continue									# late, duplicate or not from the host asked
+				
+				request.varbinds = varbinds
+				self.finish(request, '' if status == 0 else 
+							(ERRORSTATUS[status] if status < len(ERRORSTATUS) else 'error ' + str(status)))
+				completed.append(request)
+		
+		now = time.time()
+		for request in self.pending.values():
+			if now - request.sent >= self.timeout:
+				if request.retries > 0:
+					request.retries -= 1
+					self.transmit(request)
+				else:
+					self.finish(request, "timeout")
+					completed.append(request)
+		
+		return completed
+	
+	def wait(self, requests, timeout=None):
+		"""	Poll until all the requests are done (or timeout seconds have passed) """
+		
+		deadline = time.time() + timeout if timeout is not None else None
+		while [request for request in requests if not request.done]:
+			remaining = min([request.sent + self.timeout for request in requests if not request.done]) - time.time()
+			if deadline is not None:
+				if time.time() >= deadline:
+					break
+				remaining = min(remaining, deadline - time.time())
+			self.poll(max(remaining, 0))
+		return requests
+	
+	def walk(self, hosts, oid, maxRepetitions=64):
+		"""	Walk the subtree below oid on each host with pipelined GETBULKs - every host's next request
+			is sent as soon as it's previous page arrives. Returns {host : [(oid, value)]} """
+		
+		prefix = str(oid).strip('.') + '.'
+		results = dict([(host, []) for host in hosts])
+		position = dict([(host, oidKey(oid)) for host in hosts])
+		inflight = [self.getBulk(host, [oid], maxRepetitions) for host in hosts]
+		while inflight:
+			self.wait([request for request in inflight if not request.done][:1])
+			nextRound = []
+			for request in inflight:
+				if not request.done:
+					nextRound.append(request)
+					continue
+				last = None
+				for varbindOID, value in ([] if request.error else request.varbinds):
+					if not varbindOID.startswith(prefix) or value is endOfMibView:
+						last = None
+						break
+					if oidKey(varbindOID) <= position[request.host]:
+						last = None								# agent isn't returning oids in order
+						break
+					results[request.host].append((varbindOID, value))
+					last = varbindOID
+					position[request.host] = oidKey(varbindOID)
+				if last:
+					nextRound.append(self.getBulk(request.host, [last], maxRepetitions))
+			inflight = nextRound
+		return results
+	
+	def close(self):
+		self.sock.close()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+#
+#	gtop - A performance and capacity monitoring program for glusterfs clusters
+#
+#	gtop-local : read the stats of the host gtop is running on directly from /proc and /sys
+#
+#   Copyright (C) 2013 Paul Cuzner
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# The local node doesn't need to go through snmpd - the same figures are available straight
+# from the kernel, without the agent's cache making them up to 5 seconds old. Each function
+# returns the raw counters, the rates are worked out by the caller.
+#
+
+import os
+import socket, struct, fcntl
+
+PROC = '/proc'
+SYS = '/sys'
+
+SIOCGIFADDR = 0x8915
+
+
+def readCPU(proc=PROC):
+	"""	Return the cpu counters (jiffies) from /proc/stat as a list - the total for all the cpus
+		first, then each core. Each entry is [user, nice, system, idle, iowait, irq, softirq, steal] """
+
+	cpus = []
+	for line in open(os.path.join(proc, 'stat')):
+		if line.startswith('cpu'):
+			cpus.append([int(value) for value in line.split()[1:9]])
+	return cpus
+
+
+def readMemInfo(proc=PROC):
+	"""	Return /proc/meminfo as a dict of name -> kB """
+
+	memInfo = {}
+	for line in open(os.path.join(proc, 'meminfo')):
+		words = line.replace(':', ' ').split()
+		if len(words) >= 2 and words[1].isdigit():
+			memInfo[words[0]] = int(words[1])
+	return memInfo
+
+
+def readNetDev(proc=PROC):
+	"""	Return /proc/net/dev as a dict of interface -> [rx bytes, tx bytes, rx errs, tx errs, rx drop] """
+
+	interfaces = {}
+	for line in open(os.path.join(proc, 'net', 'dev')):
+		if ':' not in line:
+			continue										# headings
+		name, counters = line.split(':', 1)
+		values = [int(value) for value in counters.split()]
+		interfaces[name.strip()] = [values[0], values[8], values[2], values[10], values[3]]
+	return interfaces
+
+
+def readDiskStats(proc=PROC):
+	"""	Return /proc/diskstats as a dict of device -> [reads, sectors read, writes, sectors written] """
+
+	devices = {}
+	for line in open(os.path.join(proc, 'diskstats')):
+		words = line.split()
+		if len(words) >= 10:
+			devices[words[2]] = [int(words[3]), int(words[5]), int(words[7]), int(words[9])]
+	return devices
+
+
+def physicalDisks(sys=SYS):
+	"""	Return the names of the whole, physical disks. Partitions, device-mapper, md and loop devices
+		sit on top of these, so only these are added up for the node's disk I/O """
+
+	blockDir = os.path.join(sys, 'block')
+	return [name for name in os.listdir(blockDir) if os.path.exists(os.path.join(blockDir, name, 'device'))]
+
+
+def blockDevice(path, sys=SYS):
+	"""	Return the kernel name (as used in /proc/diskstats) of the device holding a path, or '' """
+
+	try:
+		dev = os.stat(path).st_dev
+	except OSError:
+		return ''
+	link = os.path.join(sys, 'dev', 'block', str(os.major(dev)) + ':' + str(os.minor(dev)))
+	if not os.path.exists(link):
+		return ''
+	return os.path.basename(os.path.realpath(link))
+
+
+def fsUsage(path):
+	"""	Return the (size, used) bytes of the filesystem holding a path """
+
+	st = os.statvfs(path)
+	return st.f_blocks * st.f_frsize, (st.f_blocks - st.f_bfree) * st.f_frsize
+
+
+def ifAddress(name):
+	"""	Return the IPv4 address of an interface, or '' """
+
+	s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	try:
+		return socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack('256s', name[:15]))[20:24])
+	except IOError:
+		return ''
+	finally:
+		s.close()
+
+
+def ifSpeed(name, sys=SYS):
+	"""	Return the link speed of an interface in Mbit/s, 0 when it's unknown (e.g. virtual interfaces) """
+
+	try:
+		speed = int(open(os.path.join(sys, 'class', 'net', name, 'speed')).read())
+	except (IOError, ValueError):
+		return 0
+	return max(speed, 0)
+
+
+def ifLower(name, sys=SYS):
+	"""	Return the interfaces below an interface - the members of a bond/team, or a vlan's parent """
+
+	netDir = os.path.join(sys, 'class', 'net', name)
+	try:
+		lower = [entry[len('lower_'):] for entry in os.listdir(netDir) if entry.startswith('lower_')]
+	except OSError:
+		return []
+
+	# older kernels don't have the lower_ links, but list a bond's members here
+	if not lower and os.path.exists(os.path.join(netDir, 'bonding', 'slaves')):
+		try:
+			lower = open(os.path.join(netDir, 'bonding', 'slaves')).read().split()
+		except IOError:
+			pass
+	return lower
+
+
+def readProcesses(proc=PROC):
+	"""	Return [pid, name, parameters, cpu centi-seconds, resident kB] for each process - the same
+		figures snmpd gives in hrSWRunName, hrSWRunParameters, hrSWRunPerfCPU and hrSWRunPerfMem """
+
+	ticks = os.sysconf('SC_CLK_TCK')
+	pageKB = os.sysconf('SC_PAGE_SIZE') / 1024
+
+	processes = []
+	for pid in os.listdir(proc):
+		if not pid.isdigit():
+			continue
+		try:
+			stat = open(os.path.join(proc, pid, 'stat')).read()
+			cmdline = open(os.path.join(proc, pid, 'cmdline')).read()
+		except IOError:
+			continue										# process has exited
+		name = stat[stat.find('(') + 1:stat.rfind(')')]
+		fields = stat[stat.rfind(')') + 2:].split()
+		cpu = (int(fields[11]) + int(fields[12])) * 100 / ticks		# utime + stime
+		parms = ' '.join([word for word in cmdline.split('\0')[1:] if word])
+		processes.append([int(pid), name, parms, cpu, int(fields[21]) * pageKB])
+	return processes
+
+
+def readTcpEstablished(ports, proc=PROC):
+	"""	Count the established tcp connections (IPv4 and IPv6) to each of the given local ports """
+
+	counts = dict([(port, 0) for port in ports])
+	for table in ('tcp', 'tcp6'):
+		try:
+			lines = open(os.path.join(proc, 'net', table))
+		except IOError:
+			continue										# no IPv6
+		for line in lines:
+			words = line.split(None, 4)
+			if len(words) > 3 and words[3] == '01':		# TCP_ESTABLISHED
+				port = int(words[1].rsplit(':', 1)[-1], 16)
+				if port in counts:
+					counts[port] += 1
+	return counts
@@ -0,0 +1,525 @@
+#!/usr/bin/env python
+#
+#	gtop - A performance and capacity monitoring program for glusterfs clusters
+#
+#	gtop-output : batch mode output formats
+#
+#   Copyright (C) 2013 Paul Cuzner
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Each sample run is formatted into a single buffer and handed to the stream in one write,
+# rather than a print per node.
+#
+# Formats
+#	readable .. fixed width columns, with the headings repeated each screen full
+#	raw      .. CSV, with a heading row at the start
+#	json     .. JSON lines, an object per node (and/or the cluster) per sample run
+#	binary   .. a header describing the fields and nodes, followed by a record per sample run
+#				(see readBinary)
+#
+# Output normally goes to stdout, or to a RotatingFile for long running collection. A rotating
+# file is split into segments by size and/or age, each starting with the formats header, and
+# the compression is done by a background thread so it never delays the sample runs.
+#
+
+import os
+import signal
+import struct
+import json
+import csv
+import cStringIO
+import gzip
+import threading
+import Queue
+import time
+from time import strftime, gmtime
+
+try:
+	import zstandard									# optional, only needed for zstd compressed output
+except ImportError:
+	zstandard = None
+
+from gtop_utils import convertBytes, termSize
+
+# binary format - magic, then the length of the JSON header doc
+BINMAGIC = 'GTOPBIN1'
+BINHEADER = struct.Struct('<8sI')
+BINTICK = struct.Struct('<dH')						# sample time, number of rows
+BINCLUSTER = 0xFFFF									# row index used for the cluster summary
+
+
+class Field:
+	"""	Describes a column of the batch output """
+
+	def __init__(self, name, title, heading, group, width, kind, node, cluster=None):
+		self.name = name							# used by --fields and as the json key
+		self.title = title							# csv heading
+		self.heading = heading						# readable heading
+		self.group = group							# readable heading shown across related columns
+		self.width = width
+		self.kind = kind							# count, bytes or name
+		self.node = node							# f(node, blockSize) returns the nodes value
+		self.cluster = cluster						# f(cluster, blockSize) or None if not summarised
+
+	def value(self, obj, isCluster, blockSize):
+		if isCluster:
+			return self.cluster(obj, blockSize) if self.cluster else None
+		return self.node(obj, blockSize)
+
+	def readable(self, value):
+		if value is None:
+			text = ''
+		elif self.kind == 'bytes':
+			text = convertBytes(value)
+		else:
+			text = str(value)
+		return text.ljust(self.width) if self.kind == 'name' else text.rjust(self.width)
+
+
+NAMEFIELD = Field('node', 'GlusterNode', 'Gluster Node', '', 15, 'name',
+					lambda node, bs: node.hostName, lambda cluster, bs: '<ALL>')
+
+FIELDS = (
+	Field('cores', 'Cores', 'C/T', 'CPU', 3, 'count', lambda node, bs: node.procCount),
+	Field('cpu', 'CPU%', '%', 'CPU', 3, 'count', lambda node, bs: node.cpuBusyPct, lambda cluster, bs: cluster.avgCPU),
+	Field('ram', 'RAM', 'RAM', 'Memory', 5, 'bytes', lambda node, bs: node.memTotal * 1024),
+	Field('real', 'Real%', 'Real', 'Memory', 4, 'count', lambda node, bs: node.memUsedPct),
+	Field('swap', 'Swap%', 'Swap', 'Memory', 4, 'count', lambda node, bs: node.swapUsedPct),
+	Field('netin', 'NetInBytes', 'In', 'Network AVG', 6, 'bytes',
+			lambda node, bs: node.netInRate, lambda cluster, bs: cluster.aggrNetIn),
+	Field('netout', 'NetOutBytes', 'Out', 'Network AVG', 6, 'bytes',
+			lambda node, bs: node.netOutRate, lambda cluster, bs: cluster.aggrNetOut),
+	Field('reads', 'DiskReadAVG', 'Reads', 'Disk I/O AVG', 6, 'bytes',
+			lambda node, bs: node.blocksReadAvg * bs, lambda cluster, bs: cluster.aggrDiskR * bs),
+	Field('writes', 'DiskWriteAVG', 'Writes', 'Disk I/O AVG', 6, 'bytes',
+			lambda node, bs: node.blocksWriteAvg * bs, lambda cluster, bs: cluster.aggrDiskW * bs))
+
+FIELDNAMES = [field.name for field in FIELDS]
+
+# columns of the bricks batch mode - the disk I/O of the device holding each brick
+BRICKNAMEFIELD = Field('brick', 'Brick', 'Brick', '', 30, 'name', lambda row, bs: row.brick)
+
+BRICKFIELDS = (
+	Field('device', 'Device', 'Device', '', 8, 'name', lambda row, bs: row.device),
+	Field('readbytes', 'ReadBytes', 'Reads', 'Throughput', 6, 'bytes', lambda row, bs: row.io[0]),
+	Field('writebytes', 'WriteBytes', 'Writes', 'Throughput', 6, 'bytes', lambda row, bs: row.io[1]),
+	Field('readiops', 'ReadIOPS', 'Reads', 'IOPS', 6, 'count', lambda row, bs: int(row.io[2])),
+	Field('writeiops', 'WriteIOPS', 'Writes', 'IOPS', 6, 'count', lambda row, bs: int(row.io[3])),
+	Field('clients', 'Clients', 'Clnt', '', 4, 'count', lambda row, bs: row.clients))
+
+BRICKFIELDNAMES = [field.name for field in BRICKFIELDS]
+
+
+class BrickRow:
+	"""	A brick and it's disk I/O, as a row of the bricks batch mode """
+
+	def __init__(self, node, brick):
+		self.brick = brick
+		self.fmtdName = brick if len(brick) < 31 else brick[:29] + ">"
+		self.device = node.brickDevices.get(brick, ['', 0])[0]
+		self.io = node.brickIO.get(brick, [0, 0, 0, 0])
+		self.clients = node.brickClients.get(brick, 0)
+
+
+def selectFields(names='', table=FIELDS):
+	"""	Return the fields for a comma separated list of names (all fields when empty). A
+		ValueError is raised for any name that is not known """
+
+	if not names:
+		return list(table)
+
+	byName = dict([(field.name, field) for field in table])
+	selected = []
+	for name in names.lower().split(','):
+		name = name.strip()
+		if name not in byName:
+			raise ValueError("unknown field '" + name + "'")
+		selected.append(byName[name])
+
+	return selected
+
+
+class BatchWriter:
+	"""	Base class for the batch formats. Subclasses provide header() and formatRows() """
+
+	def __init__(self, stream, fields, blockSize, timeTemplate='%H:%M:%S', showHeaders=True, bgMode='nodes'):
+		self.stream = stream
+		self.fields = fields
+		self.blockSize = blockSize
+		self.timeTemplate = timeTemplate
+		self.showHeaders = showHeaders
+		self.bgMode = bgMode
+		self.nameField = BRICKNAMEFIELD if bgMode == 'bricks' else NAMEFIELD
+
+	def start(self, cluster):
+		header = self.header(cluster)
+		if isinstance(self.stream, RotatingFile):
+			self.stream.setHeader(header)
+		self.write(header)
+
+	def header(self, cluster):
+		return ''
+
+	def rows(self, cluster):
+		"""	Return the (object, isCluster) rows to output for the batch mode """
+
+		if self.bgMode == 'bricks':
+			return [(BrickRow(node, brick), False) for node, brick in cluster.brickRows()]
+
+		rows = []
+		if self.bgMode in ['summary','all']:
+			rows.append((cluster, True))
+		if self.bgMode in ['nodes','all']:
+			rows.extend([(node, False) for node in cluster.nodes])
+		return rows
+
+	def tick(self, tickTime, cluster):
+		self.write(self.formatRows(tickTime, self.rows(cluster)))
+
+	def write(self, data):
+		if data:
+			self.stream.write(data)
+			self.stream.flush()
+
+	def close(self):
+		self.stream.flush()
+		if isinstance(self.stream, RotatingFile):
+			self.stream.close()
+
+
+class ReadableWriter(BatchWriter):
+	"""	Fixed width columns. When headings are on and the output is a terminal, they are repeated
+		each time a screen full of rows has been written. The terminal size is cached, and only
+		re-read after a SIGWINCH """
+
+	def __init__(self, stream, fields, blockSize, timeTemplate='%H:%M:%S', showHeaders=True, bgMode='nodes'):
+		BatchWriter.__init__(self, stream, fields, blockSize, timeTemplate, showHeaders, bgMode)
+		self.paginate = showHeaders and stream.isatty()
+		self.screenRows = None
+		self.rowNum = 0
+		self.triggerRow = 0
+		if self.paginate:
+			signal.signal(signal.SIGWINCH, self.resized)
+
+	def resized(self, signum, frame):
+		self.screenRows = None
+
+	def header(self, cluster=None):
+		if not self.showHeaders:
+			return ''
+
+		if self.screenRows is None:
+			self.screenRows = termSize()[0]
+
+		width = self.nameField.width
+		columns = [(' ' * 8, 'Time'.center(8), '-' * 8),
+					(' ' * width, self.nameField.heading.ljust(width), '-' * width)]
+		for field in self.fields:
+			columns.append((field.group, field.heading.rjust(field.width), '-' * field.width))
+
+		# group headings are centred across the consecutive columns that share them
+		groups = []
+		for group, heading, dashes in columns:
+			if groups and groups[-1][0] == group:
+				groups[-1][1] += len(dashes) + 1
+			else:
+				groups.append([group, len(dashes)])
+		groupLine = ' '.join([group[:width].center(width) if group.strip() else ' ' * width for group, width in groups])
+
+		hdrs = [groupLine.rstrip(), ' '.join([c[1] for c in columns]), ' '.join([c[2] for c in columns])]
+
+		self.rowNum = 0
+		self.triggerRow = self.screenRows - len(hdrs)
+		return '\n'.join(hdrs) + '\n'
+
+	def formatRows(self, tickTime, rows):
+		prefix = strftime(self.timeTemplate, gmtime(tickTime))
+		lines = []
+		for obj, isCluster in rows:
+			name = ' < ALL >' if isCluster else obj.fmtdName
+			values = [field.readable(field.value(obj, isCluster, self.blockSize)) for field in self.fields]
+			lines.append(' '.join([prefix, name.ljust(self.nameField.width)] + values))
+
+			if self.paginate:
+				self.rowNum += 1
+				if self.rowNum > self.triggerRow:
+					lines.append(self.header().rstrip('\n'))
+
+		return '\n'.join(lines) + '\n' if lines else ''
+
+
+class CSVWriter(BatchWriter):
+	"""	CSV, with the headings as the first row (even when headings are suppressed) """
+
+	def __init__(self, stream, fields, blockSize, timeTemplate='%H:%M:%S', showHeaders=True, bgMode='nodes'):
+		BatchWriter.__init__(self, stream, fields, blockSize, timeTemplate, showHeaders, bgMode)
+		self.buffer = cStringIO.StringIO()
+		self.csv = csv.writer(self.buffer, lineterminator='\n')
+
+	def flushBuffer(self):
+		data = self.buffer.getvalue()
+		self.buffer.seek(0)
+		self.buffer.truncate()
+		return data
+
+	def header(self, cluster=None):
+		self.csv.writerow(['TimeStamp', self.nameField.title] + [field.title for field in self.fields])
+		return self.flushBuffer()
+
+	def formatRows(self, tickTime, rows):
+		prefix = strftime(self.timeTemplate, gmtime(tickTime))
+		for obj, isCluster in rows:
+			values = [field.value(obj, isCluster, self.blockSize) for field in self.fields]
+			self.csv.writerow([prefix, self.nameField.value(obj, isCluster, self.blockSize)] +
+								['' if value is None else value for value in values])
+		return self.flushBuffer()
+
+
+class JSONWriter(BatchWriter):
+	"""	JSON lines - an object per row, holding the sample time (epoch), the node (or brick) and
+		the fields. The cluster summary row has a node of <ALL> """
+
+	def formatRows(self, tickTime, rows):
+		lines = []
+		for obj, isCluster in rows:
+			doc = dict([(field.name, field.value(obj, isCluster, self.blockSize)) for field in self.fields])
+			doc['time'] = tickTime
+			doc[self.nameField.name] = self.nameField.value(obj, isCluster, self.blockSize)
+			lines.append(json.dumps(doc, separators=(',',':'), sort_keys=True))
+		return '\n'.join(lines) + '\n' if lines else ''
+
+
+class BinaryWriter(BatchWriter):
+	"""	Compact binary output. The header names the fields and nodes (or bricks), then each 
+		sample run is written as the time and row count, followed by each row's node index and
+		values (doubles, NaN where a value does not apply). Text fields are not included """
+
+	def header(self, cluster):
+		names = [self.nameField.value(obj, isCluster, self.blockSize) for obj, isCluster in self.rows(cluster) if not isCluster]
+		self.nodeIndex = dict([(name, idx) for idx, name in enumerate(names)])
+		self.numeric = [field for field in self.fields if field.kind != 'name']
+		self.rowStruct = struct.Struct('<H' + 'd' * len(self.numeric))
+		doc = json.dumps({'fields' : [field.name for field in self.numeric], 'nodes' : names})
+		return BINHEADER.pack(BINMAGIC, len(doc)) + doc
+
+	def formatRows(self, tickTime, rows):
+		data = [BINTICK.pack(tickTime, len(rows))]
+		for obj, isCluster in rows:
+			values = [field.value(obj, isCluster, self.blockSize) for field in self.numeric]
+			idx = BINCLUSTER if isCluster else self.nodeIndex[self.nameField.value(obj, isCluster, self.blockSize)]
+			data.append(self.rowStruct.pack(idx, *[float('nan') if v is None else v for v in values]))
+		return ''.join(data)
+
+
+class RotatingFile:
+	"""	File like object that writes to a series of segments, named FILE.YYYYmmdd-HHMMSS (UTC)
+		with .gz or .zst added when compressed. A new segment is started once maxBytes of output
+		(before compression) or maxAge seconds have been written to the current one, and each
+		segment starts with the header. When keep is given, only that many segments are kept.
+
+		The caller's writes are queued to a background thread that does the compression and the
+		file I/O. Writes are dropped (and counted) when more than maxQueue are waiting, and a
+		failure in the writer thread is raised as an IOError by the next write() or close() """
+
+	def __init__(self, fileName, maxBytes=0, maxAge=0, compress='gzip', keep=0, maxQueue=256):
+
+		if compress == 'zstd' and zstandard is None:
+			raise IOError("zstd compression needs the python zstandard module")
+		if compress not in ('gzip', 'zstd', 'none'):
+			raise IOError("unknown compression '" + compress + "'")
+
+		self.fileName = fileName
+		self.maxBytes = maxBytes
+		self.maxAge = maxAge
+		self.compress = compress
+		self.keep = keep
+		self.suffix = {'gzip' : '.gz', 'zstd' : '.zst', 'none' : ''}[compress]
+		self.header = ''
+		self.segmentBytes = 0
+		self.segmentStart = 0
+		self.segments = []
+		self.dropped = 0										# writes dropped with the queue full
+		self.error = None										# exception that stopped the writer thread
+
+		# check the directory is writable now, rather than failing in the background thread
+		open(self.segmentName(time.time()) + '.tmp', 'w').close()
+		os.unlink(self.segmentName(time.time()) + '.tmp')
+
+		self.queue = Queue.Queue(maxQueue)
+		self.thread = threading.Thread(target=self.writer)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def segmentName(self, startTime):
+		return self.fileName + '.' + strftime('%Y%m%d-%H%M%S', gmtime(startTime)) + self.suffix
+
+	def setHeader(self, header):
+		"""	Header written at the start of every segment """
+		self.header = header
+
+	def checkWriter(self):
+		"""	Raise the writer thread's failure in the caller's thread """
+
+		if self.error:
+			raise IOError("writing " + self.fileName + " failed - " + str(self.error))
+
+	def write(self, data):
+
+		self.checkWriter()
+		now = time.time()
+		if not self.segmentStart or (self.maxBytes and self.segmentBytes + len(data) > self.maxBytes and self.segmentBytes) \
+				or (self.maxAge and now - self.segmentStart >= self.maxAge):
+			self.rotate(now)
+			if data == self.header:
+				return
+
+		self.segmentBytes += len(data)
+		try:
+			self.queue.put_nowait(data)
+		except Queue.Full:
+			self.dropped += 1
+
+	def rotate(self, now):
+
+		name = self.segmentName(now)
+		if self.segments and name == self.segments[-1]:
+			return												# more than one rotation a second
+
+		self.segments.append(name)
+		self.queue.put(('open', name))							# waits for room, so a segment is never lost
+		self.segmentStart = now
+		self.segmentBytes = len(self.header)
+		if self.header:
+			self.queue.put(self.header)
+
+		if self.keep:
+			while len(self.segments) > self.keep:
+				self.queue.put(('remove', self.segments.pop(0)))
+
+	def flush(self):
+		pass													# the writer thread writes as it goes
+
+	def isatty(self):
+		return False
+
+	def close(self):
+		self.queue.put(None)
+		self.thread.join()
+		self.checkWriter()
+
+	def openSegment(self, name):
+		"""	Return the (stream, underlying file) of a new segment. The zstd writer is entered as a
+			context manager, which older (python 2) zstandard releases require before a write """
+
+		if self.compress == 'gzip':
+			return gzip.open(name, 'ab'), None
+		elif self.compress == 'zstd':
+			raw = open(name, 'ab')
+			out = zstandard.ZstdCompressor().stream_writer(raw)
+			out.__enter__()
+			return out, raw
+		return open(name, 'ab'), None
+
+	def closeSegment(self, out, raw):
+		"""	Finish the segment's compressed frame, then close the file under it """
+
+		try:
+			if raw:
+				out.__exit__(None, None, None)
+			else:
+				out.close()
+		finally:
+			if raw:
+				raw.close()
+
+	def writer(self):
+		"""	Background thread - owns the segment files, and does all the compression and I/O. Once
+			anything fails the queue is still drained (so the caller never blocks), but nothing
+			more is written """
+
+		out, raw = None, None
+		while True:
+			item = self.queue.get()
+			if item is None:
+				break
+			elif self.error:
+				continue
+
+			try:
+				if isinstance(item, tuple):
+					action, name = item
+					if action == 'open':
+						if out:
+							self.closeSegment(out, raw)
+							out, raw = None, None
+						out, raw = self.openSegment(name)
+					elif os.path.exists(name):
+						os.unlink(name)
+				elif out is None:
+					raise IOError("no segment open")
+				else:
+					out.write(item)
+					if self.compress == 'none':
+						out.flush()
+			except Exception, e:
+				self.error = e
+
+		try:
+			if out:
+				self.closeSegment(out, raw)
+		except Exception, e:
+			self.error = self.error or e
+
+
+WRITERS = {'readable' : ReadableWriter,
+			'raw' : CSVWriter,
+			'json' : JSONWriter,
+			'binary' : BinaryWriter}
+
+
+def readBinary(stream):
+	"""	Generator returning (time, [(node, {field : value})]) for each sample run in a stream
+		written by BinaryWriter. The cluster summary row has a node of <ALL>. Any text before
+		the header (gtop's start up messages) is skipped """
+
+	def readExact(size):
+		data = stream.read(size)
+		if len(data) < size:
+			raise EOFError
+		return data
+
+	skipped = ''
+	while not skipped.endswith(BINMAGIC):
+		data = stream.read(1)
+		if not data or len(skipped) > 65536:
+			raise ValueError("not a gtop binary stream")
+		skipped += data
+	docLen = struct.unpack('<I', readExact(4))[0]
+	doc = json.loads(readExact(docLen))
+	fields = [str(name) for name in doc['fields']]
+	nodes = [str(name) for name in doc['nodes']]
+	rowStruct = struct.Struct('<H' + 'd' * len(fields))
+
+	# a partial sample run at the end (or gtop's closing message) ends the stream
+	while True:
+		try:
+			tickTime, numRows = BINTICK.unpack(readExact(BINTICK.size))
+			rows = []
+			for n in range(numRows):
+				values = rowStruct.unpack(readExact(rowStruct.size))
+				name = '<ALL>' if values[0] == BINCLUSTER else nodes[values[0]]
+				rows.append((name, dict([(f, v) for f, v in zip(fields, values[1:]) if v == v])))
+		except (EOFError, IndexError):
+			return
+		yield tickTime, rows
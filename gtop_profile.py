@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#
+#	gtop - A performance and capacity monitoring program for glusterfs clusters
+#
+#	gtop-profile : per volume fop latency/call counts from the gluster cli
+#
+#   Copyright (C) 2013 Paul Cuzner
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# 'gluster volume profile <vol> info' and 'gluster volume top <vol> read|write' are run for each
+# volume on a background thread, and the parsed results cached for the UI to display. The cli
+# can take a long time (or hang) when glusterd is busy, so each command is killed after a timeout
+# and nothing in the main loop ever waits for it.
+#
+# Profiling has to be started on a volume (gluster volume profile <vol> start) for the latency
+# figures to be available - gtop doesn't start it, since it adds overhead to every fop.
+#
+
+import threading
+import time
+
+from gtop_utils import timedCMD
+
+
+class VolumeProfile:
+	"""	The latest profile/top results for a volume """
+
+	def __init__(self, fops=None, topFiles=None, error=''):
+		self.fops = fops or []								# [fop, calls, avg latency us, max latency us, % latency]
+		self.topFiles = topFiles or []						# [op, count, filename]
+		self.error = error
+		self.time = time.time()
+
+
+def parseProfile(lines):
+	"""	Combine the cumulative stats of each brick in 'volume profile info' output into a
+		[fop, calls, avg latency, max latency, % latency] row per fop, busiest first """
+
+	fops = {}											# fop -> [calls, total latency, max latency]
+	cumulative = False
+	for line in lines:
+		words = line.split()
+		if line.startswith('Brick:') or line.startswith('Interval'):
+			cumulative = False
+		elif line.startswith('Cumulative Stats'):
+			cumulative = True
+		elif cumulative and len(words) == 9 and words[2] == 'us' and words[7].isdigit():
+			# %-latency  Avg-latency  Min-Latency  Max-Latency  No. of calls  Fop
+			try:
+				avgLatency, maxLatency = float(words[1]), float(words[5])
+			except ValueError:
+				continue
+			calls = int(words[7])
+			stats = fops.setdefault(words[8], [0, 0.0, 0.0])
+			stats[0] += calls
+			stats[1] += avgLatency * calls
+			stats[2] = max(stats[2], maxLatency)
+
+	totalLatency = sum([stats[1] for stats in fops.values()])
+	rows = []
+	for fop, (calls, latency, maxLatency) in fops.items():
+		rows.append([fop, calls, latency / calls if calls else 0, maxLatency,
+						latency * 100 / totalLatency if totalLatency else 0])
+
+	rows.sort(key=lambda row: (row[4], row[1]), reverse=True)
+	return rows
+
+
+def parseTop(lines, op, count):
+	"""	Combine the per brick 'volume top' file lists, returning the busiest [op, count, file] rows """
+
+	files = {}
+	for line in lines:
+		words = line.split(None, 1)
+		if len(words) == 2 and words[0].isdigit() and words[1].startswith('/'):
+			name = words[1].strip()
+			files[name] = files.get(name, 0) + int(words[0])
+
+	busiest = sorted(files.items(), key=lambda item: item[1], reverse=True)[:count]
+	return [[op, calls, name] for name, calls in busiest]
+
+
+class ProfileCollector(threading.Thread):
+	"""	Background thread running the gluster cli for each volume every interval seconds """
+
+	def __init__(self, volumes, command='gluster', interval=60, timeout=10, topCount=3):
+
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.volumes = list(volumes)
+		self.command = command.split()
+		self.interval = interval
+		self.timeout = timeout
+		self.topCount = topCount
+
+		self.cache = {}										# volume name -> VolumeProfile
+		self.running = []									# cli process currently running
+		self.stopped = threading.Event()
+
+	def enable(self):
+		"""	Start collecting, the first time the profile panel is shown """
+
+		if not self.isAlive() and not self.stopped.isSet():
+			self.start()
+
+	def run(self):
+
+		while not self.stopped.isSet():
+			for name in self.volumes:
+				if self.stopped.isSet():
+					return
+				self.cache[name] = self.collect(name)		# replaced whole, so readers never see a partial result
+			self.stopped.wait(self.interval)
+
+	def gluster(self, *args):
+		"""	Run a gluster cli command, returning (ok, output lines or error message) """
+
+		status, lines = timedCMD(self.command + list(args), self.timeout, self.running)
+		if status is None:
+			return False, "gluster " + " ".join(args[:3]) + " timed out after " + str(self.timeout) + "s"
+		if status != 0:
+			message = [line.strip() for line in lines if line.strip()]
+			return False, (message[0] if message else "gluster exit status " + str(status))
+		return True, lines
+
+	def collect(self, name):
+
+		ok, result = self.gluster('volume', 'profile', name, 'info')
+		if not ok:
+			return VolumeProfile(error=result)
+
+		fops = parseProfile(result)
+		if not fops:
+			return VolumeProfile(error=' '.join([line.strip() for line in result if line.strip()][:1]) or "no profile data")
+
+		topFiles = []
+		for op in ('read', 'write'):
+			ok, lines = self.gluster('volume', 'top', name, op, 'list-cnt', str(self.topCount))
+			if ok:
+				topFiles.extend(parseTop(lines, op, self.topCount))
+
+		return VolumeProfile(fops, topFiles)
+
+	def stop(self):
+		"""	Stop collecting, killing any cli command that's running """
+
+		self.stopped.set()
+		for proc in list(self.running):
+			try:
+				proc.kill()
+			except OSError:
+				pass
+		if self.isAlive():
+			self.join(1)
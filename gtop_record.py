@@ -0,0 +1,665 @@
+#!/usr/bin/env python
+#
+#	gtop - A performance and capacity monitoring program for glusterfs clusters
+#
+#	gtop-record : binary recorder/reader for gtop sessions
+#
+#   Copyright (C) 2013 Paul Cuzner
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# File Layout
+# A recording is a fixed size header, followed by a JSON schema (host names, brick names and
+# the names of the node metrics held in each node record) and then a data area made up of
+# fixed length records. Every record starts with a single character type;
+#	H .. node sample   - state, daemon flags, node index, node clock, metric values (doubles)
+#	B .. brick sample  - brick index, size and used bytes
+#	A .. node summary  - state, node index, bucket start, sample count, min/avg/max/last per metric
+#	C .. brick summary - brick index, bucket start, last size, last used and max used bytes
+#	T .. tick trailer  - closes a sample run (or bucket), holding the tick time and record count
+#
+# Since all records are the same size, record n lives at dataOffset + n*recSize so the file
+# can be read directly through mmap without any parsing of the preceding data.
+#
+# Retention
+# When a file has a capacity (in records) the data area is used as a ring, in the same way
+# as an RRD. The header keeps the total number of records ever written, so the oldest
+# record is at slot (written - capacity) % capacity. Ticks that have been partly overwritten
+# are skipped by the readers, since their trailer is the last record written.
+#
+# Tiers
+# Alongside the raw samples (FILE), the recorder consolidates the samples into 1 minute (FILE.1m)
+# and 1 hour (FILE.1h) summaries as they arrive. Each tier is a recording in it's own right, with
+# it's own retention, so queries over long time ranges only need to read the coarse tier.
+#
+
+import os
+import struct, mmap
+import json
+import calendar, datetime, time
+
+MAGIC = 'GTOPREC1'
+VERSION = 1
+
+# magic, version, record size, interval, tier step, capacity, records written, schema length
+HEADER = struct.Struct('<8sHHHHQQI')
+DATAALIGN = 512
+
+BRICKREC = struct.Struct('<cxHqq')
+BRICKSUMMARY = struct.Struct('<cxHdqqq')
+TICKREC = struct.Struct('<cxHdI')
+
+# file name suffix for each consolidation tier, by bucket size (secs)
+TIERSUFFIX = {60 : '.1m', 3600 : '.1h'}
+
+STATECODES = {'unknown' : 0, 'connected' : 1, 'disconnected' : 2}
+STATENAMES = dict([(v,k) for k,v in STATECODES.items()])
+
+# schema entries that must match before an existing recording can be appended to
+LAYOUTKEYS = ('metrics', 'hosts', 'bricks')
+
+# attribute names of the daemon flags in bit order
+DAEMONFLAGS = ('ctdb', 'samba', 'nfs', 'selfHeal', 'georep')
+
+
+class RecordError(Exception):
+	pass
+
+
+def nodeStruct(metrics):
+	"""	Return the struct used for node records, based on the number of metrics being recorded """
+
+	return struct.Struct('<cBBHd' + 'd'*len(metrics))
+
+
+def summaryStruct(metrics):
+	"""	Return the struct used for consolidated node records, holding min/avg/max/last for each metric """
+
+	return struct.Struct('<cBHdI' + 'd'*4*len(metrics))
+
+
+def recordSize(metrics):
+	"""	Records are sized to hold the largest record type, rounded up to a multiple of 8 bytes """
+
+	size = max(nodeStruct(metrics).size, BRICKREC.size, TICKREC.size)
+	return (size + 7) & ~7
+
+
+def tierRecordSize(metrics):
+	"""	Record size for the consolidated tiers """
+
+	size = max(summaryStruct(metrics).size, BRICKSUMMARY.size, TICKREC.size)
+	return (size + 7) & ~7
+
+
+def packFlags(node):
+	"""	Convert the Y/. daemon flags of a node into a bit mask """
+
+	flags = 0
+	for bit, attr in enumerate(DAEMONFLAGS):
+		if getattr(node, attr, '.') == 'Y':
+			flags |= (1 << bit)
+	return flags
+
+
+def unpackFlags(flags):
+	"""	Return a dict of daemon flag attributes (Y/.) from a bit mask """
+
+	return dict([(attr, 'Y' if flags & (1 << bit) else '.') for bit, attr in enumerate(DAEMONFLAGS)])
+
+
+def dt2Epoch(dt):
+	"""	Convert a nodes datetime to seconds, 0 if the node has no time yet """
+
+	if dt is None:
+		return 0.0
+	return float(calendar.timegm(dt.timetuple()))
+
+
+def epoch2Dt(secs):
+	""" Reverse of dt2Epoch """
+
+	if not secs:
+		return None
+	return datetime.datetime.utcfromtimestamp(secs)
+
+
+class RingFile:
+	"""	Low level writer for a recording file, handling the header and the placement of records
+		in the (optionally ringed) data area """
+
+	def __init__(self, fileName, schema, recSize, interval, step=0, capacity=0):
+
+		self.fileName = fileName
+		self.schema = schema
+		self.recSize = recSize
+		self.interval = interval
+		self.step = step
+		self.pad = {}										# padding strings, keyed by struct size
+
+		if os.path.exists(fileName) and os.path.getsize(fileName) > 0:
+			self.openExisting()
+		else:
+			self.capacity = capacity
+			self.create()
+
+	def create(self):
+		"""	Write a new header and schema to the file """
+
+		schemaText = json.dumps(self.schema)
+		self.dataOffset = alignUp(HEADER.size + len(schemaText), DATAALIGN)
+		self.written = 0
+		self.schemaLen = len(schemaText)
+
+		self.f = open(self.fileName, 'w+b')
+		self.f.write(self.header())
+		self.f.write(schemaText)
+		self.f.write('\0' * (self.dataOffset - HEADER.size - len(schemaText)))
+		self.f.flush()
+
+	def openExisting(self):
+		"""	Reopen an existing recording to continue appending to it, providing it describes
+			the same hosts, bricks and metrics. The files original capacity is kept """
+
+		hdr, schema, dataOffset = readHeader(self.fileName)
+
+		if hdr['recSize'] != self.recSize or hdr['step'] != self.step or \
+				[schema.get(key) for key in LAYOUTKEYS] != [self.schema[key] for key in LAYOUTKEYS]:
+			raise RecordError(self.fileName + " was recorded from a different cluster layout")
+
+		self.dataOffset = dataOffset
+		self.capacity = hdr['capacity']
+		self.written = hdr['written']
+		self.schemaLen = hdr['schemaLen']
+		self.f = open(self.fileName, 'r+b')
+
+	def header(self):
+		return HEADER.pack(MAGIC, VERSION, self.recSize, self.interval, self.step,
+							self.capacity, self.written, self.schemaLen)
+
+	def padded(self, data):
+		"""	pad a packed record out to the files record size """
+
+		size = len(data)
+		if size not in self.pad:
+			self.pad[size] = '\0' * (self.recSize - size)
+		return data + self.pad[size]
+
+	def append(self, recs):
+		"""	Write a list of padded records, wrapping around the end of the data area when the file
+			has a fixed capacity """
+
+		data = ''.join(recs)
+
+		if self.capacity:
+			slot = self.written % self.capacity
+			room = (self.capacity - slot) * self.recSize
+			self.f.seek(self.dataOffset + slot * self.recSize)
+			self.f.write(data[:room])
+			if len(data) > room:
+				self.f.seek(self.dataOffset)
+				self.f.write(data[room:])
+		else:
+			self.f.seek(self.dataOffset + self.written * self.recSize)
+			self.f.write(data)
+
+		self.written += len(recs)
+
+		# update the record count in the header once the data is down
+		self.f.seek(0)
+		self.f.write(self.header())
+		self.f.flush()
+
+	def read(self, seq):
+		"""	Return the raw record with the given sequence number """
+
+		if self.capacity:
+			seq = seq % self.capacity
+		self.f.seek(self.dataOffset + seq * self.recSize)
+		return self.f.read(self.recSize)
+
+	def rewind(self, count):
+		"""	Step back over the last count records, so the next append replaces them """
+
+		self.written -= count
+
+	def close(self):
+		self.f.close()
+
+
+class Tier:
+	"""	Consolidate the samples of each tick into fixed size buckets (min/avg/max/last), writing
+		each bucket to the tier's file as the first sample of the next bucket arrives. The partly
+		filled bucket is written on close, and reloaded when the tier is reopened - a restart within
+		the same bucket carries on accumulating it, and it's records are replaced rather than the
+		bucket being written twice """
+
+	def __init__(self, fileName, schema, interval, step, retention):
+
+		self.metrics = schema['metrics']
+		self.numBricks = len(schema['bricks'])
+		self.nodeRec = summaryStruct(self.metrics)
+		self.step = step
+
+		recsPerBucket = len(schema['hosts']) + self.numBricks + 1
+		capacity = (retention // step) * recsPerBucket if retention else 0
+
+		self.ring = RingFile(fileName, schema, tierRecordSize(self.metrics), interval, step, capacity)
+
+		self.bucket = None
+		self.nodes = {}										# accumulators by node index
+		self.bricks = {}									# last size, last used, max used by brick index
+		self.resumed = 0									# records of the reloaded bucket, still in the file
+		self.reload()
+
+	def reload(self):
+		"""	Load the last bucket written to the file back into the accumulators """
+
+		if self.ring.written == 0:
+			return
+		trailer = self.ring.read(self.ring.written - 1)
+		if trailer[0] != 'T':
+			return
+		recType, numNodes, bucket, numRecs = TICKREC.unpack_from(trailer)
+		if numRecs > self.ring.written or (self.ring.capacity and numRecs > self.ring.capacity):
+			return
+
+		for seq in range(self.ring.written - numRecs, self.ring.written - 1):
+			data = self.ring.read(seq)
+			if data[0] == 'A':
+				rec = self.nodeRec.unpack_from(data)
+				state, idx, count, values = rec[1], rec[2], rec[4], rec[5:]
+				self.nodes[idx] = [count, state, list(values[0::4]), [avg * count for avg in values[1::4]],
+									list(values[2::4]), list(values[3::4])]
+			elif data[0] == 'C':
+				recType, idx, recBucket, size, used, maxUsed = BRICKSUMMARY.unpack_from(data)
+				self.bricks[idx] = [size, used, maxUsed]
+
+		self.bucket = int(bucket)
+		self.resumed = numRecs
+
+	def add(self, tickTime, nodeSamples, brickSamples):
+		"""	Add a ticks samples (node index, state, metric values) and (brick index, size, used) """
+
+		bucket = int(tickTime // self.step) * self.step
+		if self.bucket is not None and bucket != self.bucket:
+			if self.resumed:
+				self.nodes, self.bricks, self.resumed = {}, {}, 0	# reloaded bucket is already in the file
+			else:
+				self.flush()
+		self.bucket = bucket
+
+		for idx, state, values in nodeSamples:
+			acc = self.nodes.get(idx)
+			if acc is None:
+				self.nodes[idx] = [1, state, list(values), list(values), list(values), list(values)]
+				continue
+
+			count, lastState, mins, sums, maxs, lasts = acc
+			for ctr, value in enumerate(values):
+				if value < mins[ctr]:
+					mins[ctr] = value
+				if value > maxs[ctr]:
+					maxs[ctr] = value
+				sums[ctr] += value
+			acc[0] = count + 1
+			acc[1] = state
+			acc[5] = list(values)
+
+		for idx, size, used in brickSamples:
+			last = self.bricks.get(idx)
+			self.bricks[idx] = [size, used, max(used, last[2]) if last else used]
+
+	def flush(self):
+		"""	Write the current bucket to the tier file """
+
+		if self.bucket is None or not self.nodes:
+			return
+
+		recs = []
+		for idx, (count, state, mins, sums, maxs, lasts) in sorted(self.nodes.items()):
+			values = []
+			for ctr in range(len(self.metrics)):
+				values.extend((mins[ctr], sums[ctr] / float(count), maxs[ctr], lasts[ctr]))
+			recs.append(self.ring.padded(self.nodeRec.pack('A', state, idx, self.bucket, count, *values)))
+
+		for idx, (size, used, maxUsed) in sorted(self.bricks.items()):
+			recs.append(self.ring.padded(BRICKSUMMARY.pack('C', idx, self.bucket, size, used, maxUsed)))
+
+		recs.append(self.ring.padded(TICKREC.pack('T', len(self.nodes), self.bucket, len(recs) + 1)))
+		if self.resumed:
+			self.ring.rewind(self.resumed)					# replace the bucket's earlier records
+			self.resumed = 0
+		self.ring.append(recs)
+
+		self.nodes = {}
+		self.bricks = {}
+
+	def close(self):
+		self.flush()
+		self.ring.close()
+
+
+class Recorder:
+	""" Append node and brick samples to a recording file, one write per tick, maintaining
+		the consolidated tiers from the same samples """
+
+	def __init__(self, fileName, cluster, metrics, interval, retention=0, tiers=()):
+
+		self.metrics = tuple(metrics)
+		self.nodeRec = nodeStruct(self.metrics)
+
+		self.schema = {'metrics' : list(self.metrics),
+						'hosts' : [node.hostName for node in cluster.nodes],
+						'bricks' : sorted(cluster.brick2Xlator.keys()),
+						'volumes' : cluster.volFiles,
+						'version' : cluster.version}
+
+		self.hostIdx = dict([(name,idx) for idx,name in enumerate(self.schema['hosts'])])
+		self.brickIdx = dict([(name,idx) for idx,name in enumerate(self.schema['bricks'])])
+
+		recsPerTick = len(self.hostIdx) + len(self.brickIdx) + 1
+		capacity = (retention // interval) * recsPerTick if retention else 0
+		self.ring = RingFile(fileName, self.schema, recordSize(self.metrics), interval, 0, capacity)
+
+		# tiers is a list of (step, retention) tuples, both in seconds
+		self.tiers = [Tier(fileName + TIERSUFFIX[step], self.schema, interval, step, keep) for step, keep in tiers]
+
+	def writeTick(self, tickTime, cluster):
+		"""	Pack the current state of every node (and it's bricks) and write them to the
+			file with a single write call """
+
+		pad = self.ring.padded
+		recs = []
+		nodeSamples = []
+		brickSamples = []
+		for node in cluster.nodes:
+
+			idx = self.hostIdx[node.hostName]
+			state = STATECODES.get(node.state,0)
+			values = [getattr(node, attr) for attr in self.metrics]
+			recs.append(pad(self.nodeRec.pack('H', state, packFlags(node), idx, dt2Epoch(node.timeStamp), *values)))
+			nodeSamples.append((idx, state, values))
+
+			for brickName, (size, used) in node.brickInfo.items():
+				if brickName in self.brickIdx:
+					recs.append(pad(BRICKREC.pack('B', self.brickIdx[brickName], size, used)))
+					brickSamples.append((self.brickIdx[brickName], size, used))
+
+		recs.append(pad(TICKREC.pack('T', len(cluster.nodes), tickTime, len(recs) + 1)))
+		self.ring.append(recs)
+
+		for tier in self.tiers:
+			tier.add(tickTime, nodeSamples, brickSamples)
+
+	def close(self):
+		self.ring.close()
+		for tier in self.tiers:
+			tier.close()
+
+
+def alignUp(value, boundary):
+	return ((value + boundary - 1) // boundary) * boundary
+
+
+def readHeader(fileName):
+	"""	Read and validate the header of a recording, returning the header fields as a dict, the
+		schema and the offset to the data area """
+
+	f = open(fileName, 'rb')
+	try:
+		raw = f.read(HEADER.size)
+		if len(raw) < HEADER.size:
+			raise RecordError(fileName + " is not a gtop recording")
+
+		magic, version, recSize, interval, step, capacity, written, schemaLen = HEADER.unpack(raw)
+		if magic != MAGIC:
+			raise RecordError(fileName + " is not a gtop recording")
+		if version != VERSION:
+			raise RecordError(fileName + " is recording version " + str(version) + ", expected " + str(VERSION))
+
+		schema = json.loads(f.read(schemaLen))
+	finally:
+		f.close()
+
+	hdr = {'version' : version, 'recSize' : recSize, 'interval' : interval, 'step' : step,
+			'capacity' : capacity, 'written' : written, 'schemaLen' : schemaLen}
+
+	return hdr, schema, alignUp(HEADER.size + schemaLen, DATAALIGN)
+
+
+class RecordFile:
+	"""	Read only, mmap based access to a recording or one of it's tiers """
+
+	def __init__(self, fileName):
+
+		self.fileName = fileName
+		self.hdr, self.schema, self.dataOffset = readHeader(fileName)
+
+		self.recSize = self.hdr['recSize']
+		self.interval = self.hdr['interval']
+		self.step = self.hdr['step']
+		self.capacity = self.hdr['capacity']
+		self.metrics = self.schema['metrics']
+		self.hosts = self.schema['hosts']
+		self.bricks = self.schema['bricks']
+		self.nodeRec = nodeStruct(self.metrics)
+		self.summaryRec = summaryStruct(self.metrics)
+
+		self.f = open(fileName, 'rb')
+		self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		# only trust the records the header says are complete, and in a ring only the last
+		# 'capacity' records are still present
+		slots = (len(self.mm) - self.dataOffset) // self.recSize
+		self.end = self.hdr['written']
+		if self.capacity:
+			self.start = max(0, self.end - self.capacity)
+		else:
+			self.start = 0
+			self.end = min(self.end, slots)
+
+	def offset(self, seq):
+		"""	Return the file offset of a record, given it's sequence number """
+
+		if self.capacity:
+			seq = seq % self.capacity
+		return self.dataOffset + seq * self.recSize
+
+	def decode(self, seq):
+		"""	Decode a record, returning a tuple starting with the record type """
+
+		pos = self.offset(seq)
+		recType = self.mm[pos]
+
+		if recType == 'H':
+			return self.nodeRec.unpack_from(self.mm, pos)
+		elif recType == 'B':
+			return BRICKREC.unpack_from(self.mm, pos)
+		elif recType == 'T':
+			return TICKREC.unpack_from(self.mm, pos)
+		elif recType == 'A':
+			return self.summaryRec.unpack_from(self.mm, pos)
+		elif recType == 'C':
+			return BRICKSUMMARY.unpack_from(self.mm, pos)
+		else:
+			raise RecordError("unknown record type at record " + str(seq) + " in " + self.fileName)
+
+	def tickRanges(self):
+		"""	Generator returning (tickTime, first, last) for each complete tick, where first..last-1
+			are the sequence numbers of the ticks samples. Only the trailers are decoded """
+
+		mm = self.mm
+		first = None if self.start else 0					# in a wrapped ring, the first tick may be partial
+		for seq in xrange(self.start, self.end):
+			pos = self.offset(seq)
+			if mm[pos] == 'T':
+				if first is not None:
+					yield TICKREC.unpack_from(mm, pos)[2], first, seq
+				first = seq + 1
+
+	def ticks(self, fromTime=None, toTime=None):
+		"""	Generator returning each tick in the file as (tickTime, nodes, bricks) where nodes is a
+			list of node (H or A) record tuples and bricks a list of brick (B or C) record tuples """
+
+		for tickTime, first, last in self.tickRanges():
+			if fromTime is not None and tickTime < fromTime:
+				continue
+			if toTime is not None and tickTime > toTime:
+				break
+
+			nodes = []
+			bricks = []
+			for seq in xrange(first, last):
+				rec = self.decode(seq)
+				if rec[0] in 'HA':
+					nodes.append(rec)
+				else:
+					bricks.append(rec)
+			yield tickTime, nodes, bricks
+
+	def firstTime(self):
+		"""	Time of the oldest complete tick in the file, None when the file is empty """
+
+		for tickTime, first, last in self.tickRanges():
+			return tickTime
+		return None
+
+	def lastTime(self):
+		"""	Time of the newest tick - the last record written is always a tick trailer """
+
+		if self.end > self.start:
+			return self.decode(self.end - 1)[2]
+		return None
+
+	def close(self):
+		self.mm.close()
+		self.f.close()
+
+
+def selectTier(fileName, fromTime):
+	"""	Open the finest resolution file of a recording (raw, 1m, 1h) that still holds data for the
+		given start time (None = from the start of the recording). A file that has never wrapped
+		holds everything. When none of them go back that far, the coarsest tier is used """
+
+	candidates = [fileName] + [fileName + TIERSUFFIX[step] for step in sorted(TIERSUFFIX)]
+	candidates = [name for name in candidates if os.path.exists(name)]
+	if not candidates:
+		raise RecordError(fileName + " not found")
+
+	for name in candidates:
+		rec = RecordFile(name)
+		oldest = rec.firstTime()
+		if oldest is not None and (rec.start == 0 or (fromTime is not None and oldest <= fromTime)):
+			return rec
+		rec.close()
+
+	return RecordFile(candidates[-1])
+
+
+class Replay:
+	"""	Play back the ticks of a recording, honouring the recorded sample intervals scaled
+		by a speed factor. A speed of 0 plays the ticks back as fast as they can be read """
+
+	def __init__(self, fileName, speed=1.0):
+
+		self.rec = RecordFile(fileName)
+		if self.rec.step:
+			raise RecordError(fileName + " holds consolidated samples, only raw recordings can be replayed")
+		self.speed = speed
+		self.paused = False
+		self.pos = 0										# index of the next tick to play
+		self.nextDue = 0									# wall clock time the next tick is due
+		self.forced = False									# play the next tick now, even when paused
+
+		# index the tick trailers so seeks don't need to decode the samples
+		self.index = list(self.rec.tickRanges())
+
+	def finished(self):
+		return self.pos >= len(self.index)
+
+	def due(self):
+		"""	Is it time to play the next tick? """
+
+		if self.finished():
+			return False
+		if self.forced:
+			return True
+		return not self.paused and time.time() >= self.nextDue
+
+	def read(self):
+		"""	Return the next tick as (tickTime, nodes, bricks), scheduling the tick that follows it """
+
+		tickTime, first, last = self.index[self.pos]
+		nodes = []
+		bricks = []
+		for seq in xrange(first, last):
+			rec = self.rec.decode(seq)
+			if rec[0] == 'H':
+				nodes.append(rec)
+			else:
+				bricks.append(rec)
+
+		self.pos += 1
+		self.forced = False
+		if self.speed and not self.finished():
+			self.nextDue = time.time() + (self.index[self.pos][0] - tickTime) / self.speed
+		else:
+			self.nextDue = 0
+
+		return tickTime, nodes, bricks
+
+	def seek(self, ticks):
+		"""	Move forwards or backwards a number of ticks, the new position is played immediately """
+
+		self.pos = max(0, min(len(self.index) - 1, self.pos - 1 + ticks))
+		self.forced = True
+
+	def seekTime(self, when):
+		"""	Position the replay at the first tick at or after a given time """
+
+		self.pos = len(self.index) - 1
+		for ctr, (tickTime, first, last) in enumerate(self.index):
+			if tickTime >= when:
+				self.pos = ctr
+				break
+		self.forced = True
+
+	def togglePause(self):
+		self.paused = not self.paused
+		self.nextDue = 0
+
+	def close(self):
+		self.rec.close()
+
+
+def parseTime(text, reference=None):
+	"""	Convert a time given as 'YYYY-MM-DD HH:MM[:SS]', 'YYYY-MM-DD' or 'HH:MM[:SS]' (UTC) to seconds.
+		Times without a date are taken to be on the same day as the reference time """
+
+	text = text.strip().replace('T', ' ')
+	for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+		try:
+			return float(calendar.timegm(time.strptime(text, fmt)))
+		except ValueError:
+			pass
+
+	for fmt in ('%H:%M:%S', '%H:%M'):
+		try:
+			t = time.strptime(text, fmt)
+		except ValueError:
+			continue
+		day = time.gmtime(reference if reference is not None else time.time())
+		return float(calendar.timegm(day[:3] + t[3:6] + (0, 0, 0)))
+
+	raise RecordError("unable to understand the time '" + text + "'")
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+#	gtop - A performance and capacity monitoring program for glusterfs clusters
+#
+#	gtop-sink : push the node and cluster metrics to Graphite or StatsD
+#
+#   Copyright (C) 2013 Paul Cuzner
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Targets
+#	graphite://host[:port]      .. Graphite plaintext over TCP (default port 2003)
+#	graphite+udp://host[:port]  .. Graphite plaintext over UDP
+#	statsd://host[:port]        .. StatsD gauges over UDP (default port 8125)
+#
+# The metrics of a sample run are built once, then sent either as UDP datagrams holding as
+# many lines as fit in the MTU, or as a single write on the TCP connection. The sockets are
+# non-blocking and serviced from the gtop main loop. When the receiver can't keep up (or is
+# down) data is dropped rather than holding up the data gathering.
+#
+
+import socket, errno
+import time
+import syslog
+
+from gtop_output import FIELDS
+
+DEFAULTPORTS = {'graphite' : 2003, 'graphite+udp' : 2003, 'statsd' : 8125}
+
+# seconds to wait before reconnecting to a graphite server
+RECONNECT = 30
+
+
+class SinkError(Exception):
+	pass
+
+
+def metricName(name):
+	"""	Graphite uses '.' as the path separator, so it can't appear in a node name """
+
+	return name.replace('.', '_').replace(' ', '_')
+
+
+def formatValue(value):
+	if value == int(value):
+		return str(int(value))
+	return '%.2f' % value
+
+
+class MetricSink:
+	"""	Sends each sample run's node and cluster metrics to a Graphite or StatsD server """
+
+	def __init__(self, target, prefix='gtop', mtu=1432, maxQueue=1048576):
+
+		if '://' not in target:
+			raise SinkError("target must be given as graphite://, graphite+udp:// or statsd://host[:port]")
+		self.scheme, address = target.split('://', 1)
+		if self.scheme not in DEFAULTPORTS:
+			raise SinkError("unknown sink type '" + self.scheme + "'")
+
+		host, sep, port = address.partition(':')
+		self.address = (host, int(port) if port else DEFAULTPORTS[self.scheme])
+		self.prefix = prefix
+		self.mtu = mtu
+		self.maxQueue = maxQueue
+		self.udp = self.scheme != 'graphite'
+
+		self.pending = ''										# tcp data waiting to be sent
+		self.sock = None
+		self.connected = False
+		self.retryTime = 0
+		self.dropped = 0										# lines dropped
+
+		if self.udp:
+			self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			self.sock.setblocking(0)
+			self.sock.connect(self.address)
+		else:
+			self.connect()
+
+	def connect(self):
+		"""	Start a non-blocking connect to the graphite server, completed by service() """
+
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.sock.setblocking(0)
+		self.connected = False
+		rc = self.sock.connect_ex(self.address)
+		if rc not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+			self.disconnect(rc)
+
+	def disconnect(self, reason):
+		if self.sock:
+			self.sock.close()
+		self.sock = None
+		self.connected = False
+		self.retryTime = time.time() + RECONNECT
+		self.dropped += self.pending.count('\n')
+		self.pending = ''
+		syslog.syslog("gtop unable to send metrics to " + self.address[0] + ":" + str(self.address[1]) +
+						" (" + (errno.errorcode.get(reason, str(reason)) if isinstance(reason, int) else str(reason)) + ")")
+
+	def lines(self, tickTime, cluster, blockSize):
+		"""	Return the metric lines for a sample run """
+
+		stamp = ' ' + str(int(tickTime))
+		if self.scheme == 'statsd':
+			fmt = lambda name, value: name + ':' + formatValue(value) + '|g'
+		else:
+			fmt = lambda name, value: name + ' ' + formatValue(value) + stamp
+
+		lines = []
+		for node in cluster.nodes:
+			path = self.prefix + '.nodes.' + metricName(node.hostName) + '.'
+			for field in FIELDS:
+				lines.append(fmt(path + field.name, field.value(node, False, blockSize)))
+
+		path = self.prefix + '.cluster.'
+		lines.append(fmt(path + 'nodes', cluster.activeNodes))
+		for field in FIELDS:
+			if field.cluster:
+				lines.append(fmt(path + field.name, field.value(cluster, True, blockSize)))
+
+		return lines
+
+	def tick(self, tickTime, cluster, blockSize):
+		"""	Queue/send the metrics for a sample run """
+
+		lines = self.lines(tickTime, cluster, blockSize)
+
+		if self.udp:
+			for datagram in self.datagrams(lines):
+				try:
+					self.sock.send(datagram)
+				except socket.error:
+					# buffer full or nothing listening (ECONNREFUSED from the last send)
+					self.dropped += datagram.count('\n')
+			return
+
+		if not self.sock:
+			if time.time() < self.retryTime:
+				self.dropped += len(lines)
+				return
+			self.connect()
+
+		data = '\n'.join(lines) + '\n'
+		if len(self.pending) + len(data) > self.maxQueue:
+			self.dropped += len(lines)
+		else:
+			self.pending += data
+		self.service()
+
+	def datagrams(self, lines):
+		"""	Pack the lines into datagrams no larger than the MTU """
+
+		datagram = ''
+		for line in lines:
+			line += '\n'
+			if datagram and len(datagram) + len(line) > self.mtu:
+				yield datagram
+				datagram = ''
+			datagram += line
+		if datagram:
+			yield datagram
+
+	def service(self):
+		"""	Complete the tcp connect and send whatever is pending, called from the main loop """
+
+		if self.udp or not self.sock or not self.pending:
+			return
+
+		if not self.connected:
+			rc = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+			if rc:
+				self.disconnect(rc)
+				return
+			try:
+				self.sock.getpeername()
+			except socket.error:
+				return											# still connecting
+			self.connected = True
+
+		try:
+			sent = self.sock.send(self.pending)
+			self.pending = self.pending[sent:]
+		except socket.error, e:
+			if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+				self.disconnect(e.args[0])
+
+	def close(self):
+		if self.sock:
+			self.sock.close()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+#	gtop - A performance and capacity monitoring program for glusterfs clusters
+#
+#	gtop-summary : precomputed gluster summary subtree, published through snmpd pass_persist
+#
+#   Copyright (C) 2013 Paul Cuzner
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# snmpd runs 'gtop --pass-persist' once and hands it the requests for the summary subtree
+# (pass_persist in snmpd.conf_gtop). The node's sample is gathered every refresh interval from
+# /proc, however many gtop instances are polling, and each poller fetches the whole subtree
+# with a single GETBULK rather than walking the host resource tables.
+#
+# Layout, below the base OID (GTOPSUMMARYOID)
+#	.1.n.0			scalars, in the order of SCALARS - the last is the helper's sampling interval
+#	.2.1.c.r		bricks - column c of brick r, in the order of BRICKCOLUMNS
+#	.3.1.c.r		network interfaces (NICCOLUMNS)
+#	.4.1.c.r		gluster daemons (DAEMONCOLUMNS)
+#	.5.1.1.r		load % of core r
+#
+# Rates are rounded to whole bytes (or blocks) per second.
+#
+
+import os
+import select
+import bisect
+import time
+
+from gtop_record import STATECODES, STATENAMES, packFlags, unpackFlags, dt2Epoch
+
+SCALARS = (('timeStamp', 'gauge'), ('state', 'integer'), ('hostActive', 'integer'), ('daemonFlags', 'integer'),
+			('procCount', 'integer'), ('cpuBusyPct', 'integer'), ('cpuUserPct', 'integer'), ('cpuSysPct', 'integer'),
+			('cpuWaitPct', 'integer'), ('cpuIdlePct', 'integer'), ('coreMax', 'integer'), ('coreSpread', 'integer'),
+			('coreSaturated', 'integer'), ('memTotal', 'counter64'), ('memAvail', 'counter64'),
+			('memUsedPct', 'integer'), ('swapTotal', 'counter64'), ('swapAvail', 'counter64'),
+			('swapUsedPct', 'integer'), ('netInRate', 'counter64'), ('netOutRate', 'counter64'),
+			('blocksReadAvg', 'counter64'), ('blocksWriteAvg', 'counter64'), ('errMsg', 'string'),
+			('interval', 'integer'))
+
+BRICKCOLUMNS = (('path', 'string'), ('size', 'counter64'), ('used', 'counter64'), ('device', 'string'),
+				('readRate', 'counter64'), ('writeRate', 'counter64'), ('readOps', 'gauge'), ('writeOps', 'gauge'),
+				('port', 'integer'), ('clients', 'gauge'))
+
+NICCOLUMNS = (('name', 'string'), ('speed', 'gauge'), ('inRate', 'counter64'), ('outRate', 'counter64'),
+				('utilPct', 'integer'), ('errors', 'gauge'), ('discards', 'gauge'))
+
+DAEMONCOLUMNS = (('daemon', 'string'), ('detail', 'string'), ('processes', 'integer'), ('cpuPct', 'integer'),
+				('memory', 'counter64'))
+
+CORECOLUMNS = (('load', 'integer'),)
+
+BRICKTABLE, NICTABLE, DAEMONTABLE, CORETABLE = 2, 3, 4, 5
+
+TABLECOLUMNS = {BRICKTABLE : BRICKCOLUMNS, NICTABLE : NICCOLUMNS, DAEMONTABLE : DAEMONCOLUMNS, CORETABLE : CORECOLUMNS}
+
+
+def parseOID(oid):
+	"""	'.1.3.6.1' -> (1, 3, 6, 1) """
+
+	return tuple([int(part) for part in oid.strip().strip('.').split('.') if part])
+
+
+def formatOID(oid):
+	return '.' + '.'.join([str(part) for part in oid])
+
+
+def snmpValue(value, valueType):
+
+	if valueType == 'string':
+		return str(value)
+	return max(int(round(value)), 0) if valueType != 'integer' else int(round(value))
+
+
+def typedValue(value, valueType):
+	"""	Convert a value fetched as a string back to the type it was published as """
+
+	if value is None or valueType == 'string':
+		return value
+	try:
+		return int(value)
+	except ValueError:
+		return 0
+
+
+def tableRows(table, columns, rows):
+	"""	Return the (oid, type, value) entries of a table, column by column as a walk returns them """
+
+	return [((table, 1, col + 1, row + 1), valueType, snmpValue(values[col], valueType))
+				for col, (name, valueType) in enumerate(columns) for row, values in enumerate(rows)]
+
+
+def intervalOID(base):
+	"""	OID of the helper's sampling interval (seconds) """
+
+	return base + '.1.' + str(len(SCALARS))
+
+
+def summaryRows(node, interval=0):
+	"""	Return the node's sample as a sorted list of (oid below the base, type, value) """
+
+	prefix = node.hostName + ":"
+	values = dict([(attr, getattr(node, attr, 0)) for attr, valueType in SCALARS])
+	values.update({'interval' : interval, 'timeStamp' : dt2Epoch(node.timeStamp), 'state' : STATECODES.get(node.state, 0),
+					'hostActive' : int(node.hostActive), 'daemonFlags' : packFlags(node),
+					'coreSaturated' : int(node.coreSaturated)})
+	rows = [((1, n + 1, 0), valueType, snmpValue(values[attr], valueType)) for n, (attr, valueType) in enumerate(SCALARS)]
+
+	bricks = []
+	for brick in sorted(node.brickInfo):
+		size, used = node.brickInfo[brick]
+		io = node.brickIO.get(brick, [0, 0, 0, 0])
+		bricks.append([brick[len(prefix):] if brick.startswith(prefix) else brick, size, used,
+						node.brickDevices.get(brick, [''])[0]] + list(io) +
+						[node.brickPorts.get(brick, 0), node.brickClients.get(brick, 0)])
+	rows += tableRows(BRICKTABLE, BRICKCOLUMNS, bricks)
+	rows += tableRows(NICTABLE, NICCOLUMNS, node.nicStats)
+	rows += tableRows(DAEMONTABLE, DAEMONCOLUMNS, node.daemonStats)
+	rows += tableRows(CORETABLE, CORECOLUMNS, [[load] for load in node.coreLoads])
+
+	rows.sort()
+	return rows
+
+
+def columns(tables, table, names):
+	"""	Return the rows of a decoded table as lists, in row order """
+
+	cells = tables.get(table, {})
+	return [[cells[row].get(col + 1) for col in range(len(names))] for row in sorted(cells)]
+
+
+def decodeSummary(pairs, hostName):
+	"""	Convert the (oid below the base, value) pairs fetched from a node into a node state in the
+		form applyNodeState takes. Values arrive as strings, and are converted back by the type of their
+		scalar or column - a brick path or device that happens to be all digits stays a string """
+
+	scalars = {}
+	tables = {}
+	for oid, value in pairs:
+		oid = parseOID(oid)
+		if len(oid) == 3 and oid[0] == 1 and 0 < oid[1] <= len(SCALARS):
+			attr, valueType = SCALARS[oid[1] - 1]
+			scalars[attr] = typedValue(value, valueType)
+		elif len(oid) == 4 and oid[1] == 1 and 0 < oid[2] <= len(TABLECOLUMNS.get(oid[0], ())):
+			valueType = TABLECOLUMNS[oid[0]][oid[2] - 1][1]
+			tables.setdefault(oid[0], {}).setdefault(oid[3], {})[oid[2]] = typedValue(value, valueType)
+
+	if 'timeStamp' not in scalars:
+		return None
+
+	state = dict([(attr, scalars.get(attr, 0)) for attr, valueType in SCALARS if attr != 'interval'])
+	state.update(unpackFlags(state.pop('daemonFlags')))
+	state['state'] = STATENAMES.get(state['state'], 'unknown')
+	state['hostActive'] = bool(state['hostActive'])
+	state['coreSaturated'] = bool(state['coreSaturated'])
+	state['errMsg'] = str(state['errMsg'] or '')
+
+	prefix = hostName + ":"
+	bricks = columns(tables, BRICKTABLE, BRICKCOLUMNS)
+	state['brickInfo'] = dict([(prefix + row[0], [row[1], row[2]]) for row in bricks])
+	state['brickIO'] = dict([(prefix + row[0], row[4:8]) for row in bricks])
+	state['brickDevices'] = dict([(prefix + row[0], [row[3], 0]) for row in bricks if row[3]])
+	state['brickPorts'] = dict([(prefix + row[0], row[8]) for row in bricks if row[8]])
+	state['brickClients'] = dict([(prefix + row[0], row[9]) for row in bricks if row[9]])
+	state['nicStats'] = columns(tables, NICTABLE, NICCOLUMNS)
+	state['daemonStats'] = columns(tables, DAEMONTABLE, DAEMONCOLUMNS)
+	state['coreLoads'] = [row[0] for row in columns(tables, CORETABLE, CORECOLUMNS)]
+
+	return state
+
+
+class PassPersist:
+	"""	The snmpd pass_persist protocol on stdin/stdout. The sample is refreshed by gather() every
+		interval seconds, between requests, so a request is always answered from the cached rows """
+
+	def __init__(self, base, gather, interval, stdin, stdout):
+
+		self.base = parseOID(base)
+		self.gather = gather
+		self.interval = interval
+		self.stdin = stdin
+		self.stdout = stdout
+		self.buffer = ''
+		self.oids = []
+		self.rows = []
+		self.nextSample = 0
+
+	def refresh(self):
+
+		self.rows = [(self.base + oid, valueType, value) for oid, valueType, value in summaryRows(self.gather(), self.interval)]
+		self.oids = [oid for oid, valueType, value in self.rows]
+
+	def readLine(self):
+		"""	Return the next request line, or None at end of file """
+
+		while '\n' not in self.buffer:
+			data = os.read(self.stdin.fileno(), 4096)
+			if not data:
+				return None
+			self.buffer += data
+		line, self.buffer = self.buffer.split('\n', 1)
+		return line.strip()
+
+	def respond(self, lines):
+
+		self.stdout.write(''.join([line + '\n' for line in lines]))
+		self.stdout.flush()
+
+	def lookup(self, command, oid):
+		"""	Answer a get or getnext, returning the response lines """
+
+		oid = parseOID(oid)
+		if command == 'get':
+			n = bisect.bisect_left(self.oids, oid)
+			found = n < len(self.oids) and self.oids[n] == oid
+		else:
+			n = bisect.bisect_right(self.oids, oid)
+			found = n < len(self.oids)
+
+		if not found:
+			return ['NONE']
+		oid, valueType, value = self.rows[n]
+		return [formatOID(oid), valueType, str(value)]
+
+	def run(self):
+
+		while True:
+			now = time.time()
+			if now >= self.nextSample:
+				self.refresh()
+				self.nextSample = now + self.interval
+
+			if '\n' not in self.buffer:
+				ready, w, x = select.select([self.stdin], [], [], max(self.nextSample - time.time(), 0))
+				if not ready:
+					continue
+
+			command = self.readLine()
+			if not command:
+				return										# snmpd has closed the pipe
+
+			command = command.lower()
+			if command == 'ping':
+				self.respond(['PONG'])
+			elif command in ('get', 'getnext'):
+				oid = self.readLine()
+				if oid is None:
+					return
+				self.respond(self.lookup(command, oid))
+			elif command == 'set':
+				self.readLine()
+				self.readLine()
+				self.respond(['not-writable'])
+			else:
+				self.respond(['NONE'])
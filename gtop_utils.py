@@ -20,7 +20,11 @@
 #
 import subprocess
 import struct, datetime
-from subprocess import PIPE,Popen					# used in screenSize and issueCMD
+import math
+import fcntl, termios
+import os, signal
+import tempfile, time
+from subprocess import PIPE,Popen					# used in issueCMD
 
 def convertBytes(inBytes):
 	"""
@@ -66,6 +70,59 @@ def issueCMD(cmd=""):
 	return response.split('\n')								# use split to return a list
 
 
+def timedCMD(cmdWords, timeout, running=None):
+	"""	Run a command, killing it if it hasn't finished within timeout seconds. Returns the exit status
+		(None when it timed out) and the output as a list. The output goes to a temporary file rather 
+		than a pipe, so a command with a lot of output can't stall waiting for us to read it. 
+		running, if given, is a list the process is added to while it runs so another thread can kill it
+	"""
+	
+	output = tempfile.TemporaryFile()
+	try:
+		proc = Popen(cmdWords, stdout=output, stderr=subprocess.STDOUT, close_fds=True)
+	except OSError, e:
+		output.close()
+		return 127, [str(e)]
+	
+	if running is not None:
+		running.append(proc)
+	
+	deadline = time.time() + timeout
+	while proc.poll() is None and time.time() < deadline:
+		time.sleep(0.1)
+	
+	if proc.poll() is None:
+		try:
+			os.kill(proc.pid, signal.SIGKILL)
+		except OSError:
+			pass
+		proc.wait()
+		status = None
+	else:
+		status = proc.returncode
+	
+	if running is not None:
+		running.remove(proc)
+	
+	output.seek(0)
+	response = output.read()
+	output.close()
+	
+	return status, response.split('\n')
+
+
+def termSize(fd=1):
+	"""	Return the (rows, columns) of the terminal attached to fd, using the TIOCGWINSZ ioctl
+		instead of running stty. (24, 80) is returned when fd is not a terminal """
+	
+	try:
+		rows, columns = struct.unpack('hh', fcntl.ioctl(fd, termios.TIOCGWINSZ, '    '))
+	except (IOError, struct.error):
+		return 24, 80
+	
+	return (rows or 24), (columns or 80)
+
+
 #def oct2Tuple(dateOctet):
 #	""" This function call converts the SNMP datetime octet into a human readable
 #		tuple. 
@@ -95,6 +152,69 @@ def oct2DateTime(dateOctet):
 
 	return t
 		
+
+class QuantileSketch:
+	"""	Mergeable quantile sketch (log bucketed, as used by DDSketch). Values are counted in 
+		buckets whose bounds grow geometrically, so any quantile is returned within the given
+		relative accuracy, and memory depends on the range of the values, not how many are added.
+		Sketches built separately (e.g. per node) can be merged to give the combined distribution 
+	"""
+	
+	def __init__(self, accuracy=0.01):
+		
+		self.gamma = (1 + accuracy) / (1 - accuracy)
+		self.logGamma = math.log(self.gamma)
+		self.buckets = {}								# bucket index -> count
+		self.zeros = 0									# values <= 0 are counted here
+		self.count = 0
+		self.max = None
+		
+	def add(self, value, count=1, peak=None):
+		"""	Add a value, count times. When the value is an average of several samples, peak is the
+			largest of them - it's kept as the max instead of the average """
+		
+		if peak is None or peak < value:
+			peak = value
+		self.count += count
+		if self.max is None or peak > self.max:
+			self.max = peak
+			
+		if value <= 0:
+			self.zeros += count
+		else:
+			idx = int(math.ceil(math.log(value) / self.logGamma))
+			self.buckets[idx] = self.buckets.get(idx, 0) + count
+			
+	def merge(self, other):
+		"""	Add the contents of another sketch (of the same accuracy) to this one """
+		
+		for idx, count in other.buckets.items():
+			self.buckets[idx] = self.buckets.get(idx, 0) + count
+		self.zeros += other.zeros
+		self.count += other.count
+		if other.max is not None and (self.max is None or other.max > self.max):
+			self.max = other.max
+		
+	def quantile(self, q):
+		"""	Return the estimated value at quantile q (0..1), 0 when the sketch is empty """
+		
+		if self.count == 0:
+			return 0
+		
+		rank = q * (self.count - 1)
+		seen = self.zeros
+		if rank < seen:
+			return 0
+			
+		for idx in sorted(self.buckets):
+			seen += self.buckets[idx]
+			if rank < seen:
+				# use the mid point of the bucket, but never report more than the real max
+				return min(2 * math.pow(self.gamma, idx) / (self.gamma + 1), self.max)
+				
+		return self.max
+
+
 #>> import datetime
 #>> a = datetime.datetime.now()
 #>> b = datetime.datetime.now()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+#	gtop - tests for the gtop_agent datagram ordering
+#
+#	python -m unittest discover tests
+#
+
+import os
+import sys
+import socket
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gtop_agent
+from gtop_agent import AgentListener, encodeNode, decodeNode, sign, SEQMOD
+
+
+class Node:
+
+	def __init__(self, hostName):
+
+		self.hostName = hostName
+		self.state = 'connected'
+		self.hostActive = True
+		self.coreSaturated = False
+		self.timeStamp = None
+		self.errMsg = ''
+		for attr in gtop_agent.INTATTRS + gtop_agent.FLOATATTRS:
+			setattr(self, attr, 0)
+		self.ctdb = self.samba = self.nfs = self.selfHeal = self.georep = '.'
+		self.coreLoads, self.nicStats, self.daemonStats = [], [], []
+		self.brickInfo, self.brickIO, self.brickDevices, self.brickPorts, self.brickClients = {}, {}, {}, {}, {}
+
+
+class AgentListenerTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.listener = AgentListener('127.0.0.1:0', ['localhost'], key='secret', resync=15)
+		self.address = self.listener.sock.getsockname()
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.node = Node('localhost')
+
+	def tearDown(self):
+
+		self.listener.close()
+		self.sock.close()
+
+	def send(self, session, sequence, cpu=0, key='secret'):
+
+		self.node.cpuBusyPct = cpu
+		self.sock.sendto(sign(encodeNode(self.node, session, sequence), key), self.address)
+
+	def receive(self):
+
+		time.sleep(0.05)
+		return [state['cpuBusyPct'] for host, state in self.listener.poll()]
+
+	def testRoundTrip(self):
+
+		self.node.brickInfo = {'localhost:/bricks/b1' : [100, 50]}
+		sender, session, sequence, state = decodeNode(encodeNode(self.node, 7, 9))
+		self.assertEqual((sender, session, sequence), ('localhost', 7, 9))
+		self.assertEqual(state['brickInfo'], {'localhost:/bricks/b1' : [100, 50]})
+
+	def testOrderingIgnoresTheClock(self):
+
+		self.node.timeStamp = None
+		self.send(1, 10, cpu=10)
+		self.send(1, 9, cpu=9)								# late
+		self.send(1, 11, cpu=11)
+		self.assertEqual(self.receive(), [10, 11])
+
+	def testReplayDropped(self):
+
+		self.send(1, 5, cpu=5)
+		self.assertEqual(self.receive(), [5])
+		self.send(1, 5, cpu=5)
+		self.assertEqual(self.receive(), [])
+		self.assertTrue(self.listener.dropped >= 1)
+
+	def testUnsignedDropped(self):
+
+		self.send(1, 1, cpu=1, key='wrong')
+		self.assertEqual(self.receive(), [])
+
+	def testWrap(self):
+
+		self.send(1, SEQMOD - 1, cpu=1)
+		self.send(1, 0, cpu=2)
+		self.send(1, 1, cpu=3)
+		self.assertEqual(self.receive(), [1, 2, 3])
+
+	def testAgentRestart(self):
+
+		self.send(1, 1000, cpu=1)
+		self.send(2, 1, cpu=2)								# new session starts counting again
+		self.send(2, 2, cpu=3)
+		self.assertEqual(self.receive(), [1, 2, 3])
+
+	def testResyncAfterGap(self):
+
+		self.send(1, 1000, cpu=1)
+		self.assertEqual(self.receive(), [1])
+		self.listener.lastSeq['localhost'][2] -= 16			# not heard from for longer than resync
+		self.send(1, 10, cpu=2)
+		self.assertEqual(self.receive(), [2])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+#
+#	gtop - tests for gtop_heal, run against a synthetic brick directory tree
+#
+#	python -m unittest discover tests
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gtop_heal
+from gtop_heal import BrickBacklog, HealScanner, DirectoryReader, XATTROP
+
+
+def makeBrick(root, name, pending):
+	"""	Create a brick with an xattrop index holding the base file and pending gfid entries """
+
+	path = os.path.join(root, name)
+	indexDir = os.path.join(path, XATTROP)
+	os.makedirs(indexDir)
+	open(os.path.join(indexDir, 'xattrop-0a1b2c3d-0000-0000-0000-000000000000'), 'w').close()
+	addEntries(indexDir, 0, pending)
+	return path
+
+
+def addEntries(indexDir, start, count):
+
+	for n in range(start, start + count):
+		open(os.path.join(indexDir, '%08x-0000-0000-0000-%012x' % (n, n)), 'w').close()
+
+
+def removeEntries(indexDir, count):
+
+	names = sorted([name for name in os.listdir(indexDir) if not name.startswith('xattrop-')])
+	for name in names[:count]:
+		os.unlink(os.path.join(indexDir, name))
+
+
+def touch(path, mtime):
+	os.utime(path, (mtime, mtime))
+
+
+class DirectoryReaderTest(unittest.TestCase):
+
+	def setUp(self):
+		self.root = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def testNames(self):
+
+		addEntries(self.root, 0, 300)
+		self.assertEqual(sorted(DirectoryReader(self.root)), sorted(os.listdir(self.root)))
+
+	def testMissing(self):
+		self.assertRaises(OSError, DirectoryReader, os.path.join(self.root, 'missing'))
+
+
+class BrickBacklogTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.root = tempfile.mkdtemp()
+		self.brick = makeBrick(self.root, 'brick1', 1000)
+		self.indexDir = os.path.join(self.brick, XATTROP)
+		touch(self.indexDir, 1000)
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def count(self, backlog, now):
+		"""	Run a complete count, one CHECKEVERY slice per step, returning the number of steps """
+
+		self.assertTrue(backlog.start(now))
+		steps = 1
+		while not backlog.step(0):						# deadline already passed - stop at each check
+			steps += 1
+		return steps
+
+	def testResumesAcrossSlices(self):
+
+		backlog = BrickBacklog(self.brick)
+		self.assertTrue(backlog.start(100))
+		self.assertFalse(backlog.step(0))
+		self.assertTrue(gtop_heal.CHECKEVERY - 1 <= backlog.partial <= gtop_heal.CHECKEVERY)	# less the base file
+		self.assertEqual(backlog.pending, None)		# nothing published until the count completes
+
+		steps = 1
+		while not backlog.step(0):
+			steps += 1
+		self.assertEqual(backlog.pending, 1000)
+		self.assertEqual(steps, 1001 // gtop_heal.CHECKEVERY)	# 1000 entries and the base file
+
+	def testUnchangedIndexIsNotRead(self):
+
+		backlog = BrickBacklog(self.brick)
+		self.count(backlog, 100)
+
+		def unexpected(path):
+			raise AssertionError("index read although it's mtime is unchanged")
+		saved, gtop_heal.indexEntries = gtop_heal.indexEntries, unexpected
+		try:
+			self.assertFalse(backlog.start(110))
+		finally:
+			gtop_heal.indexEntries = saved
+		self.assertEqual(backlog.pending, 1000)
+		self.assertEqual(backlog.rate, 0)
+
+	def testDrainRate(self):
+
+		backlog = BrickBacklog(self.brick)
+		self.count(backlog, 100)
+
+		removeEntries(self.indexDir, 500)					# heals completing - positive rate
+		touch(self.indexDir, 2000)
+		self.count(backlog, 110)
+		self.assertEqual(backlog.pending, 500)
+		self.assertAlmostEqual(backlog.rate, 50.0)
+
+		addEntries(self.indexDir, 5000, 200)				# backlog growing - negative rate
+		touch(self.indexDir, 3000)
+		self.count(backlog, 120)
+		self.assertEqual(backlog.pending, 700)
+		self.assertAlmostEqual(backlog.rate, -20.0)
+
+	def testMissingIndex(self):
+
+		backlog = BrickBacklog(os.path.join(self.root, 'nobrick'))
+		self.assertFalse(backlog.start(100))
+		self.assertEqual(backlog.pending, None)
+
+
+class HealScannerTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.root = tempfile.mkdtemp()
+		self.bricks = [makeBrick(self.root, 'brick1', 600), makeBrick(self.root, 'brick2', 400)]
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+
+	def testVolumeTotals(self):
+
+		class Volume:
+			def __init__(self, name):
+				self.name = name
+
+		scanner = HealScanner({'vol1' : self.bricks}, interval=5, timeSlice=0)
+		passes = 0
+		while passes == 0 or scanner.queue:
+			scanner.service()							# a slice per pass of the main loop
+			passes += 1
+		self.assertTrue(passes > 1)
+
+		volumes = [Volume('vol1'), Volume('vol2')]
+		scanner.update(volumes)
+		self.assertEqual(volumes[0].healPending, 1000)
+		self.assertEqual(volumes[1].healPending, None)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+#
+#	gtop - tests for the gtop_iputils SNMPv2c client, against a local udp agent stand-in
+#
+#	python -m unittest discover tests
+#
+
+import os
+import sys
+import socket
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gtop_iputils import *
+
+
+def oidOrder(oid):
+	return [int(arc) for arc in oid.split('.')]
+
+
+class StandInAgent(threading.Thread):
+	"""	Answers GET and GETBULK requests from a fixed MIB of (oid, value, tag), using the client's
+		own encoder. drop is the number of requests to ignore before answering """
+
+	def __init__(self, mib, delay=0, drop=0):
+
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.mib = sorted(mib, key=lambda row: oidOrder(row[0]))
+		self.delay = delay
+		self.drop = drop
+		self.requests = 0
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.bind(('127.0.0.1', 0))
+		self.sock.settimeout(0.2)
+		self.stopped = threading.Event()
+		self.host = '127.0.0.1:' + str(self.sock.getsockname()[1])
+
+	def answer(self, pduType, varbinds, maxRepetitions):
+
+		values = dict([(oid, (value, tag)) for oid, value, tag in self.mib])
+		out = []
+		for oid, value in varbinds:
+			if pduType == GETREQUEST:
+				out.append((oid,) + values[oid] if oid in values else (oid, None, NOSUCHOBJECT))
+			else:
+				following = [row for row in self.mib if oidOrder(row[0]) > oidOrder(oid)][:maxRepetitions]
+				out.extend(following)
+				if len(following) < maxRepetitions:
+					out.append((oid, None, ENDOFMIBVIEW))
+		return out
+
+	def run(self):
+
+		while not self.stopped.isSet():
+			try:
+				data, source = self.sock.recvfrom(65535)
+			except socket.timeout:
+				continue
+			self.requests += 1
+			if self.drop:
+				self.drop -= 1
+				continue
+			community, pduType, requestId, field1, field2, varbinds = decodeMessage(data)
+			time.sleep(self.delay)
+			self.sock.sendto(encodeMessage(community, RESPONSE, requestId, self.answer(pduType, varbinds, field2)), source)
+
+	def stop(self):
+
+		self.stopped.set()
+		self.join()
+		self.sock.close()
+
+
+MIB = [('1.3.6.1.2.1.1.1.0', 'Linux node1 ' + 'x' * 300, OCTETSTRING),		# long-form length
+		('1.3.6.1.4.1.99.1.1', 2**40 + 5, COUNTER64),
+		('1.3.6.1.4.1.99.1.2', 4000000000, GAUGE32),
+		('1.3.6.1.4.1.99.1.3', -7, INTEGER),
+		('1.3.6.1.4.1.99.1.4', '10.0.0.1', IPADDRESS)] + \
+		[('1.3.6.1.4.1.99.2.' + str(n), n, COUNTER32) for n in range(1, 151)] + \
+		[('1.3.6.1.4.1.99.3.1', 1, INTEGER)]						# just past the walked subtree
+
+
+class EncodingTest(unittest.TestCase):
+
+	def roundTrip(self, value, tag):
+
+		encoded = encodeValue(value, tag)
+		valueTag, start, end = decodeTLV(encoded, 0)
+		self.assertEqual(valueTag, tag)
+		self.assertEqual(end, len(encoded))
+		return decodeValue(valueTag, encoded[start:end])
+
+	def testIntegers(self):
+
+		for value in (0, 1, 127, 128, 255, 256, 65535, 2**31 - 1, -1, -128, -129, -2**31):
+			self.assertEqual(self.roundTrip(value, INTEGER), value)
+
+	def testUnsigned(self):
+
+		for value in (0, 128, 2**32 - 1):
+			self.assertEqual(self.roundTrip(value, COUNTER32), value)
+			self.assertEqual(self.roundTrip(value, GAUGE32), value)
+		for value in (2**63, 2**64 - 1):
+			self.assertEqual(self.roundTrip(value, COUNTER64), value)
+
+	def testOctetString(self):
+
+		self.assertEqual(self.roundTrip('', OCTETSTRING), '')
+		self.assertEqual(self.roundTrip('gluster', OCTETSTRING), 'gluster')
+
+	def testLongFormLength(self):
+
+		for size in (127, 128, 255, 256, 70000):
+			encoded = encodeValue('y' * size, OCTETSTRING)
+			self.assertEqual(decodeTLV(encoded, 0), (OCTETSTRING, len(encoded) - size, len(encoded)))
+		self.assertEqual(berLength(127), '\x7f')
+		self.assertEqual(berLength(128), '\x81\x80')
+		self.assertEqual(berLength(256), '\x82\x01\x00')
+
+	def testExceptions(self):
+
+		self.assertEqual(self.roundTrip(None, NOSUCHOBJECT), None)
+		self.assertEqual(self.roundTrip(None, NOSUCHINSTANCE), None)
+		self.assertTrue(self.roundTrip(None, ENDOFMIBVIEW) is endOfMibView)
+
+	def testOID(self):
+
+		for oid in ('1.3.6.1.4.1.2021.13.15.1.1.2.268435455', '2.999.3', '0.0'):
+			encoded = encodeOID(oid)
+			tag, start, end = decodeTLV(encoded, 0)
+			self.assertEqual(decodeOID(encoded[start:end]), oid)
+
+	def testMessage(self):
+
+		data = encodeMessage('gluster', RESPONSE, 1234, [('1.3.6.1.2.1.1.3.0', 99, TIMETICKS), ('1.3.6.1.9', None, NOSUCHINSTANCE)])
+		self.assertEqual(decodeMessage(data), ('gluster', RESPONSE, 1234, 0, 0, [('1.3.6.1.2.1.1.3.0', 99), ('1.3.6.1.9', None)]))
+
+	def testTruncated(self):
+
+		data = encodeMessage('gluster', RESPONSE, 1, [('1.3.6.1.2.1.1.1.0', 'x', OCTETSTRING)])
+		self.assertRaises(SNMPError, decodeMessage, data[:-3])
+		self.assertRaises(SNMPError, decodeMessage, '\x30\x05\x02')
+
+
+class AsyncSNMPTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.agents = []
+		self.client = AsyncSNMP(community='gluster', timeout=0.3, retries=1)
+
+	def tearDown(self):
+
+		self.client.close()
+		for agent in self.agents:
+			agent.stop()
+
+	def agent(self, **kw):
+
+		agent = StandInAgent(MIB, **kw)
+		agent.start()
+		self.agents.append(agent)
+		return agent.host
+
+	def testTypedGet(self):
+
+		host = self.agent()
+		request = self.client.get(host, ['1.3.6.1.2.1.1.1.0', '1.3.6.1.4.1.99.1.1', '1.3.6.1.4.1.99.1.2',
+											'1.3.6.1.4.1.99.1.3', '1.3.6.1.4.1.99.1.4', '1.3.6.1.9'])
+		self.client.wait([request])
+		self.assertEqual(request.error, '')
+		self.assertEqual([value for oid, value in request.varbinds],
+							[MIB[0][1], 2**40 + 5, 4000000000, -7, '10.0.0.1', None])
+
+	def testRequestsInFlightTogether(self):
+
+		hosts = [self.agent(delay=0.2) for n in range(3)]
+		start = time.time()
+		requests = [self.client.get(host, ['1.3.6.1.4.1.99.1.3']) for host in hosts]
+		self.client.wait(requests)
+		self.assertTrue(time.time() - start < 0.5)			# not 3 x 0.2s one after another
+		self.assertEqual([request.varbinds for request in requests], [[('1.3.6.1.4.1.99.1.3', -7)]] * 3)
+
+	def testRetryAndTimeout(self):
+
+		retried = self.agent(drop=1)
+		silent = self.agent(drop=10)
+		requests = [self.client.get(retried, ['1.3.6.1.4.1.99.1.3']), self.client.get(silent, ['1.3.6.1.4.1.99.1.3'])]
+		self.client.wait(requests)
+		self.assertEqual(requests[0].error, '')
+		self.assertEqual(requests[1].error, 'timeout')
+
+	def testPipelinedWalk(self):
+
+		hosts = [self.agent(), self.agent(delay=0.05)]
+		results = self.client.walk(hosts, '1.3.6.1.4.1.99.2', maxRepetitions=40)
+		for host in hosts:
+			self.assertEqual(results[host], [('1.3.6.1.4.1.99.2.' + str(n), n) for n in range(1, 151)])
+
+	def testWalkToEndOfMibView(self):
+
+		host = self.agent()
+		results = self.client.walk([host], '1.3.6.1.4.1.99.3', maxRepetitions=10)
+		self.assertEqual(results[host], [('1.3.6.1.4.1.99.3.1', 1)])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#
+#	gtop - tests for the gtop_profile volume profile panel, against a stub gluster cli
+#
+#	python -m unittest discover tests
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gtop_profile import ProfileCollector, parseProfile, parseTop
+
+# recorded 'gluster volume profile vol1 info' - two bricks, each with cumulative and interval stats
+PROFILEINFO = """Brick: server1:/bricks/b1
+-------------------------
+Cumulative Stats:
+   Block Size:               4096b+                8192b+
+ No. of Reads:                   10                     2
+No. of Writes:                  100                    20
+ %-latency   Avg-latency   Min-Latency   Max-Latency   No. of calls         Fop
+ ---------   -----------   -----------   -----------   ------------        ----
+      0.00       0.00 us       0.00 us       0.00 us             12     RELEASE
+     34.78      20.00 us      10.00 us      50.00 us            100      LOOKUP
+     65.22     150.00 us      30.00 us     900.00 us             50       WRITE
+
+    Duration: 3600 seconds
+   Data Read: 45056 bytes
+Data Written: 573440 bytes
+
+Interval 7 Stats:
+ %-latency   Avg-latency   Min-Latency   Max-Latency   No. of calls         Fop
+ ---------   -----------   -----------   -----------   ------------        ----
+    100.00    5000.00 us    5000.00 us    9000.00 us           9999      LOOKUP
+
+    Duration: 60 seconds
+   Data Read: 0 bytes
+Data Written: 0 bytes
+
+Brick: server2:/bricks/b2
+-------------------------
+Cumulative Stats:
+ %-latency   Avg-latency   Min-Latency   Max-Latency   No. of calls         Fop
+ ---------   -----------   -----------   -----------   ------------        ----
+     92.31      40.00 us      20.00 us      70.00 us            300      LOOKUP
+      7.69     100.00 us      60.00 us     400.00 us             10       WRITE
+
+    Duration: 3600 seconds
+   Data Read: 0 bytes
+Data Written: 40960 bytes
+
+Interval 7 Stats:
+ %-latency   Avg-latency   Min-Latency   Max-Latency   No. of calls         Fop
+ ---------   -----------   -----------   -----------   ------------        ----
+    100.00    8000.00 us    8000.00 us    8000.00 us            777       WRITE
+
+    Duration: 60 seconds
+   Data Read: 0 bytes
+Data Written: 0 bytes
+
+"""
+
+# recorded 'gluster volume top vol1 read list-cnt 3'
+TOPREAD = """Brick: server1:/bricks/b1
+Count		filename
+=======================
+120		/dir/a.txt
+30		/b.log
+Brick: server2:/bricks/b2
+Count		filename
+=======================
+80		/dir/a.txt
+50		/c dat
+"""
+
+TOPWRITE = """Brick: server1:/bricks/b1
+Count		filename
+=======================
+7		/b.log
+"""
+
+# the stub gluster cli - prints the recording for the command, and hangs for volume 'hung'
+STUB = """import os, sys, time
+args = sys.argv[1:]
+if 'hung' in args:
+	time.sleep(60)
+name = os.path.join(os.path.dirname(os.path.abspath(__file__)), '-'.join(args[:4]))
+if not os.path.exists(name):
+	print 'Volume ' + args[2] + ' does not exist'
+	sys.exit(1)
+sys.stdout.write(open(name).read())
+"""
+
+
+class ParseTest(unittest.TestCase):
+
+	def testProfileMergesCumulativeStats(self):
+
+		rows = parseProfile(PROFILEINFO.split('\n'))
+		self.assertEqual([row[:2] for row in rows], [['LOOKUP', 400], ['WRITE', 60], ['RELEASE', 12]])
+
+		lookup, write, release = rows
+		self.assertAlmostEqual(lookup[2], 35.0)						# (100 * 20 + 300 * 40) / 400
+		self.assertEqual(lookup[3], 70.0)
+		self.assertAlmostEqual(write[2], 8500.0 / 60)
+		self.assertEqual(write[3], 900.0)
+		self.assertAlmostEqual(lookup[4] + write[4], 100.0)
+		self.assertAlmostEqual(lookup[4], 14000 * 100.0 / 22500)
+		self.assertEqual(release[2:], [0, 0.0, 0])
+
+	def testTopMergesBricks(self):
+
+		self.assertEqual(parseTop(TOPREAD.split('\n'), 'read', 3),
+							[['read', 200, '/dir/a.txt'], ['read', 50, '/c dat'], ['read', 30, '/b.log']])
+		self.assertEqual(parseTop(TOPREAD.split('\n'), 'read', 1), [['read', 200, '/dir/a.txt']])
+
+
+class ProfileCollectorTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.dir = tempfile.mkdtemp()
+		stub = os.path.join(self.dir, 'gluster')
+		open(stub, 'w').write(STUB)
+		for name, output in [('volume-profile-vol1-info', PROFILEINFO), ('volume-top-vol1-read', TOPREAD),
+								('volume-top-vol1-write', TOPWRITE)]:
+			open(os.path.join(self.dir, name), 'w').write(output)
+
+		self.command = sys.executable + ' ' + stub
+
+	def tearDown(self):
+
+		shutil.rmtree(self.dir)
+
+	def testCollect(self):
+
+		collector = ProfileCollector(['vol1'], self.command, timeout=10)
+		profile = collector.collect('vol1')
+
+		self.assertEqual(profile.error, '')
+		self.assertEqual([row[:2] for row in profile.fops], [['LOOKUP', 400], ['WRITE', 60], ['RELEASE', 12]])
+		self.assertEqual(profile.topFiles, [['read', 200, '/dir/a.txt'], ['read', 50, '/c dat'], ['read', 30, '/b.log'],
+											['write', 7, '/b.log']])
+
+	def testCliError(self):
+
+		profile = ProfileCollector(['nosuch'], self.command).collect('nosuch')
+		self.assertEqual(profile.error, 'Volume nosuch does not exist')
+		self.assertEqual(profile.fops, [])
+
+	def testHungCliKilled(self):
+
+		collector = ProfileCollector(['vol1', 'hung'], self.command, interval=60, timeout=0.5)
+		collector.enable()
+
+		deadline = time.time() + 10
+		while 'hung' not in collector.cache and time.time() < deadline:
+			time.sleep(0.1)
+		collector.stop()
+
+		self.assertEqual(collector.cache['vol1'].error, '')
+		self.assertTrue('timed out' in collector.cache['hung'].error)
+		self.assertEqual(collector.running, [])
+
+
+if __name__ == '__main__':
+	unittest.main()
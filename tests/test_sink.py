@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+#	gtop - tests for the gtop_sink Graphite/StatsD sender, against local listener stand-ins
+#
+#	python -m unittest discover tests
+#
+
+import os
+import sys
+import socket
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gtop_sink import MetricSink
+
+
+def metricLines(count, tickTime=1000):
+	"""	Graphite lines of varying lengths, as MetricSink.lines() would build them """
+
+	return ['gtop.nodes.node' + str(n) + '.' + 'x' * (n % 17) + ' ' + str(n) + ' ' + str(tickTime) for n in range(count)]
+
+
+def fixedLines(sink, lines):
+	"""	Have the sink send the given lines each tick, rather than building them from a cluster """
+
+	sink.lines = lambda tickTime, cluster, blockSize: lines
+	return sink
+
+
+def unusedPort(sockType):
+	"""	Return a local port with nothing bound to it """
+
+	sock = socket.socket(socket.AF_INET, sockType)
+	sock.bind(('127.0.0.1', 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+
+class UDPSinkTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.listener.bind(('127.0.0.1', 0))
+		self.listener.settimeout(0.5)
+		self.target = 'statsd://127.0.0.1:' + str(self.listener.getsockname()[1])
+
+	def tearDown(self):
+
+		self.listener.close()
+
+	def testDatagramsFitTheMTU(self):
+
+		lines = metricLines(200)
+		sink = MetricSink(self.target, mtu=256)
+		datagrams = list(sink.datagrams(lines))
+		sink.close()
+
+		self.assertTrue(len(datagrams) > 1)
+		for datagram in datagrams:
+			self.assertTrue(len(datagram) <= 256)
+			self.assertTrue(datagram.endswith('\n'))
+		self.assertEqual(''.join(datagrams).splitlines(), lines)
+
+	def testTickSendsWholeLines(self):
+
+		lines = metricLines(100)
+		sink = fixedLines(MetricSink(self.target, mtu=300), lines)
+		sink.tick(1000, None, 1024)
+		sink.close()
+
+		received = []
+		while len(received) < len(lines):
+			datagram = self.listener.recv(65536)
+			self.assertTrue(len(datagram) <= 300)
+			received.extend(datagram.splitlines())
+		self.assertEqual(received, lines)
+		self.assertEqual(sink.dropped, 0)
+
+	def testNothingListening(self):
+
+		lines = metricLines(5)
+		sink = fixedLines(MetricSink('statsd://127.0.0.1:' + str(unusedPort(socket.SOCK_DGRAM))), lines)
+		sink.tick(1000, None, 1024)
+		time.sleep(0.1)										# let the port unreachable come back
+		sink.tick(1005, None, 1024)							# ECONNREFUSED from the first send
+		sink.close()
+
+		self.assertEqual(sink.dropped, len(lines))
+
+
+class TCPSinkTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.listener.bind(('127.0.0.1', 0))
+		self.listener.listen(1)
+		self.listener.settimeout(1)
+		self.target = 'graphite://127.0.0.1:' + str(self.listener.getsockname()[1])
+
+	def tearDown(self):
+
+		self.listener.close()
+
+	def testTickIsOneWrite(self):
+
+		lines = metricLines(50)
+		sink = fixedLines(MetricSink(self.target), lines)
+		conn, address = self.listener.accept()				# the connect has completed
+		conn.settimeout(1)
+
+		writes = []
+		send = sink.sock.send
+		def countedSend(data):
+			writes.append(data)
+			return send(data)
+		sink.sock.send = countedSend
+
+		sink.tick(1000, None, 1024)
+		self.assertTrue(sink.connected)
+		self.assertEqual(writes, ['\n'.join(lines) + '\n'])
+		self.assertEqual(sink.pending, '')
+
+		received = ''
+		while len(received) < len(writes[0]):
+			received += conn.recv(65536)
+		self.assertEqual(received.splitlines(), lines)
+		conn.close()
+		sink.close()
+
+	def testQueueLimit(self):
+
+		lines = metricLines(50)
+		sink = fixedLines(MetricSink(self.target, maxQueue=len('\n'.join(lines))), lines)
+		sink.tick(1000, None, 1024)
+		sink.close()
+
+		self.assertEqual(sink.dropped, len(lines))
+		self.assertEqual(sink.pending, '')
+
+	def testNothingListening(self):
+
+		lines = metricLines(5)
+		sink = fixedLines(MetricSink('graphite://127.0.0.1:' + str(unusedPort(socket.SOCK_STREAM))), lines)
+		sink.tick(1000, None, 1024)							# refused, now or when the connect completes
+		deadline = time.time() + 1
+		while sink.sock and time.time() < deadline:
+			time.sleep(0.01)
+			sink.service()
+		self.assertEqual(sink.sock, None)
+		self.assertTrue(sink.retryTime > time.time())
+
+		sink.tick(1005, None, 1024)							# still inside retryTime
+		sink.close()
+		self.assertEqual(sink.dropped, 2 * len(lines))
+
+
+if __name__ == '__main__':
+	unittest.main()